@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+#
+# Synthetic inputs for benchmarking the Daily Bulletin Build System
+# Copyright (C) 2024 Runxi Yu <https://runxiyu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# The generators mimic the layouts the parsers expect: the Sodexo menu with
+# station names in merged cells down column B, and The Week Ahead with the
+# community time table on page 2 and the AODs on the last page.
+#
+
+from __future__ import annotations
+import datetime
+import io
+import json
+import os
+import random
+
+import openpyxl
+from openpyxl.worksheet.worksheet import Worksheet
+import pptx
+import pptx.util
+import PIL.Image
+
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
+BREAKFAST_STATIONS = [
+    "Taste of Asia",
+    "Eat Global",
+    "Revolution Noodle",
+    "Piccola Italia",
+    "Self Pick-up",
+    "Fruit/Drink",
+]
+MAIN_MEAL_STATIONS = [
+    "Taste of Asia",
+    "Eat Global",
+    "Revolution Noodle",
+    "Piccola Italia",
+    "Vegetarian",
+    "Daily Soup",
+    "Dessert/Fruit/Drink",
+]
+COMMUNITY_TIME_ACTIVITIES = [
+    "Whole School Assembly",
+    "Tutor group check-in",
+    "House Meeting",
+    "Clubs",
+    "Year Group Assembly",
+]
+
+
+def dish(rng: random.Random) -> str:
+    return "%s %s\n%s" % (
+        rng.choice(["Braised", "Roasted", "Steamed", "Stir-fried", "Grilled"]),
+        rng.choice(["Chicken", "Tofu", "Beef", "Fish", "Broccoli", "Noodles"]),
+        rng.choice(["红烧鸡", "烤豆腐", "清蒸鱼", "炒面", "西兰花"]),
+    )
+
+
+def write_meal_table(
+    ws: Worksheet,
+    row: int,
+    meal: str,
+    stations: list[str],
+    rows_per_station: int,
+    rng: random.Random,
+) -> int:
+    ws.cell(row=row, column=2, value=meal)
+    for column, weekday in enumerate(WEEKDAYS, start=3):
+        ws.cell(row=row + 1, column=column, value=weekday)
+    row += 2
+    for station in stations:
+        ws.cell(row=row, column=2, value=station)
+        if rows_per_station > 1:
+            ws.merge_cells(
+                start_row=row,
+                start_column=2,
+                end_row=row + rows_per_station - 1,
+                end_column=2,
+            )
+        for offset in range(rows_per_station):
+            for column in range(3, 8):
+                ws.cell(row=row + offset, column=column, value=dish(rng))
+        row += rows_per_station
+    return row + 1
+
+
+def generate_menu_xlsx(filename: str, rows_per_station: int = 3, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    assert isinstance(ws, Worksheet)
+    ws.title = "菜单"
+    row = 1
+    row = write_meal_table(
+        ws, row, "BREAKFAST 早餐", BREAKFAST_STATIONS, rows_per_station, rng
+    )
+    row = write_meal_table(
+        ws, row, "LUNCH 午餐", MAIN_MEAL_STATIONS, rows_per_station, rng
+    )
+    row = write_meal_table(
+        ws, row, "DINNER 晚餐", MAIN_MEAL_STATIONS, rows_per_station, rng
+    )
+    ws.cell(row=row, column=2, value="Students Snack 学生点心")
+    for column, weekday in enumerate(WEEKDAYS, start=3):
+        ws.cell(row=row + 1, column=column, value=weekday)
+    for offset in range(2, 5):
+        for column in range(3, 8):
+            ws.cell(row=row + offset, column=column, value=dish(rng))
+    wb.save(filename)
+
+
+def random_jpeg(width: int, height: int, rng: random.Random) -> io.BytesIO:
+    image = PIL.Image.frombytes(
+        "RGB", (width, height), rng.randbytes(width * height * 3)
+    )
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    buffer.seek(0)
+    return buffer
+
+
+def generate_week_ahead_pptx(
+    filename: str,
+    photo_slides: int = 10,
+    photo_size: tuple[int, int] = (1600, 1200),
+    seed: int = 0,
+) -> None:
+    rng = random.Random(seed)
+    prs = pptx.Presentation()
+    blank = prs.slide_layouts[6]
+    title_only = prs.slide_layouts[5]
+
+    for page in range(2):
+        slide = prs.slides.add_slide(title_only)
+        slide.shapes.title.text = "The Week Ahead, page %d" % page
+
+    slide = prs.slides.add_slide(title_only)
+    slide.shapes.title.text = "Community Time"
+    table = slide.shapes.add_table(
+        6,
+        5,
+        pptx.util.Inches(0.5),
+        pptx.util.Inches(1.5),
+        pptx.util.Inches(9),
+        pptx.util.Inches(5),
+    ).table
+    for column, year in enumerate(["", "Y9", "Y10", "Y11", "Y12"]):
+        table.cell(0, column).text = year
+    for row, weekday in enumerate(WEEKDAYS, start=1):
+        table.cell(row, 0).text = weekday[:3]
+        for column in range(1, 5):
+            table.cell(row, column).text = rng.choice(COMMUNITY_TIME_ACTIVITIES)
+    table.cell(1, 1).merge(table.cell(1, 4))
+    table.cell(1, 1).text = "Whole School Assembly"
+    table.cell(3, 1).merge(table.cell(3, 2))
+    table.cell(3, 1).text = "Tutor group check-in"
+
+    for page in range(photo_slides):
+        slide = prs.slides.add_slide(blank)
+        slide.shapes.add_picture(
+            random_jpeg(*photo_size, rng),
+            pptx.util.Inches(0),
+            pptx.util.Inches(0),
+            width=prs.slide_width,
+        )
+
+    slide = prs.slides.add_slide(blank)
+    textbox = slide.shapes.add_textbox(
+        pptx.util.Inches(1),
+        pptx.util.Inches(1),
+        pptx.util.Inches(8),
+        pptx.util.Inches(4),
+    )
+    textbox.text_frame.text = "\n".join(
+        "%s: Announcement of the day for %s" % (weekday, weekday)
+        for weekday in WEEKDAYS[:4]
+    )
+    prs.save(filename)
+
+
+def generate_week_json(filename: str, start_date: datetime.date, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    menu = {
+        meal: {
+            weekday[:3]: {station: [dish(rng), dish(rng)] for station in stations}
+            for weekday in WEEKDAYS
+        }
+        for meal, stations in [
+            ("Breakfast", BREAKFAST_STATIONS),
+            ("Lunch", MAIN_MEAL_STATIONS),
+            ("Dinner", MAIN_MEAL_STATIONS),
+        ]
+    }
+    with open(filename, "w", encoding="utf-8") as fd:
+        json.dump(
+            {
+                "start_date": start_date.isoformat(),
+                "community_time": [
+                    [rng.choice(COMMUNITY_TIME_ACTIVITIES) for _ in range(4)]
+                    for _ in WEEKDAYS
+                ],
+                "aods": ["AOD %s" % weekday for weekday in WEEKDAYS[:4]],
+                "menu": menu,
+                "snacks": {
+                    time_of_day: [dish(rng) for _ in WEEKDAYS]
+                    for time_of_day in ["Morning", "Afternoon", "Evening"]
+                },
+            },
+            fd,
+            ensure_ascii=False,
+            indent="\t",
+        )
+
+
+def generate_build_directory(
+    directory: str,
+    start_date: datetime.date,
+    inspirations: int = 2000,
+    approved_fraction: float = 0.01,
+    attachment_size: int = 200_000,
+    seed: int = 0,
+) -> None:
+    # Most inspirations are already used or still unapproved, as in a build
+    # directory that has been in service for a few terms.
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    generate_week_json(
+        os.path.join(directory, "week-%s.json" % start_date.strftime("%Y%m%d")),
+        start_date,
+        seed,
+    )
+    with open(os.path.join(directory, "cycles.json"), "w", encoding="utf-8") as fd:
+        json.dump(
+            {
+                (start_date + datetime.timedelta(days=d)).isoformat(): str(d + 1)
+                for d in range(5)
+            },
+            fd,
+        )
+    for number in range(inspirations):
+        status = rng.random()
+        used = status < 0.7
+        approved = used or status > 1 - approved_fraction
+        attachment = None
+        if approved and not used and rng.random() < 0.5:
+            attachment = "photo%d.jpg" % number
+            with open(os.path.join(directory, "inspattach-" + attachment), "wb") as fd:
+                fd.write(rng.randbytes(attachment_size))
+        with open(
+            os.path.join(directory, "inspire-%08d" % number), "w", encoding="utf-8"
+        ) as fd:
+            json.dump(
+                {
+                    "type": "media" if attachment else "text",
+                    "origin": "Someone %d" % number,
+                    "uname": "s%05d" % number,
+                    "text": "Inspiration number %d" % number,
+                    "file": attachment,
+                    "approved": approved,
+                    "used": used,
+                },
+                fd,
+                indent="\t",
+            )
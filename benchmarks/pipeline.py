@@ -0,0 +1,519 @@
+#!/usr/bin/env python3
+#
+# End-to-end pipeline benchmark for the Daily Bulletin Build System
+# Copyright (C) 2024 Runxi Yu <https://runxiyu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Run from the source directory:
+#     python3 -m benchmarks.pipeline
+#     python3 -m benchmarks.pipeline --latency 0.2 --throttle-rate 0.1
+#
+# Runs inspire_dl, weekly, and then daily, pack and sendmail for each day of
+# the week against a fake Graph server on localhost. Every request made
+# through common.request() is redirected to it, whatever its host, over real
+# sockets. The server adds latency to every response, answers a fraction of
+# requests with 429, and serves file bodies at a limited rate.
+#
+# The exit status is 1 if the run took longer than --deadline seconds.
+#
+
+from __future__ import annotations
+from typing import Any, Optional
+from configparser import ConfigParser
+import argparse
+import base64
+import datetime
+import email.message
+import http.server
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import requests
+import requests.adapters
+
+from sjdbmk import (
+    common,
+    daily,
+    graphreplay,
+    inspire_dl,
+    instrument,
+    metrics,
+    pack,
+    sendmail,
+    weekly,
+)
+
+from . import fixtures
+
+logger = logging.getLogger(__name__)
+
+SOURCE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARK_DATE = datetime.datetime(
+    2024, 10, 21, tzinfo=datetime.timezone(datetime.timedelta(hours=8))
+)
+MENU_SENDER = "menu@example.org"
+MENU_MESSAGE_ID = "menu-message"
+DECK_URL = "https://download.example.org/the_week_ahead.pptx?tempauth=benchmark"
+API_BASE = "https://sjdb.example.org/sjdb/"
+
+
+class FakeGraphServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        deck: bytes,
+        menu_message: bytes,
+        inspirations: dict[str, dict[str, Any]],
+        events: list[dict[str, Any]],
+        latency: float,
+        throttle_rate: float,
+        retry_after: float,
+        bytes_per_second: float,
+        seed: int = 0,
+    ) -> None:
+        super().__init__(("127.0.0.1", 0), FakeGraphHandler)
+        self.deck = deck
+        self.menu_message = menu_message
+        self.inspirations = inspirations
+        self.events = events
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.bytes_per_second = bytes_per_second
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.drafts = 0
+
+    def throttled(self) -> bool:
+        with self.lock:
+            return self.random.random() < self.throttle_rate
+
+    def new_draft_id(self) -> str:
+        with self.lock:
+            self.drafts += 1
+            return "draft-%d" % self.drafts
+
+
+class FakeGraphHandler(http.server.BaseHTTPRequestHandler):
+    # Keep-alive, so that connection reuse in the client shows up
+    protocol_version = "HTTP/1.1"
+    server: FakeGraphServer
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def reply(
+        self,
+        status: int,
+        body: bytes,
+        headers: Optional[dict[str, str]] = None,
+        slow: bool = False,
+    ) -> None:
+        self.send_response(status)
+        for name, value in (
+            {"Content-Type": "application/json"} | (headers or {})
+        ).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not slow or not self.server.bytes_per_second:
+            self.wfile.write(body)
+            return
+        chunk_size = max(int(self.server.bytes_per_second / 10), 1)
+        for start in range(0, len(body), chunk_size):
+            chunk = body[start : start + chunk_size]
+            time.sleep(len(chunk) / self.server.bytes_per_second)
+            self.wfile.write(chunk)
+
+    def reply_json(self, value: Any, status: int = 200) -> None:
+        self.reply(status, json.dumps(value).encode("utf-8"))
+
+    def do_GET(self) -> None:
+        self.handle_request("GET")
+
+    def do_POST(self) -> None:
+        self.handle_request("POST")
+
+    def handle_request(self, method: str) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        time.sleep(self.server.latency)
+        if self.server.throttled():
+            self.reply(
+                429,
+                b'{"error": {"code": "TooManyRequests"}}',
+                {"Retry-After": "%g" % self.server.retry_after},
+            )
+            return
+
+        path = urllib.parse.urlsplit(self.path).path
+        segments = path.strip("/").split("/")
+        if method == "POST" and path == "/v1.0/search/query":
+            self.reply_json(search_results())
+        elif method == "GET" and path == "/v1.0/me/messages/%s/$value" % (
+            MENU_MESSAGE_ID
+        ):
+            self.reply(
+                200, self.server.menu_message, {"Content-Type": "message/rfc822"}, True
+            )
+        elif method == "GET" and segments[:2] == ["v1.0", "shares"]:
+            self.reply_json({"@microsoft.graph.downloadUrl": DECK_URL})
+        elif method == "GET" and path == "/the_week_ahead.pptx":
+            self.reply_deck()
+        elif method == "GET" and segments[-2:] == ["calendarView", "delta"]:
+            self.reply_json(
+                {
+                    "value": self.server.events,
+                    "@odata.deltaLink": "https://graph.microsoft.com%s?$deltatoken=1"
+                    % path,
+                }
+            )
+        elif method == "POST" and path == "/v1.0/me/messages":
+            self.reply_json({"id": self.server.new_draft_id()}, 201)
+        elif method == "POST" and segments[:3] == ["v1.0", "me", "messages"]:
+            self.reply(202, b"")
+        elif method == "GET" and path == "/sjdb/rs":
+            self.reply_json(list(self.server.inspirations))
+        elif method == "GET" and segments[:2] == ["sjdb", "rs"]:
+            self.reply_json(self.server.inspirations[segments[2]])
+        else:
+            self.reply_json({"error": {"code": "itemNotFound"}}, 404)
+
+    def reply_deck(self) -> None:
+        deck = self.server.deck
+        range_header = self.headers.get("Range")
+        if not range_header:
+            self.reply(200, deck, {"Content-Type": "application/octet-stream"}, True)
+            return
+        first, _, last = range_header.removeprefix("bytes=").partition("-")
+        if first:
+            start = int(first)
+            end = min(int(last), len(deck) - 1) if last else len(deck) - 1
+        else:
+            start = max(len(deck) - int(last), 0)
+            end = len(deck) - 1
+        self.reply(
+            206,
+            deck[start : end + 1],
+            {
+                "Content-Type": "application/octet-stream",
+                "Content-Range": "bytes %d-%d/%d" % (start, end, len(deck)),
+            },
+            True,
+        )
+
+
+class ForwardingAdapter(requests.adapters.HTTPAdapter):
+    # Sends every request to the fake server, keeping the path and query
+    def __init__(self, port: int) -> None:
+        super().__init__()
+        self.port = port
+
+    def send(  # type: ignore[override]
+        self, request: requests.PreparedRequest, **kwargs: Any
+    ) -> requests.Response:
+        assert request.url is not None
+        parts = urllib.parse.urlsplit(request.url)
+        request.url = urllib.parse.urlunsplit(
+            ("http", "127.0.0.1:%d" % self.port, parts.path, parts.query, "")
+        )
+        return super().send(request, **kwargs)
+
+
+def menu_subject(start: datetime.date) -> str:
+    end = start + datetime.timedelta(days=4)
+    return "YKPao-SJ weekly menu (%s %d - %s %d)" % (
+        start.strftime("%b"),
+        start.day,
+        end.strftime("%b"),
+        end.day,
+    )
+
+
+def search_results() -> dict[str, Any]:
+    return {
+        "value": [
+            {
+                "hitsContainers": [
+                    {
+                        "hits": [
+                            {
+                                "hitId": MENU_MESSAGE_ID,
+                                "resource": {
+                                    "subject": menu_subject(BENCHMARK_DATE.date()),
+                                    "sender": {
+                                        "emailAddress": {"address": MENU_SENDER}
+                                    },
+                                },
+                            }
+                        ]
+                    }
+                ]
+            }
+        ]
+    }
+
+
+def build_menu_message(menu_filename: str) -> bytes:
+    message = email.message.EmailMessage()
+    message["From"] = MENU_SENDER
+    message["Subject"] = menu_subject(BENCHMARK_DATE.date())
+    message.set_content("Please find the menu attached.")
+    with open(menu_filename, "rb") as fd:
+        message.add_attachment(
+            fd.read(),
+            maintype="application",
+            subtype="vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            filename="menu.xlsx",
+        )
+    return message.as_bytes()
+
+
+def build_events(count: int, seed: int = 0) -> list[dict[str, Any]]:
+    rng = random.Random(seed)
+    events = []
+    for number in range(count):
+        start = datetime.datetime.combine(
+            BENCHMARK_DATE.date() + datetime.timedelta(days=rng.randrange(5)),
+            datetime.time(rng.randrange(8, 17)),
+        )
+        events.append(
+            {
+                "id": base64.urlsafe_b64encode(b"event %d" % number).decode("ascii"),
+                "subject": "Event %d" % number,
+                "start": {"dateTime": start.isoformat(), "timeZone": "Asia/Shanghai"},
+                "end": {
+                    "dateTime": (start + datetime.timedelta(hours=1)).isoformat(),
+                    "timeZone": "Asia/Shanghai",
+                },
+                "isAllDay": False,
+                "isCancelled": False,
+                "location": {"displayName": "Room %d" % rng.randrange(100)},
+                "categories": [],
+                "showAs": "busy",
+            }
+        )
+    return events
+
+
+def build_inspirations(count: int) -> dict[str, dict[str, Any]]:
+    return {
+        "%08d"
+        % number: {
+            "type": "text",
+            "origin": "Someone %d" % number,
+            "uname": "s%05d" % number,
+            "text": "Inspiration number %d" % number,
+            "file": None,
+        }
+        for number in range(count)
+    }
+
+
+def pipeline_config(directory: str) -> ConfigParser:
+    config = ConfigParser()
+    config.read(os.path.join(SOURCE_DIRECTORY, "config.example.ini"))
+    config.read_dict(
+        {
+            "general": {"build_path": directory},
+            "templates": {"directory": os.path.join(SOURCE_DIRECTORY, "templates")},
+            "weekly_menu": {"sender": MENU_SENDER},
+            "web_service": {"api_base": API_BASE},
+            # The example configuration only documents [cycle]
+            "cycle": {
+                "term_start": "2024-08-26",
+                "term_end": "2025-01-24",
+                "labels": "1 2 3 4 5 6 7 8 9 10",
+                "no_school": "2024-09-16..2024-09-17 2024-10-01..2024-10-07",
+                "no_school_pattern": "(?i)holiday|no school",
+            },
+        }
+    )
+    return config
+
+
+def run_pipeline(config: ConfigParser) -> None:
+    token = common.acquire_token("", "", "", "", [])
+    with instrument.stage("inspire_dl"):
+        inspire_dl.download_inspirations(config["web_service"]["api_base"], token)
+    with instrument.stage("weekly"):
+        weekly.generate(
+            datetime_target=BENCHMARK_DATE, **weekly.generate_arguments(config)
+        )
+    cycle_data = daily.load_cycle_data(**daily.cycle_data_arguments(config))
+    for offset in range(5):
+        day = BENCHMARK_DATE + datetime.timedelta(days=offset)
+        with instrument.stage("daily"):
+            daily.generate(day, config["the_week_ahead"]["file_url"], cycle_data)
+        with instrument.stage("pack"):
+            pack.main(day.strftime("%Y-%m-%d"), config)
+        with instrument.stage("sendmail"):
+            with open(
+                "sjdb-%s.html" % day.strftime("%Y%m%d"), "r", encoding="utf-8"
+            ) as fd:
+                html = fd.read()
+            sendmail.sendmail(
+                token,
+                subject="Daily Bulletin %s" % day.strftime("%Y-%m-%d"),
+                body=html,
+                to=["bulletin@example.org"],
+                cc=[],
+                bcc=["student%d@example.org" % number for number in range(500)],
+                when=day.replace(hour=6),
+            )
+
+
+def print_report(report: dict[str, Any]) -> None:
+    by_path: dict[str, list[float]] = {}
+    for entry in report["stages"]:
+        by_path.setdefault(entry["path"].removeprefix("total/"), []).append(
+            entry["wall_seconds"]
+        )
+    print("%-48s %5s %9s %9s" % ("stage", "runs", "total s", "mean s"))
+    for path, walls in by_path.items():
+        print(
+            "%-48s %5d %9.3f %9.3f"
+            % (path, len(walls), sum(walls), sum(walls) / len(walls))
+        )
+
+    by_endpoint: dict[str, list[float]] = {}
+    for call in report["http"]:
+        totals = by_endpoint.setdefault(
+            metrics.endpoint_label(call["url"]), [0, 0, 0, 0.0]
+        )
+        totals[0] += 1
+        totals[1] += call["status"] == 429
+        totals[2] += call["bytes"] or 0
+        totals[3] += call["seconds"]
+    print()
+    print("%-60s %5s %5s %10s %9s" % ("endpoint", "reqs", "429s", "KiB", "total s"))
+    for endpoint, (calls, throttled, total_bytes, seconds) in sorted(
+        by_endpoint.items()
+    ):
+        print(
+            "%-60s %5d %5d %10.1f %9.3f"
+            % (endpoint, calls, throttled, total_bytes / 1024, seconds)
+        )
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.ERROR)
+    parser = argparse.ArgumentParser(
+        description="Benchmark the whole Daily Bulletin pipeline against a fake Graph"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="seconds added to every response"
+    )
+    parser.add_argument(
+        "--throttle-rate",
+        type=float,
+        default=0.05,
+        help="fraction of requests answered with 429",
+    )
+    parser.add_argument(
+        "--retry-after",
+        type=float,
+        default=0.5,
+        help="Retry-After sent with each 429, in seconds",
+    )
+    parser.add_argument(
+        "--bytes-per-second",
+        type=float,
+        default=2_000_000,
+        help="download speed for files, 0 for unlimited",
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        default=None,
+        help="fail if the whole pipeline takes longer than this many seconds",
+    )
+    parser.add_argument("--photo-slides", type=int, default=10)
+    parser.add_argument("--inspirations", type=int, default=20)
+    parser.add_argument("--events", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    previous_directory = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="sjdb-pipeline-") as directory:
+        os.chdir(directory)
+        try:
+            fixtures.generate_week_ahead_pptx(
+                "deck.pptx", photo_slides=args.photo_slides, seed=args.seed
+            )
+            fixtures.generate_menu_xlsx("menu.xlsx", seed=args.seed)
+            with open("deck.pptx", "rb") as fd:
+                deck = fd.read()
+            menu_message = build_menu_message("menu.xlsx")
+            os.makedirs("build")
+            os.chdir("build")
+
+            server = FakeGraphServer(
+                deck,
+                menu_message,
+                build_inspirations(args.inspirations),
+                build_events(args.events, args.seed),
+                latency=args.latency,
+                throttle_rate=args.throttle_rate,
+                retry_after=args.retry_after,
+                bytes_per_second=args.bytes_per_second,
+                seed=args.seed,
+            )
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            graphreplay.mount(
+                common.http_session(),
+                ForwardingAdapter(server.server_address[1]),
+                "replay",
+            )
+            try:
+                with instrument.run(
+                    "pipeline", report_directory=directory, trace_memory=False
+                ) as report:
+                    run_pipeline(pipeline_config(os.getcwd()))
+            finally:
+                server.shutdown()
+                server.server_close()
+        finally:
+            os.chdir(previous_directory)
+
+    result = report.to_json()
+    print_report(result)
+    total = result["stages"][-1]["wall_seconds"]
+    print()
+    print(
+        "Total: %.3f s, %d requests, %.1f KiB"
+        % (
+            total,
+            len(result["http"]),
+            sum(call["bytes"] or 0 for call in result["http"]) / 1024,
+        )
+    )
+    if args.deadline is not None:
+        if total > args.deadline:
+            print("Over the deadline of %.1f s" % args.deadline)
+            raise SystemExit(1)
+        print("Within the deadline of %.1f s" % args.deadline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+#
+# Micro-benchmarks for the Daily Bulletin Build System's parsers and builders
+# Copyright (C) 2024 Runxi Yu <https://runxiyu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Run from the source directory:
+#     python3 -m benchmarks.run
+#     python3 -m benchmarks.run --update-baseline
+#
+# Each benchmark is timed several times on fresh synthetic inputs and then
+# run once more under tracemalloc for its peak memory. Results are compared
+# against the baseline file and the exit status is 1 if anything regressed.
+#
+# Timings depend on the machine, so no baseline is shipped: run with
+# --update-baseline once on the machine that checks for regressions, before
+# changing anything. Without a baseline the exit status is 2, as nothing
+# could be compared.
+#
+
+from __future__ import annotations
+from typing import Any, Callable, NamedTuple
+from configparser import ConfigParser
+import argparse
+import datetime
+import json
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import zoneinfo
+
+from sjdbmk import daily, menu, pack, twa, weekly
+
+from . import fixtures
+
+logger = logging.getLogger(__name__)
+
+SOURCE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(SOURCE_DIRECTORY, "benchmarks", "baseline.json")
+BENCHMARK_DATE = datetime.datetime(
+    2024, 10, 21, tzinfo=zoneinfo.ZoneInfo("Asia/Shanghai")
+)
+BENCHMARK_STEM = BENCHMARK_DATE.strftime("%Y%m%d")
+
+
+class Benchmark(NamedTuple):
+    name: str
+    # Called once per benchmark with the scratch directory as cwd
+    prepare: Callable[[argparse.Namespace], None]
+    # Called before every timed run, untimed
+    reset: Callable[[argparse.Namespace], None]
+    run: Callable[[], Any]
+
+
+def nothing(args: argparse.Namespace) -> None:
+    pass
+
+
+def prepare_menu(args: argparse.Namespace) -> None:
+    fixtures.generate_menu_xlsx(
+        "menu-%s.xlsx" % BENCHMARK_STEM, rows_per_station=args.rows_per_station
+    )
+
+
+def prepare_the_week_ahead(args: argparse.Namespace) -> None:
+    fixtures.generate_week_ahead_pptx(
+        "the_week_ahead-%s.pptx" % BENCHMARK_STEM, photo_slides=args.photo_slides
+    )
+
+
+def reset_the_week_ahead(args: argparse.Namespace) -> None:
+    for suffix in ["parsed", "index"]:
+        filename = "the_week_ahead-%s.%s.json" % (BENCHMARK_STEM, suffix)
+        if os.path.exists(filename):
+            os.unlink(filename)
+
+
+def prepare_week(args: argparse.Namespace) -> None:
+    prepare_menu(args)
+    prepare_the_week_ahead(args)
+
+
+def run_build_week(parallel: bool) -> Any:
+    return weekly.build_week(BENCHMARK_DATE, 2, -1, register=False, parallel=parallel)
+
+
+def prepare_daily(args: argparse.Namespace) -> None:
+    fixtures.generate_build_directory(
+        "pristine", BENCHMARK_DATE.date(), inspirations=args.inspirations
+    )
+
+
+def reset_daily(args: argparse.Namespace) -> None:
+    # daily.generate marks inspirations as used, so start from a fresh copy
+    for filename in os.listdir("pristine"):
+        shutil.copyfile(os.path.join("pristine", filename), filename)
+
+
+def run_daily() -> Any:
+    with open("cycles.json", "r", encoding="utf-8") as fd:
+        cycle_data = json.load(fd)
+    return daily.generate(
+        BENCHMARK_DATE,
+        the_week_ahead_url="https://example.org/the_week_ahead",
+        cycle_data=cycle_data,
+    )
+
+
+def prepare_pack(args: argparse.Namespace) -> None:
+    prepare_daily(args)
+    reset_daily(args)
+    run_daily()
+
+
+def run_pack() -> Any:
+    config = ConfigParser()
+    config.read_dict(
+        {
+            "general": {"build_path": os.getcwd()},
+            "templates": {
+                "directory": os.path.join(SOURCE_DIRECTORY, "templates"),
+                "main": "template.html",
+            },
+        }
+    )
+    return pack.main(BENCHMARK_DATE.strftime("%Y-%m-%d"), config)
+
+
+BENCHMARKS = [
+    Benchmark(
+        "menu.parse_menus",
+        prepare_menu,
+        nothing,
+        lambda: menu.parse_menus(BENCHMARK_DATE),
+    ),
+    Benchmark(
+        "menu.parse_snacks",
+        prepare_menu,
+        nothing,
+        lambda: menu.parse_snacks(BENCHMARK_DATE),
+    ),
+    Benchmark(
+        "twa.parse_the_week_ahead",
+        prepare_the_week_ahead,
+        reset_the_week_ahead,
+        lambda: twa.parse_the_week_ahead(BENCHMARK_DATE, 2, -1),
+    ),
+    Benchmark(
+        "twa.parse_the_week_ahead (cached)",
+        prepare_the_week_ahead,
+        nothing,
+        lambda: twa.parse_the_week_ahead(BENCHMARK_DATE, 2, -1),
+    ),
+    Benchmark(
+        "weekly.build_week",
+        prepare_week,
+        reset_the_week_ahead,
+        lambda: run_build_week(parallel=False),
+    ),
+    Benchmark(
+        "weekly.build_week (parallel)",
+        prepare_week,
+        reset_the_week_ahead,
+        lambda: run_build_week(parallel=True),
+    ),
+    Benchmark("daily.generate", prepare_daily, reset_daily, run_daily),
+    Benchmark("pack.main", prepare_pack, nothing, run_pack),
+]
+
+
+def measure(benchmark: Benchmark, args: argparse.Namespace) -> dict[str, float]:
+    previous_directory = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="sjdb-bench-") as directory:
+        os.chdir(directory)
+        try:
+            benchmark.prepare(args)
+            # One untimed run warms imports and caches meant to be warm
+            benchmark.reset(args)
+            benchmark.run()
+            timings = []
+            for _ in range(args.repeat):
+                benchmark.reset(args)
+                start = time.perf_counter()
+                benchmark.run()
+                timings.append(time.perf_counter() - start)
+            benchmark.reset(args)
+            tracemalloc.start()
+            try:
+                benchmark.run()
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+        finally:
+            os.chdir(previous_directory)
+    return {
+        "seconds": statistics.median(timings),
+        "min_seconds": min(timings),
+        "peak_bytes": peak,
+    }
+
+
+def compare(
+    results: dict[str, dict[str, float]],
+    baseline: dict[str, dict[str, float]],
+    tolerance: float,
+) -> list[str]:
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric in ["seconds", "peak_bytes"]:
+            if result[metric] > baseline[name][metric] * (1 + tolerance):
+                regressions.append(
+                    "%s: %s went from %g to %g"
+                    % (name, metric, baseline[name][metric], result[metric])
+                )
+    return regressions
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.ERROR)
+    parser = argparse.ArgumentParser(
+        description="Benchmark the Daily Bulletin parsers and builders"
+    )
+    parser.add_argument(
+        "--only", action="append", default=None, help="run only this benchmark"
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs each")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="store these results as the new baseline",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="fraction above the baseline counted as a regression",
+    )
+    parser.add_argument("--inspirations", type=int, default=2000)
+    parser.add_argument("--photo-slides", type=int, default=10)
+    parser.add_argument("--rows-per-station", type=int, default=3)
+    args = parser.parse_args()
+
+    try:
+        with open(args.baseline, "r", encoding="utf-8") as fd:
+            baseline = json.load(fd)
+    except FileNotFoundError:
+        if not args.update_baseline:
+            logger.error(
+                "No baseline at %s, so nothing will be compared; "
+                "run with --update-baseline first" % args.baseline
+            )
+        baseline = {}
+
+    results = {}
+    for benchmark in BENCHMARKS:
+        if args.only and benchmark.name not in args.only:
+            continue
+        results[benchmark.name] = measure(benchmark, args)
+        previous = baseline.get(benchmark.name)
+        print(
+            "%-36s %9.2f ms %9.1f KiB%s"
+            % (
+                benchmark.name,
+                results[benchmark.name]["seconds"] * 1000,
+                results[benchmark.name]["peak_bytes"] / 1024,
+                (
+                    "  (baseline %.2f ms, %.1f KiB)"
+                    % (previous["seconds"] * 1000, previous["peak_bytes"] / 1024)
+                    if previous
+                    else ""
+                ),
+            )
+        )
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as fd:
+            json.dump(baseline | results, fd, indent="\t")
+        print("Baseline written to %s" % args.baseline)
+        return
+
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print("REGRESSION: %s" % regression)
+    if regressions:
+        sys.exit(1)
+    if not baseline.keys() & results.keys():
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+#
+# Startup time budget for the Daily Bulletin Build System's entry points
+# Copyright (C) 2024 Runxi Yu <https://runxiyu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Run from the source directory:
+#     python3 -m benchmarks.startup
+#
+# Runs "python3 -X importtime -m sjdbmk.<entry point> --help" for each entry
+# point and adds up the import time after interpreter startup, which is what
+# our own import structure decides. The exit status is 1 if an entry point
+# is over its budget, or if it loads one of the heavy libraries just to print
+# its help; those belong inside the functions that use them.
+#
+
+from __future__ import annotations
+from typing import NamedTuple
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+SOURCE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Milliseconds of imports after site, with room for slower machines
+BUDGETS = {
+    "inspire_approve": 15,
+    "pack": 40,
+    "otd": 40,
+    "itn": 40,
+    "instrument": 40,
+    "daily": 60,
+    "cal": 60,
+    "cycles": 60,
+    "inspire_dl": 60,
+    "sendmail": 60,
+    "weekly": 80,
+    "buildgraph": 80,
+    "daemon": 80,
+    "weeks": 40,
+    "backfill": 80,
+    "store": 40,
+    "retention": 40,
+}
+HEAVY_MODULES = [
+    "requests",
+    "urllib3",
+    "msal",
+    "openpyxl",
+    "jinja2",
+    "pptx",
+    "lxml",
+    "PIL",
+    "bs4",
+]
+
+
+class Measurement(NamedTuple):
+    import_seconds: float
+    wall_seconds: float
+    heavy: list[str]
+
+
+def parse_importtime(stderr: str) -> tuple[float, set[str]]:
+    # Lines look like "import time:   self |  cumulative | <indent>name"
+    total = 0
+    after_site = False
+    modules = set()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line.split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        modules.add(name.strip())
+        if name.startswith("  "):
+            continue
+        if name.strip() == "site":
+            after_site = True
+        elif after_site:
+            total += int(fields[1])
+    return total / 1_000_000, modules
+
+
+def measure(entry_point: str) -> Measurement:
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "sjdbmk." + entry_point, "--help"],
+        cwd=SOURCE_DIRECTORY,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    wall_seconds = time.perf_counter() - start
+    import_seconds, modules = parse_importtime(completed.stderr)
+    return Measurement(
+        import_seconds,
+        wall_seconds,
+        [heavy for heavy in HEAVY_MODULES if heavy in modules],
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Check the startup time of each Daily Bulletin entry point"
+    )
+    parser.add_argument(
+        "--only", action="append", default=None, help="check only this entry point"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="runs each; the fastest one counts"
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="multiply every budget by this, for slow machines",
+    )
+    args = parser.parse_args()
+
+    failures = []
+    print("%-16s %10s %10s %10s" % ("entry point", "import ms", "budget ms", "wall ms"))
+    for entry_point, budget in BUDGETS.items():
+        if args.only and entry_point not in args.only:
+            continue
+        measurements = [measure(entry_point) for _ in range(args.repeat)]
+        best = min(measurements, key=lambda measurement: measurement.import_seconds)
+        budget_seconds = budget * args.scale / 1000
+        print(
+            "%-16s %10.1f %10.1f %10.1f"
+            % (
+                entry_point,
+                best.import_seconds * 1000,
+                budget_seconds * 1000,
+                min(measurement.wall_seconds for measurement in measurements) * 1000,
+            )
+        )
+        if best.import_seconds > budget_seconds:
+            failures.append(
+                "%s: %.1f ms of imports, budget %.1f ms"
+                % (entry_point, best.import_seconds * 1000, budget_seconds * 1000)
+            )
+        if best.heavy:
+            failures.append(
+                "%s: --help imports %s" % (entry_point, ", ".join(best.heavy))
+            )
+
+    for failure in failures:
+        print("OVER BUDGET: %s" % failure)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
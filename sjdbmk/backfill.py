@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+#
+# Rebuild the week files of a whole term for the Daily Bulletin Build System
+# Copyright (C) 2024 Runxi Yu <https://runxiyu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# weekly for every Monday in a range, after losing a build directory or
+# changing how menus or The Week Ahead are parsed:
+#
+# - One login, one mail search for all the menus, and one calendar sync
+#   over the whole range.
+# - Missing menus are downloaded in parallel threads. The Week Ahead share
+#   is always the current deck, so it is downloaded at most once, and only
+#   for this or next week; older weeks need their deck in the build
+#   directory or the shared cache already.
+# - Parsing is CPU-bound, so each week is parsed in its own process.
+#
+# One week failing does not stop the others. Every week is listed at the end
+# with its result, and the exit status is 1 if any failed.
+#
+#     python3 -m sjdbmk.backfill --from 2024-09-02 --to 2025-01-17
+#
+
+from __future__ import annotations
+from typing import Any, Optional
+from configparser import ConfigParser
+import argparse
+import concurrent.futures
+import datetime
+import logging
+import os
+import sys
+import zoneinfo
+
+from . import cal, cas, common, instrument, menu, twa, weekly, weeks
+
+logger = logging.getLogger(__name__)
+
+# Enough results to find a term's menus in one search
+MENU_SEARCH_SIZE = 100
+
+
+def mondays_between(
+    first: datetime.datetime, last: datetime.datetime
+) -> list[datetime.datetime]:
+    monday = first - datetime.timedelta(days=first.weekday())
+    mondays = []
+    while monday <= last:
+        mondays.append(monday)
+        monday += datetime.timedelta(days=7)
+    return mondays
+
+
+def download_menus(
+    token: str,
+    mondays: list[datetime.datetime],
+    arguments: dict[str, Any],
+    download_threads: int,
+) -> dict[datetime.datetime, str]:
+    missing = [
+        monday
+        for monday in mondays
+        if not os.path.isfile("menu-%s.xlsx" % monday.strftime("%Y%m%d"))
+        and not cas.fetch_input("menu-%s" % monday.strftime("%Y%m%d"))
+    ]
+    if not missing:
+        return {}
+    failures = {}
+    search_results = common.search_mail(
+        token, arguments["weekly_menu_query_string"], size=MENU_SEARCH_SIZE
+    )
+    downloads = {}
+    for monday in missing:
+        try:
+            downloads[monday] = menu.find_menu_hit(
+                search_results,
+                monday,
+                arguments["weekly_menu_sender"],
+                arguments["weekly_menu_subject_regex"],
+                arguments["weekly_menu_subject_regex_four_groups"],
+            )
+        except ValueError as e:
+            failures[monday] = "menu: %s" % e
+    with concurrent.futures.ThreadPoolExecutor(download_threads) as executor:
+        futures = {
+            executor.submit(
+                menu.download_menu_message,
+                token,
+                hit,
+                "menu-%s.xlsx" % monday.strftime("%Y%m%d"),
+            ): monday
+            for monday, hit in downloads.items()
+        }
+        for future in concurrent.futures.as_completed(futures):
+            monday = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                failures[monday] = "menu: %s" % e
+            else:
+                cas.store_input(
+                    "menu-%s" % monday.strftime("%Y%m%d"),
+                    "menu-%s.xlsx" % monday.strftime("%Y%m%d"),
+                )
+    return failures
+
+
+def download_the_week_ahead(
+    token: str,
+    mondays: list[datetime.datetime],
+    the_week_ahead_url: str,
+    now: datetime.datetime,
+) -> dict[datetime.datetime, str]:
+    missing = [
+        monday
+        for monday in mondays
+        if not os.path.isfile(twa.the_week_ahead_local_filename(monday))
+        and not cas.fetch_input("the_week_ahead-%s" % monday.strftime("%Y%m%d"))
+    ]
+    failures = {}
+    this_monday = now.replace(
+        hour=0, minute=0, second=0, microsecond=0
+    ) - datetime.timedelta(days=now.weekday())
+    current = [monday for monday in missing if monday >= this_monday]
+    for monday in missing:
+        if current and monday == current[0]:
+            try:
+                twa.download_or_report_the_week_ahead(token, monday, the_week_ahead_url)
+            except Exception as e:
+                failures[monday] = "The Week Ahead: %s" % e
+        else:
+            failures[monday] = "The Week Ahead: no local copy of this week's deck"
+    return failures
+
+
+def parse_week(
+    monday: datetime.datetime,
+    the_week_ahead_community_time_page_number: int,
+    the_week_ahead_aod_page_number: int,
+) -> str:
+    return weekly.build_week(
+        monday,
+        the_week_ahead_community_time_page_number,
+        the_week_ahead_aod_page_number,
+        register=False,
+        parallel=False,
+    )
+
+
+def backfill(
+    mondays: list[datetime.datetime],
+    arguments: dict[str, Any],
+    now: datetime.datetime,
+    jobs: Optional[int] = None,
+    download_threads: int = 4,
+) -> dict[datetime.datetime, str]:
+    # Returns the result for every Monday: the week file, or why it failed
+    with instrument.stage("login"):
+        token = common.acquire_token(
+            arguments["graph_client_id"],
+            arguments["graph_authority"],
+            arguments["graph_username"],
+            arguments["graph_password"],
+            arguments["graph_scopes"],
+        )
+    try:
+        with instrument.stage("calendar_sync"):
+            cal.sync_calendar(
+                token,
+                arguments["calendar_address"],
+                *weekly.covering_calendar_window(
+                    arguments["calendar_window"],
+                    mondays[0],
+                    mondays[-1] + datetime.timedelta(days=7),
+                ),
+            )
+    except Exception:
+        logger.exception("Calendar sync failed, continuing without it")
+
+    with instrument.stage("download"):
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            menu_failures = executor.submit(
+                download_menus, token, mondays, arguments, download_threads
+            )
+            the_week_ahead_failures = executor.submit(
+                download_the_week_ahead,
+                token,
+                mondays,
+                arguments["the_week_ahead_url"],
+                now,
+            )
+            failures = menu_failures.result()
+            for monday, failure in the_week_ahead_failures.result().items():
+                failures[monday] = (
+                    "%s; %s" % (failures[monday], failure)
+                    if monday in failures
+                    else failure
+                )
+
+    results = dict(failures)
+    with instrument.stage("parse"):
+        with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+            futures = {
+                executor.submit(
+                    parse_week,
+                    monday,
+                    arguments["the_week_ahead_community_time_page_number"],
+                    arguments["the_week_ahead_aod_page_number"],
+                ): monday
+                for monday in mondays
+                if monday not in failures
+            }
+            for future in concurrent.futures.as_completed(futures):
+                monday = futures[future]
+                try:
+                    week_filename = future.result()
+                except Exception as e:
+                    logger.exception(
+                        "Parsing the week of %s failed" % monday.strftime("%Y-%m-%d")
+                    )
+                    results[monday] = "parse: %s" % e
+                else:
+                    # Only here, so that the workers never race on the manifest
+                    weeks.register(week_filename, weeks.read_week(week_filename))
+                    results[monday] = week_filename
+    return dict(sorted(results.items()))
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Generate the week files of every Monday in a range"
+    )
+    parser.add_argument(
+        "--from",
+        dest="first",
+        required=True,
+        help="the first day of the range, in YYYY-MM-DD",
+    )
+    parser.add_argument(
+        "--to",
+        dest="last",
+        required=True,
+        help="the last day of the range, in YYYY-MM-DD",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=None,
+        help="processes parsing weeks; defaults to the CPU count",
+    )
+    parser.add_argument(
+        "--download-threads",
+        type=int,
+        default=4,
+        help="menus downloaded at the same time",
+    )
+    parser.add_argument(
+        "--config", default="config.ini", help="path to the configuration file"
+    )
+    parser.add_argument(
+        "--profile", action="store_true", help="dump a cProfile of this run"
+    )
+    parser.add_argument(
+        "--no-trace-memory",
+        dest="trace_memory",
+        action="store_false",
+        help="leave peak memory out of the run report, which is faster",
+    )
+    args = parser.parse_args()
+
+    config = ConfigParser()
+    config.read(args.config)
+
+    tzinfo = zoneinfo.ZoneInfo(config["general"]["timezone"])
+    mondays = mondays_between(
+        datetime.datetime.strptime(args.first, "%Y-%m-%d").replace(tzinfo=tzinfo),
+        datetime.datetime.strptime(args.last, "%Y-%m-%d").replace(tzinfo=tzinfo),
+    )
+    if not mondays:
+        parser.error("the range has no weeks")
+    logger.info(
+        "Backfilling %d weeks from %s" % (len(mondays), mondays[0].strftime("%Y-%m-%d"))
+    )
+
+    build_path = config["general"]["build_path"]
+    os.chdir(build_path)
+    common.install_graph_transport(config)
+    cas.install(config)
+
+    with instrument.run(
+        "backfill",
+        profile=args.profile,
+        trace_memory=args.trace_memory,
+        metrics_directory=config.get("metrics", "textfile_directory", fallback=None),
+    ):
+        results = backfill(
+            mondays,
+            weekly.generate_arguments(config),
+            datetime.datetime.now(tzinfo),
+            jobs=args.jobs,
+            download_threads=args.download_threads,
+        )
+
+    failed = 0
+    for monday, result in results.items():
+        if result.startswith("week-"):
+            print("%s ok     %s" % (monday.strftime("%Y-%m-%d"), result))
+        else:
+            failed += 1
+            print("%s FAILED %s" % (monday.strftime("%Y-%m-%d"), result))
+    print("%d weeks built, %d failed" % (len(results) - failed, failed))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
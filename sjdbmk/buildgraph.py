@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+#
+# Incremental builds for the Daily Bulletin Build System
+# Copyright (C) 2024 Runxi Yu <https://runxiyu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# A small make: every artifact has a rule listing the hashes of its inputs,
+# and build-state.json remembers the input hashes each artifact was last
+# built from. An artifact is rebuilt only when one of them differs, when it
+# has never been built, or when it was changed or removed since, and the
+# reasons are logged and printed.
+#
+#     week-*.json   <- menu-*.xlsx, The Week Ahead, [the_week_ahead] pages
+#     day-*.json    <- week-*.json, cycle day, inspiration, On This Day,
+#                      In The News (as last built, for days already
+#                      past), [the_week_ahead] file_url
+#     sjdb-*.html   <- day-*.json, the templates, [templates]
+#
+# Since a day file's hash only changes when its content does, a template
+# change rebuilds only the bulletins, and a new week file only the days
+# whose data actually changed.
+#
+# Run from the source directory:
+#     python3 -m sjdbmk.buildgraph --from 2024-09-02 --to 2024-09-27
+#
+
+from __future__ import annotations
+from typing import Any, Callable, NamedTuple, Optional
+from configparser import ConfigParser
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import zoneinfo
+
+from . import (
+    cas,
+    common,
+    daily,
+    deadline,
+    instrument,
+    itn,
+    menu,
+    otd,
+    pack,
+    retention,
+    twa,
+    weekly,
+    weeks,
+)
+
+logger = logging.getLogger(__name__)
+
+BUILD_STATE_FILENAME = "build-state.json"
+MISSING = "missing"
+
+
+class Rule(NamedTuple):
+    artifact: str
+    inputs: Callable[[], dict[str, str]]
+    build: Callable[[], Any]
+
+
+def value_hash(value: Any) -> str:
+    return hashlib.sha256(
+        json.dumps(value, sort_keys=True, ensure_ascii=False, default=str).encode(
+            "utf-8"
+        )
+    ).hexdigest()
+
+
+def config_section_hash(
+    config: ConfigParser, section: str, options: Optional[list[str]] = None
+) -> str:
+    if not config.has_section(section):
+        return MISSING
+    items: dict[str, Optional[str]] = dict(config.items(section, raw=True))
+    if options is not None:
+        # A missing option hashes as null, apart from one set to ""
+        items = {option: items.get(option) for option in options}
+    return value_hash(items)
+
+
+class BuildGraph:
+    def __init__(self, state_filename: str = BUILD_STATE_FILENAME) -> None:
+        self.state_filename = state_filename
+        try:
+            with open(state_filename, "r", encoding="utf-8") as fd:
+                state = json.load(fd)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            state = {}
+        # path -> [inode, mtime_ns, size, sha256], so unchanged files are
+        # not hashed again
+        self.files: dict[str, list[Any]] = state.get("files", {})
+        self.artifacts: dict[str, dict[str, Any]] = state.get("artifacts", {})
+
+    def file_hash(self, path: str) -> str:
+        # Compressed files hash as their content, so compressing an old
+        # artifact does not make it look changed
+        actual_path = retention.existing_path(path)
+        if actual_path is None:
+            self.files.pop(path, None)
+            return MISSING
+        stat = os.stat(actual_path)
+        signature = [stat.st_ino, stat.st_mtime_ns, stat.st_size]
+        cached = self.files.get(path)
+        if cached and cached[:3] == signature:
+            assert isinstance(cached[3], str)
+            return cached[3]
+        digest = common.file_sha256(actual_path)
+        self.files[path] = signature + [digest]
+        return digest
+
+    def directory_hash(self, directory: str) -> str:
+        return value_hash(
+            {
+                entry.name: self.file_hash(entry.path)
+                for entry in sorted(os.scandir(directory), key=lambda e: e.name)
+                if entry.is_file()
+            }
+        )
+
+    def reasons(self, rule: Rule, inputs: dict[str, str]) -> list[str]:
+        recorded = self.artifacts.get(rule.artifact)
+        if recorded is None:
+            return ["never built"]
+        output_hash = self.file_hash(rule.artifact)
+        if output_hash == MISSING:
+            return ["%s is missing" % rule.artifact]
+        if output_hash != recorded["output"]:
+            return ["%s was changed outside the build" % rule.artifact]
+        reasons = []
+        for name in sorted(inputs.keys() | recorded["inputs"].keys()):
+            if name not in recorded["inputs"]:
+                reasons.append("new input %s" % name)
+            elif name not in inputs:
+                reasons.append("input %s removed" % name)
+            elif inputs[name] != recorded["inputs"][name]:
+                reasons.append("%s changed" % name)
+        if not reasons and recorded.get("degraded"):
+            reasons.append("the last build was degraded")
+        return reasons
+
+    def make(self, rule: Rule, force: bool = False, dry_run: bool = False) -> list[str]:
+        # Returns why the artifact was (or, with dry_run, would be) rebuilt,
+        # and nothing if it was up to date
+        inputs = rule.inputs()
+        reasons = ["forced"] if force else self.reasons(rule, inputs)
+        if not reasons or dry_run:
+            return reasons
+        logger.info("Rebuilding %s: %s" % (rule.artifact, "; ".join(reasons)))
+        degraded_before = len(deadline.degradations)
+        rule.build()
+        self.artifacts[rule.artifact] = {
+            "inputs": inputs,
+            "output": self.file_hash(rule.artifact),
+            "built": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "reasons": reasons,
+        }
+        if len(deadline.degradations) != degraded_before:
+            # Built again next time, when what it left out may be back
+            self.artifacts[rule.artifact]["degraded"] = True
+        self.save()
+        return reasons
+
+    def save(self) -> None:
+        directory = os.path.dirname(os.path.abspath(self.state_filename))
+        fd, temporary_filename = tempfile.mkstemp(prefix=".build-state-", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as state_file:
+                json.dump(
+                    {"files": self.files, "artifacts": self.artifacts},
+                    state_file,
+                    indent="\t",
+                )
+            os.replace(temporary_filename, self.state_filename)
+        except BaseException:
+            os.unlink(temporary_filename)
+            raise
+
+
+def week_rule(
+    graph: BuildGraph, config: ConfigParser, monday: datetime.datetime
+) -> Rule:
+    def inputs() -> dict[str, str]:
+        return {
+            "menu": graph.file_hash("menu-%s.xlsx" % monday.strftime("%Y%m%d")),
+            "the_week_ahead": graph.file_hash(
+                twa.the_week_ahead_local_filename(monday)
+            ),
+            "config[the_week_ahead]": config_section_hash(
+                config,
+                "the_week_ahead",
+                ["community_time_page_number", "aod_page_number"],
+            ),
+            "twa_parser": str(twa.TWA_PARSER_VERSION),
+            "menu_parser": str(menu.MENU_PARSER_VERSION),
+        }
+
+    def build() -> str:
+        return weekly.build_week(
+            monday,
+            int(config["the_week_ahead"]["community_time_page_number"]),
+            int(config["the_week_ahead"]["aod_page_number"]),
+        )
+
+    return Rule("week-%s.json" % monday.strftime("%Y%m%d"), inputs, build)
+
+
+def inspiration_hash(graph: BuildGraph, stddate: str) -> str:
+    chosen = daily.choose_inspiration(stddate)
+    if chosen is None:
+        return MISSING
+    inspfn, inspjq = chosen
+    # Not "used", which the build itself sets to the date
+    content = {key: value for key, value in inspjq.items() if key != "used"}
+    if inspjq["file"]:
+        content["attachment"] = graph.file_hash(
+            "inspattach-%s" % os.path.basename(inspjq["file"])
+        )
+    return value_hash([inspfn, content])
+
+
+def day_rule(
+    graph: BuildGraph,
+    config: ConfigParser,
+    cycle_data: dict[str, str],
+    day: datetime.datetime,
+) -> Rule:
+    in_the_news_ttl = config.getfloat("in_the_news", "ttl", fallback=21600)
+    # The cached In The News is today's, so a day already past keeps the news
+    # it was built with, and is not rebuilt whenever the cache changes
+    past = day.date() < datetime.datetime.now(day.tzinfo).date()
+
+    def in_the_news_hash() -> str:
+        if past:
+            return value_hash(
+                list(
+                    daily.previous_build(
+                        day.strftime("%Y-%m-%d"), daily.IN_THE_NEWS_FIELDS
+                    )
+                )
+            )
+        return value_hash(
+            [
+                itn.read_in_the_news(language, in_the_news_ttl)
+                for language in ["en", "zh"]
+            ]
+        )
+
+    def inputs() -> dict[str, str]:
+        week_filename, days_since_beginning = weeks.find_week(day)
+        return {
+            "week": "%s:%d:%s"
+            % (week_filename, days_since_beginning, graph.file_hash(week_filename)),
+            "cycle_day": cycle_data.get(day.strftime("%Y-%m-%d"), MISSING),
+            "inspiration": inspiration_hash(graph, day.strftime("%Y-%m-%d")),
+            "on_this_day": value_hash(
+                [
+                    otd.read_on_this_day(language, day.strftime("%m-%d"))
+                    for language in ["en", "zh"]
+                ]
+            ),
+            "in_the_news": in_the_news_hash(),
+            "config[the_week_ahead]": config_section_hash(
+                config, "the_week_ahead", ["file_url"]
+            ),
+        }
+
+    def build() -> str:
+        return daily.generate(
+            day,
+            the_week_ahead_url=config["the_week_ahead"]["file_url"],
+            cycle_data=cycle_data,
+            in_the_news_ttl=in_the_news_ttl,
+            build_deadline=deadline.from_config(config, day),
+            keep_in_the_news=past,
+        )
+
+    return Rule("day-%s.json" % day.strftime("%Y%m%d"), inputs, build)
+
+
+def bulletin_rule(
+    graph: BuildGraph, config: ConfigParser, day: datetime.datetime
+) -> Rule:
+    def inputs() -> dict[str, str]:
+        return {
+            "day": graph.file_hash("day-%s.json" % day.strftime("%Y%m%d")),
+            "templates": graph.directory_hash(config["templates"]["directory"]),
+            "config[templates]": config_section_hash(config, "templates"),
+        }
+
+    def build() -> None:
+        pack.main(day.strftime("%Y-%m-%d"), config)
+
+    return Rule("sjdb-%s.html" % day.strftime("%Y%m%d"), inputs, build)
+
+
+def build_day(
+    graph: BuildGraph,
+    config: ConfigParser,
+    cycle_data: dict[str, str],
+    day: datetime.datetime,
+    force: bool = False,
+    dry_run: bool = False,
+) -> dict[str, list[str]]:
+    # The day and its bulletin, with the reasons for whatever was rebuilt
+    deadline.reset()
+    rebuilt = {}
+    for rule in [
+        day_rule(graph, config, cycle_data, day),
+        bulletin_rule(graph, config, day),
+    ]:
+        with instrument.stage(rule.artifact.split("-", 1)[0]):
+            reasons = graph.make(rule, force=force, dry_run=dry_run)
+        if reasons:
+            rebuilt[rule.artifact] = reasons
+    return rebuilt
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Rebuild the Daily Bulletins whose inputs changed"
+    )
+    parser.add_argument(
+        "--from",
+        dest="first",
+        default=None,
+        help="the first day to build, in YYYY-MM-DD; defaults to tomorrow",
+    )
+    parser.add_argument(
+        "--to",
+        dest="last",
+        default=None,
+        help="the last day to build, in YYYY-MM-DD; defaults to the first",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="only explain what would be rebuilt and why",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="rebuild everything in the range"
+    )
+    parser.add_argument(
+        "--config", default="config.ini", help="path to the configuration file"
+    )
+    parser.add_argument(
+        "--profile", action="store_true", help="dump a cProfile of this run"
+    )
+    parser.add_argument(
+        "--no-trace-memory",
+        dest="trace_memory",
+        action="store_false",
+        help="leave peak memory out of the run report, which is faster",
+    )
+    args = parser.parse_args()
+
+    config = ConfigParser()
+    config.read(args.config)
+
+    tzinfo = zoneinfo.ZoneInfo(config["general"]["timezone"])
+    if args.first:
+        first = datetime.datetime.strptime(args.first, "%Y-%m-%d").replace(
+            tzinfo=tzinfo
+        )
+    else:
+        first = datetime.datetime.now(tz=tzinfo).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        ) + datetime.timedelta(days=1)
+    if args.last:
+        last = datetime.datetime.strptime(args.last, "%Y-%m-%d").replace(tzinfo=tzinfo)
+    else:
+        last = first
+
+    # Relative to where we were started, as for pack
+    config["templates"]["directory"] = os.path.abspath(config["templates"]["directory"])
+    config["general"]["build_path"] = os.path.abspath(config["general"]["build_path"])
+    os.chdir(config["general"]["build_path"])
+    cas.install(config)
+
+    graph = BuildGraph()
+    days = weeks.school_days(first, last)
+    mondays = sorted({day - datetime.timedelta(days=day.weekday()) for day in days})
+    rebuilt: dict[str, list[str]] = {}
+    with instrument.run(
+        "build",
+        profile=args.profile,
+        trace_memory=args.trace_memory,
+        metrics_directory=config.get("metrics", "textfile_directory", fallback=None),
+    ):
+        for monday in mondays:
+            rule = week_rule(graph, config, monday)
+            if MISSING in rule.inputs().values():
+                # Fetching them is weekly's job
+                logger.info("Inputs of %s not downloaded, skipping" % rule.artifact)
+                continue
+            with instrument.stage("week"):
+                reasons = graph.make(rule, force=args.force, dry_run=args.dry_run)
+            if reasons:
+                rebuilt[rule.artifact] = reasons
+        with instrument.stage("load_cycles"):
+            cycle_data = daily.load_cycle_data(**daily.cycle_data_arguments(config))
+        for day in days:
+            try:
+                rebuilt.update(
+                    build_day(
+                        graph,
+                        config,
+                        cycle_data,
+                        day,
+                        force=args.force,
+                        dry_run=args.dry_run,
+                    )
+                )
+            except FileNotFoundError as e:
+                logger.warning("Skipping %s: %s" % (day.strftime("%Y-%m-%d"), e))
+        graph.save()
+
+    for artifact, reasons in rebuilt.items():
+        print(
+            "%s %s: %s"
+            % (
+                "would rebuild" if args.dry_run else "rebuilt",
+                artifact,
+                "; ".join(reasons),
+            )
+        )
+    if not rebuilt:
+        print("everything is up to date")
+
+
+if __name__ == "__main__":
+    main()
@@ -17,16 +17,40 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 #
 
-from typing import Any
+from __future__ import annotations
+from typing import Any, Optional
+from configparser import ConfigParser
+import argparse
 import datetime
+import json
+import logging
+import os
+import tempfile
+import zoneinfo
 
-import requests
+from . import common
+
+logger = logging.getLogger(__name__)
+
+CALENDAR_STORE_FILENAME = "calendar.json"
+# Only what we render or use to derive the cycle; everything else is dropped.
+CALENDAR_FIELDS = [
+    "subject",
+    "start",
+    "end",
+    "isAllDay",
+    "isCancelled",
+    "location",
+    "categories",
+    "showAs",
+]
 
 
 def calfetch(
     token: str, calendar_address: str, datetime_target: datetime.datetime
 ) -> Any:
-    calendar_response = requests.get(
+    calendar_response = common.request(
+        "GET",
         "https://graph.microsoft.com/v1.0/users/%s/calendar/calendarView"
         % calendar_address,
         headers={"Authorization": "Bearer " + token},
@@ -44,3 +68,182 @@ def calfetch(
         )
     calendar_object = calendar_response.json()
     return calendar_object
+
+
+def load_calendar_store(path: str = CALENDAR_STORE_FILENAME) -> dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as fd:
+            store = json.load(fd)
+    except FileNotFoundError:
+        return {"window": None, "delta_link": None, "events": {}}
+    assert isinstance(store, dict)
+    return store
+
+
+def save_calendar_store(
+    store: dict[str, Any], path: str = CALENDAR_STORE_FILENAME
+) -> None:
+    fd, temporary_path = tempfile.mkstemp(
+        prefix=".calendar-", suffix=".json", dir=os.path.dirname(os.path.abspath(path))
+    )
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as temporary_file:
+            json.dump(store, temporary_file, ensure_ascii=False, indent="\t")
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+def sync_calendar(
+    token: str,
+    calendar_address: str,
+    window_start: datetime.datetime,
+    window_end: datetime.datetime,
+    path: str = CALENDAR_STORE_FILENAME,
+) -> dict[str, Any]:
+    window = [
+        window_start.replace(microsecond=0).isoformat(),
+        window_end.replace(microsecond=0).isoformat(),
+    ]
+    store = load_calendar_store(path)
+    url: Optional[str]
+    if store["window"] == window and store["delta_link"]:
+        logger.info("Syncing calendar changes since the last sync")
+        url = store["delta_link"]
+        params: Optional[dict[str, str]] = None
+    else:
+        logger.info("Syncing calendar from scratch for %s to %s" % tuple(window))
+        store = {"window": window, "delta_link": None, "events": {}}
+        url = None
+
+    changes = 0
+    while True:
+        if url is None:
+            url = (
+                "https://graph.microsoft.com/v1.0/users/%s/calendarView/delta"
+                % calendar_address
+            )
+            params = {
+                "startDateTime": window[0],
+                "endDateTime": window[1],
+                "$select": ",".join(CALENDAR_FIELDS),
+            }
+        calendar_response = common.request(
+            "GET",
+            url,
+            headers={
+                "Authorization": "Bearer " + token,
+                "Prefer": "odata.maxpagesize=200",
+            },
+            params=params,
+            timeout=15,
+        )
+        if calendar_response.status_code == 410 and store["delta_link"]:
+            logger.warning("Calendar delta token expired, syncing from scratch")
+            store = {"window": window, "delta_link": None, "events": {}}
+            url = None
+            continue
+        if calendar_response.status_code != 200:
+            raise ValueError(
+                "Calendar response status code is not 200", calendar_response.content
+            )
+        page = calendar_response.json()
+        for event in page["value"]:
+            changes += 1
+            if "@removed" in event:
+                store["events"].pop(event["id"], None)
+            else:
+                store["events"][event["id"]] = {
+                    field: event.get(field) for field in CALENDAR_FIELDS
+                }
+        if "@odata.nextLink" in page:
+            url = page["@odata.nextLink"]
+            params = None
+            continue
+        store["delta_link"] = page["@odata.deltaLink"]
+        break
+
+    logger.info(
+        "Calendar sync got %d changes, %d events stored"
+        % (changes, len(store["events"]))
+    )
+    save_calendar_store(store, path)
+    return store
+
+
+def parse_graph_datetime(value: dict[str, str]) -> datetime.datetime:
+    # Graph gives seven fractional digits, which fromisoformat() rejects
+    naive = datetime.datetime.fromisoformat(value["dateTime"][:26])
+    return naive.replace(tzinfo=zoneinfo.ZoneInfo(value.get("timeZone") or "UTC"))
+
+
+def event_dates(
+    event: dict[str, Any], tzinfo: datetime.tzinfo
+) -> tuple[datetime.date, datetime.date]:
+    # The end date is exclusive, like Graph's own end times
+    if event["isAllDay"]:
+        start_date = datetime.date.fromisoformat(event["start"]["dateTime"][:10])
+        end_date = datetime.date.fromisoformat(event["end"]["dateTime"][:10])
+    else:
+        start = parse_graph_datetime(event["start"]).astimezone(tzinfo)
+        end = parse_graph_datetime(event["end"]).astimezone(tzinfo)
+        start_date = start.date()
+        end_date = end.date() + datetime.timedelta(days=1 if end.time() else 0)
+    return start_date, max(end_date, start_date + datetime.timedelta(days=1))
+
+
+def events_on(
+    date: datetime.date,
+    tzinfo: datetime.tzinfo,
+    store: Optional[dict[str, Any]] = None,
+) -> list[dict[str, Any]]:
+    if store is None:
+        store = load_calendar_store()
+    events = []
+    for event in store["events"].values():
+        if event.get("isCancelled"):
+            continue
+        start_date, end_date = event_dates(event, tzinfo)
+        if start_date <= date < end_date:
+            events.append(event)
+    return events
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Sync the school calendar for the Daily Bulletin"
+    )
+    parser.add_argument(
+        "--config", default="config.ini", help="path to the configuration file"
+    )
+    args = parser.parse_args()
+
+    config = ConfigParser()
+    config.read(args.config)
+
+    tzinfo = zoneinfo.ZoneInfo(config["general"]["timezone"])
+    window_start = datetime.datetime.strptime(
+        config["calendar"]["window_start"], "%Y-%m-%d"
+    ).replace(tzinfo=tzinfo)
+    window_end = datetime.datetime.strptime(
+        config["calendar"]["window_end"], "%Y-%m-%d"
+    ).replace(tzinfo=tzinfo)
+
+    build_path = config["general"]["build_path"]
+    os.chdir(build_path)
+    common.install_graph_transport(config)
+
+    token = common.acquire_token(
+        config["credentials"]["client_id"],
+        config["credentials"]["authority"],
+        config["credentials"]["username"],
+        config["credentials"]["password"],
+        config["credentials"]["scope"].split(" "),
+    )
+    sync_calendar(token, config["calendar"]["address"], window_start, window_end)
+
+
+if __name__ == "__main__":
+    main()
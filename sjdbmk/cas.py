@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+#
+# Shared cache of downloads and parses for the Daily Bulletin Build System
+# Copyright (C) 2024 Runxi Yu <https://runxiyu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Lets several machines building the bulletin share what they download and
+# parse, so that only the first to get to a week does either:
+#
+# - A downloaded menu or The Week Ahead is kept as an object named by the
+#   SHA-256 of its content, with a ref from its name, e.g. menu-20240902, to
+#   that hash. Where the build would download it, the cached copy is used.
+# - A parse result is kept under the hash of its source file's hash, the
+#   parser version and any settings, so a changed file or parser misses.
+#
+# Where the cache lives is a backend: anything with get() and put() of bytes
+# by key, and chosen by [cache] backend. The directory backend included
+# works on a local directory or one that both machines mount. With no
+# [cache] directory there is no cache, and a cache that fails only logs a
+# warning, as the build can always do the work itself.
+#
+
+from __future__ import annotations
+from typing import Any, Callable, Optional, Protocol
+from configparser import ConfigParser
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+class Backend(Protocol):
+    def get(self, key: str) -> Optional[bytes]: ...
+
+    def put(self, key: str, data: bytes) -> None: ...
+
+
+class DirectoryBackend:
+    # Keys are paths under the directory. Every file is written under a
+    # temporary name and renamed into place, so another machine never reads
+    # half of one.
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            with open(os.path.join(self.directory, key), "rb") as fd:
+                return fd.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, data: bytes) -> None:
+        path = os.path.join(self.directory, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temporary_filename = tempfile.mkstemp(
+            prefix=".cas-", dir=os.path.dirname(path)
+        )
+        try:
+            with os.fdopen(fd, "wb") as temporary_file:
+                temporary_file.write(data)
+            # Readable by whoever else builds from the same mount
+            os.chmod(temporary_filename, 0o644)
+            os.replace(temporary_filename, path)
+        except BaseException:
+            os.unlink(temporary_filename)
+            raise
+
+
+def directory_backend(config: ConfigParser) -> Backend:
+    return DirectoryBackend(os.path.abspath(config["cache"]["directory"]))
+
+
+BACKENDS: dict[str, Callable[[ConfigParser], Backend]] = {
+    "directory": directory_backend,
+}
+
+backend: Optional[Backend] = None
+
+
+def install(config: ConfigParser) -> None:
+    global backend
+    if not config.get("cache", "directory", fallback=""):
+        backend = None
+        return
+    backend_name = config.get("cache", "backend", fallback="directory")
+    if backend_name not in BACKENDS:
+        raise ValueError("Unknown cache backend %s" % backend_name)
+    backend = BACKENDS[backend_name](config)
+
+
+def get(key: str) -> Optional[bytes]:
+    if backend is None:
+        return None
+    try:
+        return backend.get(key)
+    except OSError:
+        logger.warning("Reading %s from the cache failed" % key, exc_info=True)
+        return None
+
+
+def put(key: str, data: bytes) -> None:
+    if backend is None:
+        return
+    try:
+        backend.put(key, data)
+    except OSError:
+        logger.warning("Writing %s to the cache failed" % key, exc_info=True)
+
+
+def object_key(sha256: str) -> str:
+    return "objects/%s/%s" % (sha256[:2], sha256[2:])
+
+
+def fetch_input(name: str) -> Optional[str]:
+    # Writes the input cached under the name, e.g. menu-20240902, to the
+    # filename it was cached from, and returns that filename
+    ref = get("refs/%s.json" % name)
+    if ref is None:
+        return None
+    try:
+        entry = json.loads(ref)
+        sha256 = entry["sha256"]
+        filename = os.path.basename(entry["filename"])
+        if not isinstance(sha256, str) or not isinstance(filename, str):
+            raise TypeError("Cached ref is not a pair of strings")
+    except (ValueError, KeyError, TypeError):
+        logger.warning("Cached ref of %s is corrupt, ignoring it" % name)
+        return None
+    data = get(object_key(sha256))
+    if data is None or hashlib.sha256(data).hexdigest() != sha256:
+        logger.warning("Cached %s is missing or corrupt, ignoring it" % name)
+        return None
+    fd, temporary_filename = tempfile.mkstemp(prefix=".cas-", dir=".")
+    try:
+        with os.fdopen(fd, "wb") as temporary_file:
+            temporary_file.write(data)
+        os.replace(temporary_filename, filename)
+    except BaseException:
+        os.unlink(temporary_filename)
+        raise
+    logger.info("Using %s from the cache" % filename)
+    return filename
+
+
+def store_input(name: str, filename: str) -> None:
+    if backend is None:
+        return
+    with open(filename, "rb") as fd:
+        data = fd.read()
+    sha256 = hashlib.sha256(data).hexdigest()
+    # The object first, so that a ref never points at nothing
+    put(object_key(sha256), data)
+    put(
+        "refs/%s.json" % name,
+        json.dumps({"filename": filename, "sha256": sha256}).encode("utf-8"),
+    )
+
+
+def parsed_key(kind: str, key: dict[str, Any]) -> str:
+    return "parsed/%s/%s.json" % (
+        kind,
+        hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest(),
+    )
+
+
+def get_parsed(kind: str, key: dict[str, Any]) -> Optional[Any]:
+    data = get(parsed_key(kind, key))
+    if data is None:
+        return None
+    try:
+        parsed = json.loads(data)
+    except ValueError:
+        logger.warning("Cached parse of %s is corrupt, ignoring it" % kind)
+        return None
+    logger.info("Using the cached parse of %s" % kind)
+    return parsed
+
+
+def put_parsed(kind: str, key: dict[str, Any], value: Any) -> None:
+    put(
+        parsed_key(kind, key),
+        json.dumps(value, ensure_ascii=False).encode("utf-8"),
+    )
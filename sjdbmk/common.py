@@ -17,14 +17,117 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 #
 
-from typing import Any, Iterable, Iterator
+from __future__ import annotations
+from typing import Any, Iterable, Iterator, Optional, TYPE_CHECKING
+from configparser import ConfigParser
 import logging
+import os
 import re
 import base64
+import hashlib
 import shutil
+import time
 
-import requests
-import msal  # type: ignore
+# requests and msal are slow to import, so they are only loaded once
+# something actually talks to Graph
+if TYPE_CHECKING:
+    import requests
+
+from . import instrument
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRIES = 4
+MAX_RETRY_DELAY = 60.0
+REPLAY_TOKEN = "replayed-token"
+
+# Set by graphreplay: "live", "record", or "replay" when Graph is offline
+graph_mode = "live"
+
+_session: Optional[requests.Session] = None
+_msal_applications: dict[tuple[str, str], Any] = {}
+
+
+def http_session() -> requests.Session:
+    global _session
+    if _session is None:
+        import requests
+
+        _session = requests.Session()
+    return _session
+
+
+def install_graph_transport(config: ConfigParser) -> None:
+    if config.get("graph", "mode", fallback="live") == "live":
+        return
+    from . import graphreplay
+
+    graphreplay.install(http_session(), config)
+
+
+def replaying_graph() -> bool:
+    return graph_mode == "replay"
+
+
+def available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        # Not Linux
+        return os.cpu_count() or 1
+
+
+def retry_delay(response: requests.Response, attempt: int) -> float:
+    retry_after = response.headers.get("Retry-After")
+    delay = float(2**attempt)
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            import email.utils
+
+            try:
+                delay = (
+                    email.utils.parsedate_to_datetime(retry_after).timestamp()
+                    - time.time()
+                )
+            except (TypeError, ValueError):
+                pass
+    return min(max(delay, 0.0), MAX_RETRY_DELAY)
+
+
+def request(method: str, url: str, **kwargs: Any) -> requests.Response:
+    attempt = 0
+    while True:
+        start = time.perf_counter()
+        response = http_session().request(method, url, **kwargs)
+        if kwargs.get("stream"):
+            content_length = response.headers.get("Content-Length")
+            response_bytes = int(content_length) if content_length else None
+        else:
+            response_bytes = len(response.content)
+        instrument.record_http(
+            method,
+            url,
+            response.status_code,
+            response_bytes,
+            time.perf_counter() - start,
+            attempt,
+        )
+        # Graph throttles with 429, and sometimes with 503 and Retry-After
+        throttled = response.status_code == 429 or (
+            response.status_code == 503 and "Retry-After" in response.headers
+        )
+        if not throttled or attempt >= MAX_RETRIES:
+            return response
+        delay = retry_delay(response, attempt)
+        logger.warning(
+            "%s %s returned %d, retrying in %.1f seconds"
+            % (method, url.split("?", 1)[0], response.status_code, delay)
+        )
+        response.close()
+        time.sleep(delay)
+        attempt += 1
 
 
 def acquire_token(
@@ -34,13 +137,27 @@ def acquire_token(
     graph_password: str,
     graph_scopes: list[str],
 ) -> str:
-    app = msal.PublicClientApplication(
-        graph_client_id,
-        authority=graph_authority,
-    )
-    result = app.acquire_token_by_username_password(
-        graph_username, graph_password, scopes=graph_scopes
-    )
+    if replaying_graph():
+        return REPLAY_TOKEN
+    import msal  # type: ignore
+
+    # Reusing the application keeps its token cache, so a long-running
+    # process only logs in again once the token is about to expire
+    app = _msal_applications.get((graph_client_id, graph_authority))
+    if app is None:
+        app = msal.PublicClientApplication(
+            graph_client_id,
+            authority=graph_authority,
+        )
+        _msal_applications[(graph_client_id, graph_authority)] = app
+    accounts = app.get_accounts(username=graph_username)
+    result = None
+    if accounts:
+        result = app.acquire_token_silent(graph_scopes, account=accounts[0])
+    if not result or "access_token" not in result:
+        result = app.acquire_token_by_username_password(
+            graph_username, graph_password, scopes=graph_scopes
+        )
 
     if "access_token" in result:
         assert isinstance(result["access_token"], str)
@@ -48,8 +165,9 @@ def acquire_token(
     raise ValueError("Authentication error in password login")
 
 
-def search_mail(token: str, query_string: str) -> list[dict[str, Any]]:
-    hits = requests.post(
+def search_mail(token: str, query_string: str, size: int = 15) -> list[dict[str, Any]]:
+    hits = request(
+        "POST",
         "https://graph.microsoft.com/v1.0/search/query",
         headers={"Authorization": "Bearer " + token},
         json={
@@ -58,7 +176,7 @@ def search_mail(token: str, query_string: str) -> list[dict[str, Any]]:
                     "entityTypes": ["message"],
                     "query": {"queryString": query_string},
                     "from": 0,
-                    "size": 15,
+                    "size": size,
                     "enableTopResults": True,
                 }
             ]
@@ -76,11 +194,9 @@ def encode_sharing_url(url: str) -> str:
     )
 
 
-def download_share_url(
-    token: str, url: str, local_filename: str, chunk_size: int = 65536
-) -> None:
-
-    x = requests.get(
+def get_share_download_url(token: str, url: str) -> str:
+    x = request(
+        "GET",
         "https://graph.microsoft.com/v1.0/shares/%s/driveItem"
         % encode_sharing_url(url),
         headers={"Authorization": "Bearer " + token},
@@ -92,8 +208,18 @@ def download_share_url(
     except KeyError:
         print(x)
         raise ValueError("Download URL not found")
+    assert isinstance(download_direct_url, str)
+    return download_direct_url
 
-    with requests.get(
+
+def download_share_url(
+    token: str, url: str, local_filename: str, chunk_size: int = 65536
+) -> None:
+
+    download_direct_url = get_share_download_url(token, url)
+
+    with request(
+        "GET",
         download_direct_url,
         headers={
             "Authorization": "Bearer %s" % token,
@@ -131,5 +257,22 @@ def filter_mail_results_by_subject_regex_groups(
             yield (hit, [matched.group(group) for group in subject_regex_groups])
 
 
+def file_sha256(filename: str, chunk_size: int = 65536) -> str:
+    # Of the uncompressed content of a .gz file, so that compressing an old
+    # artifact does not change its hash
+    digest = hashlib.sha256()
+    if filename.endswith(".gz"):
+        import gzip
+
+        with gzip.open(filename, "rb") as gzip_file:
+            while chunk := gzip_file.read(chunk_size):
+                digest.update(chunk)
+    else:
+        with open(filename, "rb") as fd:
+            while chunk := fd.read(chunk_size):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
 class DailyBulletinError(Exception):
     pass
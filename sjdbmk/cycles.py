@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+#
+# Day of cycle computation for the Songjiang Daily Bulletin Build System
+# Copyright (C) 2024 Runxi Yu <https://runxiyu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Instead of maintaining cycles.json by hand, the [cycle] section describes
+# the term: its first and last days, the cycle's day labels, and the days
+# without school. No-school days may also come from all-day events in the
+# synced school calendar whose subject matches a pattern. The result is the
+# same date -> label table that cycles.json used to hold.
+#
+
+from __future__ import annotations
+from typing import Any, Iterable, Optional
+from configparser import ConfigParser
+import argparse
+import datetime
+import json
+import logging
+import os
+import re
+import zoneinfo
+
+from . import cal
+
+logger = logging.getLogger(__name__)
+
+
+def parse_date_ranges(specification: str) -> set[datetime.date]:
+    # "2024-10-01..2024-10-07 2024-09-16" -> every date listed, ranges inclusive
+    dates = set()
+    for item in specification.split():
+        first, _, last = item.partition("..")
+        start = datetime.date.fromisoformat(first)
+        end = datetime.date.fromisoformat(last) if last else start
+        while start <= end:
+            dates.add(start)
+            start += datetime.timedelta(days=1)
+    return dates
+
+
+def calendar_no_school_dates(
+    store: dict[str, Any], pattern: str, tzinfo: datetime.tzinfo
+) -> set[datetime.date]:
+    compiled = re.compile(pattern)
+    dates = set()
+    for event in store["events"].values():
+        if event.get("isCancelled") or not event.get("isAllDay"):
+            continue
+        if not compiled.search(event.get("subject") or ""):
+            continue
+        start_date, end_date = cal.event_dates(event, tzinfo)
+        while start_date < end_date:
+            dates.add(start_date)
+            start_date += datetime.timedelta(days=1)
+    return dates
+
+
+def compute_cycle_table(
+    term_start: datetime.date,
+    term_end: datetime.date,
+    labels: list[str],
+    no_school: Iterable[datetime.date],
+) -> dict[str, str]:
+    no_school = set(no_school)
+    table = {}
+    school_days = 0
+    date = term_start
+    while date <= term_end:
+        if date.weekday() < 5 and date not in no_school:
+            table[date.isoformat()] = labels[school_days % len(labels)]
+            school_days += 1
+        date += datetime.timedelta(days=1)
+    return table
+
+
+def term_arguments(config: ConfigParser) -> dict[str, Any]:
+    # The [cycle] section, as the arguments of cycle_table()
+    section = config["cycle"]
+    return {
+        "term_start": datetime.date.fromisoformat(section["term_start"]),
+        "term_end": datetime.date.fromisoformat(section["term_end"]),
+        "labels": section["labels"].split(),
+        "no_school": parse_date_ranges(section.get("no_school", "")),
+        "no_school_pattern": section.get("no_school_pattern", ""),
+        "tzinfo": zoneinfo.ZoneInfo(config["general"]["timezone"]),
+    }
+
+
+def cycle_table(
+    term_start: datetime.date,
+    term_end: datetime.date,
+    labels: list[str],
+    no_school: set[datetime.date],
+    no_school_pattern: str,
+    tzinfo: datetime.tzinfo,
+    store: Optional[dict[str, Any]] = None,
+) -> dict[str, str]:
+    if no_school_pattern:
+        if store is None:
+            store = cal.load_calendar_store()
+        no_school = no_school | calendar_no_school_dates(
+            store, no_school_pattern, tzinfo
+        )
+    return compute_cycle_table(term_start, term_end, labels, no_school)
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Print the day of cycle for every day of the term"
+    )
+    parser.add_argument(
+        "--write",
+        default=None,
+        help="also write the table to this file, in the cycles.json format",
+    )
+    parser.add_argument(
+        "--config", default="config.ini", help="path to the configuration file"
+    )
+    args = parser.parse_args()
+
+    config = ConfigParser()
+    config.read(args.config)
+
+    build_path = config["general"]["build_path"]
+    os.chdir(build_path)
+
+    term = term_arguments(config)
+    table = cycle_table(**term)
+    date = term["term_start"]
+    while date <= term["term_end"]:
+        if date.weekday() < 5:
+            print(
+                "%s %s %s"
+                % (
+                    date.isoformat(),
+                    date.strftime("%a"),
+                    table.get(date.isoformat(), "-"),
+                )
+            )
+        date += datetime.timedelta(days=1)
+    if args.write:
+        with open(args.write, "w", encoding="utf-8") as fd:
+            json.dump(table, fd, indent="\t")
+
+
+if __name__ == "__main__":
+    main()
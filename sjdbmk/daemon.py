@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+#
+# Resident build daemon for the Songjiang Daily Bulletin Build System
+# Copyright (C) 2024 Runxi Yu <https://runxiyu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Instead of building everything just before the bulletin goes out, this
+# stays running with its imports, Graph session and login warm, and keeps
+# the next school day's bulletin built:
+#
+# - The week of the next school day, and from [daemon] prefetch_from_weekday
+#   on also the next week, is built with weekly as soon as its menu and The
+#   Week Ahead can be fetched, retrying every prefetch_interval seconds.
+#   From fallback_hours before the week starts, a week that cannot be
+#   fetched is built from the last good week with those sections marked
+#   stale, and retried the same way until it can be patched.
+# - In The News is prefetched every in_the_news_interval seconds.
+# - day-*.json and sjdb-*.html for the next school day are checked whenever
+#   something in the build directory or the templates changes, watched with
+#   inotify where available and by polling otherwise, and rebuilt through
+#   buildgraph if one of their inputs actually did.
+#
+# New week files, In The News and approved inspirations all land in the build
+# directory, so the watcher is what triggers rebuilds for them too. Sending
+# stays a separate, deliberate step.
+#
+
+from __future__ import annotations
+from typing import Optional
+from configparser import ConfigParser
+import argparse
+import ctypes
+import ctypes.util
+import datetime
+import logging
+import os
+import select
+import struct
+import time
+import zoneinfo
+
+from . import (
+    buildgraph,
+    cal,
+    cas,
+    common,
+    daily,
+    instrument,
+    itn,
+    otd,
+    retention,
+    weekly,
+    weeks,
+)
+
+logger = logging.getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+INOTIFY_EVENT = struct.Struct("iIII")
+# Changes to anything else in the build directory, such as our own output,
+# never cause a rebuild
+INPUT_FILENAMES = {
+    "cycles.json",
+    otd.OTD_STORE_FILENAME,
+    itn.ITN_CACHE_FILENAME,
+    cal.CALENDAR_STORE_FILENAME,
+    weeks.WEEK_MANIFEST_FILENAME,
+}
+INPUT_PREFIXES = ["inspire-", "inspattach-", "week-"]
+
+
+class InotifyWatcher:
+    def __init__(self, directories: list[str]) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.directories = {}
+        for directory in directories:
+            watch = libc.inotify_add_watch(
+                self.fd,
+                os.fsencode(directory),
+                IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE,
+            )
+            if watch < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+            self.directories[watch] = directory
+
+    def wait(self, timeout: float) -> set[str]:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        changed: set[str] = set()
+        if not ready:
+            return changed
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                watch, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                changed.add(os.path.join(self.directories[watch], os.fsdecode(name)))
+
+
+class PollingWatcher:
+    def __init__(self, directories: list[str], interval: float = 5) -> None:
+        self.directories = directories
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def scan(self) -> dict[str, tuple[int, int]]:
+        snapshot = {}
+        for directory in self.directories:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    snapshot[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def wait(self, timeout: float) -> set[str]:
+        deadline = time.monotonic() + timeout
+        while True:
+            time.sleep(max(min(self.interval, deadline - time.monotonic()), 0))
+            snapshot = self.scan()
+            changed = {
+                path
+                for path in snapshot.keys() | self.snapshot.keys()
+                if snapshot.get(path) != self.snapshot.get(path)
+            }
+            self.snapshot = snapshot
+            if changed or time.monotonic() >= deadline:
+                return changed
+
+
+def make_watcher(directories: list[str]) -> InotifyWatcher | PollingWatcher:
+    try:
+        return InotifyWatcher(directories)
+    except (OSError, AttributeError, TypeError) as e:
+        # Not Linux, or out of watches
+        logger.warning("inotify unavailable, polling instead: %s" % e)
+        return PollingWatcher(directories)
+
+
+def next_school_day(now: datetime.datetime) -> datetime.datetime:
+    day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    day += datetime.timedelta(days=1)
+    while day.weekday() >= 5:
+        day += datetime.timedelta(days=1)
+    return day
+
+
+def week_start(day: datetime.datetime) -> datetime.datetime:
+    # Midnight, like next_school_day(), so the same week compares equal
+    day = day.replace(hour=0, minute=0, second=0, microsecond=0)
+    return day - datetime.timedelta(days=day.weekday())
+
+
+def is_input(path: str, template_directory: str) -> bool:
+    if os.path.dirname(os.path.abspath(path)) == template_directory:
+        return True
+    name = os.path.basename(path)
+    return name in INPUT_FILENAMES or any(
+        name.startswith(prefix) for prefix in INPUT_PREFIXES
+    )
+
+
+def warm_up() -> None:
+    # Pay for the slow imports and the first connection while nothing waits
+    import jinja2  # noqa: F401
+    import openpyxl  # noqa: F401
+
+    common.http_session()
+
+
+class Daemon:
+    def __init__(self, config: ConfigParser, trace_memory: bool = True) -> None:
+        self.config = config
+        self.trace_memory = trace_memory
+        self.tzinfo = zoneinfo.ZoneInfo(config["general"]["timezone"])
+        self.cycle_arguments = daily.cycle_data_arguments(config)
+        self.template_directory = os.path.abspath(config["templates"]["directory"])
+        self.prefetch_interval = config.getfloat(
+            "daemon", "prefetch_interval", fallback=1800
+        )
+        self.prefetch_from_weekday = config.getint(
+            "daemon", "prefetch_from_weekday", fallback=4
+        )
+        self.fallback_hours = config.getfloat("daemon", "fallback_hours", fallback=12)
+        self.in_the_news_interval = config.getfloat(
+            "daemon", "in_the_news_interval", fallback=3600
+        )
+        self.metrics_directory = config.get(
+            "metrics", "textfile_directory", fallback=None
+        )
+        self.next_prefetch = 0.0
+        self.next_in_the_news = 0.0
+        self.built_for: Optional[datetime.datetime] = None
+
+    def run_forever(self) -> None:
+        watcher = make_watcher([".", self.template_directory])
+        dirty = True
+        while True:
+            now = datetime.datetime.now(self.tzinfo)
+            if time.monotonic() >= self.next_prefetch:
+                self.prefetch_weeks(now)
+                self.next_prefetch = time.monotonic() + self.prefetch_interval
+            if time.monotonic() >= self.next_in_the_news:
+                self.refresh_in_the_news()
+                self.next_in_the_news = time.monotonic() + self.in_the_news_interval
+            target = next_school_day(now)
+            if dirty or target != self.built_for:
+                self.build_day(target)
+                dirty = False
+            timeout = max(
+                min(self.next_prefetch, self.next_in_the_news) - time.monotonic(),
+                1,
+            )
+            # Wake up at least every minute to notice the day rolling over
+            changed = watcher.wait(min(timeout, 60))
+            inputs = [
+                path for path in changed if is_input(path, self.template_directory)
+            ]
+            if inputs:
+                logger.info("Inputs changed: %s" % ", ".join(sorted(inputs)))
+                dirty = True
+
+    def prefetch_weeks(self, now: datetime.datetime) -> None:
+        mondays = [week_start(next_school_day(now))]
+        if now.weekday() >= self.prefetch_from_weekday:
+            next_monday = week_start(now) + datetime.timedelta(days=7)
+            if next_monday not in mondays:
+                mondays.append(next_monday)
+        for monday in mondays:
+            week_filename = "week-%s.json" % monday.strftime("%Y%m%d")
+            if retention.exists(week_filename):
+                stale = weeks.read_week(week_filename).stale
+                if not stale:
+                    continue
+                logger.info(
+                    "Retrying %s for the week of %s"
+                    % (", ".join(stale), monday.strftime("%Y-%m-%d"))
+                )
+                fallback = True
+            else:
+                logger.info("Prefetching the week of %s" % monday.strftime("%Y-%m-%d"))
+                fallback = monday - now <= datetime.timedelta(hours=self.fallback_hours)
+            try:
+                with instrument.run(
+                    "weekly",
+                    trace_memory=self.trace_memory,
+                    metrics_directory=self.metrics_directory,
+                ):
+                    weekly.generate(
+                        datetime_target=monday,
+                        fallback=fallback,
+                        **weekly.generate_arguments(self.config),
+                    )
+            except Exception:
+                # Usually the menu or The Week Ahead is not out yet
+                logger.exception(
+                    "Week of %s not ready, retrying in %d seconds"
+                    % (monday.strftime("%Y-%m-%d"), self.prefetch_interval)
+                )
+
+    def refresh_in_the_news(self) -> None:
+        try:
+            itn.prefetch()
+        except Exception:
+            logger.exception("In The News prefetch failed")
+
+    def build_day(self, day: datetime.datetime) -> None:
+        self.built_for = day
+        try:
+            weeks.find_week(day)
+        except FileNotFoundError:
+            logger.info(
+                "Not building %s before its week is ready" % day.strftime("%Y-%m-%d")
+            )
+            return
+        logger.info("Building %s" % day.strftime("%Y-%m-%d"))
+        try:
+            with instrument.run(
+                "daemon",
+                trace_memory=self.trace_memory,
+                metrics_directory=self.metrics_directory,
+            ):
+                rebuilt = buildgraph.build_day(
+                    buildgraph.BuildGraph(),
+                    self.config,
+                    daily.load_cycle_data(**self.cycle_arguments),
+                    day,
+                )
+        except Exception:
+            logger.exception("Building %s failed" % day.strftime("%Y-%m-%d"))
+            return
+        if not rebuilt:
+            logger.info("%s is up to date" % day.strftime("%Y-%m-%d"))
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Keep the next Daily Bulletin built, prefetching its inputs"
+    )
+    parser.add_argument(
+        "--no-trace-memory",
+        dest="trace_memory",
+        action="store_false",
+        help="leave peak memory out of the run reports, which is faster",
+    )
+    parser.add_argument(
+        "--config", default="config.ini", help="path to the configuration file"
+    )
+    args = parser.parse_args()
+
+    config = ConfigParser()
+    config.read(args.config)
+
+    # Relative to where we were started, as for pack
+    config["templates"]["directory"] = os.path.abspath(config["templates"]["directory"])
+    config["general"]["build_path"] = os.path.abspath(config["general"]["build_path"])
+    os.chdir(config["general"]["build_path"])
+    common.install_graph_transport(config)
+    cas.install(config)
+
+    warm_up()
+    Daemon(config, trace_memory=args.trace_memory).run_forever()
+
+
+if __name__ == "__main__":
+    main()
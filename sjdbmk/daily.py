@@ -29,7 +29,7 @@ import base64
 import mimetypes
 import typing
 
-# import legacy_wikipedia
+from . import otd, itn, cycles, deadline, instrument, model, retention, store, weeks
 
 logger = logging.getLogger(__name__)
 
@@ -45,6 +45,53 @@ DAYNAMES = [
 ]
 DAYNAMES_CHINESE = ["周一", "周二", "周三", "周四", "周五", "周六", "周日", "周一"]
 DAYNAMES_SHORT = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun", "Mon"]
+# Ranges shorter than this are written in-process, as starting the pool
+# would take longer than writing them
+POOL_MINIMUM_DAYS = 10
+IN_THE_NEWS_FIELDS = ["in_the_news_html_en", "in_the_news_html_zh"]
+
+
+def cycle_data_arguments(config: ConfigParser) -> dict[str, typing.Any]:
+    # The [cycle] term if there is one, and the cycle_data file otherwise
+    if config.has_section("cycle"):
+        return {"term": cycles.term_arguments(config)}
+    return {"cycle_data_filename": config["general"]["cycle_data"]}
+
+
+def load_cycle_data(
+    term: typing.Optional[dict[str, typing.Any]] = None,
+    cycle_data_filename: typing.Optional[str] = None,
+) -> dict[str, str]:
+    if term is not None:
+        return cycles.cycle_table(**term)
+    assert cycle_data_filename is not None
+    with open(cycle_data_filename, "r", encoding="utf-8") as cycle_data_file:
+        cycle_data = json.load(cycle_data_file)
+    assert isinstance(cycle_data, dict)
+    return cycle_data
+
+
+def choose_inspiration(
+    stddate: str,
+) -> typing.Optional[tuple[str, dict[str, typing.Any]]]:
+    # "used" holds the date an inspiration was used on, so building the same
+    # day again picks the same one instead of using up another. Inspirations
+    # from before this have it set to True.
+    chosen = None
+    for inspfn in sorted(os.listdir()):
+        if not inspfn.startswith("inspire-"):
+            continue
+        with open(inspfn, "r", encoding="utf-8") as inspfd:
+            candidate = json.load(inspfd)
+        if candidate["used"] == stddate:
+            return (inspfn, candidate)
+        if (not candidate["approved"]) or candidate["used"] or chosen:
+            continue
+        if candidate["type"] not in ["text", "media", "canteen"]:
+            logger.warning("Inspiration type for %s invalid, skipping" % inspfn)
+            continue
+        chosen = (inspfn, candidate)
+    return chosen
 
 
 def main() -> None:
@@ -57,11 +104,42 @@ def main() -> None:
         # TODO: Verify validity of date
         # TODO: Verify consistency of date elsewhere
     )
+    parser.add_argument(
+        "--from",
+        dest="first",
+        default=None,
+        help="generate for every school day from this one on, in YYYY-MM-DD, instead of --date",
+    )
+    parser.add_argument(
+        "--to",
+        dest="last",
+        default=None,
+        help="the last day of a --from range, in YYYY-MM-DD; defaults to the Friday of that school week",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=None,
+        help="processes writing the days of a long range; defaults to the CPU count",
+    )
     parser.add_argument(
         "--config", default="config.ini", help="path to the configuration file"
     )
+    parser.add_argument(
+        "--profile", action="store_true", help="dump a cProfile of this run"
+    )
+    parser.add_argument(
+        "--no-trace-memory",
+        dest="trace_memory",
+        action="store_false",
+        help="leave peak memory out of the run report, which is faster",
+    )
     args = parser.parse_args()
 
+    if args.first:
+        generate_range_main(args)
+        return
+
     if args.date:
         datetime_target_naive = datetime.datetime.strptime(args.date, "%Y-%m-%d")
     else:
@@ -81,196 +159,426 @@ def main() -> None:
     del datetime_target_naive
     logger.info("Generating for %s" % datetime_target_aware.strftime("%Y-%m-%d %Z"))
 
+    cycle_arguments = cycle_data_arguments(config)
     build_path = config["general"]["build_path"]
     os.chdir(build_path)
 
-    cycle_data_path = config["general"]["cycle_data"]
-    with open(cycle_data_path, "r", encoding="utf-8") as cycle_data_file:
-        cycle_data = json.load(cycle_data_file)
+    with instrument.run(
+        "daily",
+        profile=args.profile,
+        trace_memory=args.trace_memory,
+        metrics_directory=config.get("metrics", "textfile_directory", fallback=None),
+    ):
+        with instrument.stage("load_cycles"):
+            cycle_data = load_cycle_data(**cycle_arguments)
 
-    the_week_ahead_url = config["the_week_ahead"]["file_url"]
+        the_week_ahead_url = config["the_week_ahead"]["file_url"]
+        in_the_news_ttl = config.getfloat("in_the_news", "ttl", fallback=21600)
 
-    generate(
-        datetime_target_aware,
-        cycle_data=cycle_data,
-        the_week_ahead_url=the_week_ahead_url,
+        generate(
+            datetime_target_aware,
+            cycle_data=cycle_data,
+            the_week_ahead_url=the_week_ahead_url,
+            in_the_news_ttl=in_the_news_ttl,
+            build_deadline=deadline.from_config(config, datetime_target_aware),
+        )
+
+
+def generate_range_main(args: argparse.Namespace) -> None:
+    config = ConfigParser()
+    config.read(args.config)
+
+    tzinfo = zoneinfo.ZoneInfo(config["general"]["timezone"])
+    first = datetime.datetime.strptime(args.first, "%Y-%m-%d").replace(tzinfo=tzinfo)
+    if args.last:
+        last = datetime.datetime.strptime(args.last, "%Y-%m-%d").replace(tzinfo=tzinfo)
+    else:
+        # The Friday of the school week, which for a weekend is the next one
+        last = first + datetime.timedelta(days=(4 - first.weekday()) % 7)
+    if last < first:
+        raise ValueError(
+            "--to %s is before --from %s"
+            % (last.strftime("%Y-%m-%d"), first.strftime("%Y-%m-%d"))
+        )
+    logger.info(
+        "Generating for %s to %s"
+        % (first.strftime("%Y-%m-%d"), last.strftime("%Y-%m-%d %Z"))
     )
 
+    cycle_arguments = cycle_data_arguments(config)
+    build_path = config["general"]["build_path"]
+    os.chdir(build_path)
+
+    with instrument.run(
+        "daily",
+        profile=args.profile,
+        trace_memory=args.trace_memory,
+        metrics_directory=config.get("metrics", "textfile_directory", fallback=None),
+    ):
+        with instrument.stage("load_cycles"):
+            cycle_data = load_cycle_data(**cycle_arguments)
+        written = generate_range(
+            weeks.school_days(first, last),
+            the_week_ahead_url=config["the_week_ahead"]["file_url"],
+            cycle_data=cycle_data,
+            in_the_news_ttl=config.getfloat("in_the_news", "ttl", fallback=21600),
+            jobs=args.jobs,
+            build_deadline=deadline.Deadline(
+                None, 0.0, deadline.budgets_from_config(config)
+            ),
+        )
+    logger.info("Wrote %d day files" % len(written))
+
 
 def generate(
     datetime_target: datetime.datetime,
     the_week_ahead_url: str,
     cycle_data: dict[str, str],
+    in_the_news_ttl: float = 21600,
+    build_deadline: typing.Optional[deadline.Deadline] = None,
+    keep_in_the_news: bool = False,
 ) -> str:
+    # With keep_in_the_news, In The News stays as the last build of the day
+    # had it, for rebuilding days whose news the cache no longer holds
+    with instrument.stage("load_week"):
+        week_filename, days_since_beginning = weeks.find_week(datetime_target)
+
+    logger.info("Checking for inspirations")
+    stddate = datetime_target.strftime("%Y-%m-%d")
+    with instrument.stage("inspirations"):
+        chosen = choose_inspiration(stddate)
+        if chosen:
+            mark_inspiration_used(chosen[0], chosen[1], stddate)
+    logger.info("Finished processing inspirations")
+
+    logger.info("Starting In The News")
+    with instrument.stage("in_the_news"):
+        if keep_in_the_news:
+            in_the_news = previous_build(stddate, IN_THE_NEWS_FIELDS)
+        else:
+            in_the_news = deadline.run_section(
+                build_deadline,
+                "in_the_news",
+                read_in_the_news,
+                in_the_news_ttl,
+                fallback=lambda: previous_build(stddate, IN_THE_NEWS_FIELDS),
+            )
+    logger.info("Finished In The News")
+
+    return write_day(
+        datetime_target,
+        the_week_ahead_url,
+        cycle_data.get(stddate),
+        week_filename,
+        days_since_beginning,
+        chosen,
+        in_the_news,
+        build_deadline,
+    )[0]
+
+
+def generate_range(
+    datetime_targets: list[datetime.datetime],
+    the_week_ahead_url: str,
+    cycle_data: dict[str, str],
+    in_the_news_ttl: float = 21600,
+    jobs: typing.Optional[int] = None,
+    build_deadline: typing.Optional[deadline.Deadline] = None,
+) -> list[str]:
+    # Everything shared between the days is read once here, and only the
+    # per-day work is left to write_day, in a process pool for long ranges
+    located = {}
+    with instrument.stage("load_weeks"):
+        for datetime_target in datetime_targets:
+            try:
+                located[datetime_target] = weeks.find_week(datetime_target)
+            except FileNotFoundError:
+                logger.warning(
+                    "No week file for %s, skipping it"
+                    % datetime_target.strftime("%Y-%m-%d")
+                )
+    stddates = [
+        datetime_target.strftime("%Y-%m-%d") for datetime_target in located.keys()
+    ]
+    with instrument.stage("inspirations"):
+        assigned = assign_inspirations(stddates)
+        for stddate, chosen in assigned.items():
+            if chosen:
+                mark_inspiration_used(chosen[0], chosen[1], stddate)
+    past = {
+        stddate: datetime_target.date()
+        < datetime.datetime.now(datetime_target.tzinfo).date()
+        for datetime_target, stddate in zip(located.keys(), stddates)
+    }
+    with instrument.stage("in_the_news"):
+        # Days already past keep their last build's In The News, as with
+        # generate(keep_in_the_news=True), and the rest share today's
+        in_the_news: dict[str, tuple[typing.Any, ...]] = {
+            stddate: previous_build(stddate, IN_THE_NEWS_FIELDS)
+            for stddate in stddates
+            if past[stddate]
+        }
+        if not all(past.values()):
+            current_in_the_news = deadline.run_section(
+                build_deadline,
+                "in_the_news",
+                read_in_the_news,
+                in_the_news_ttl,
+                fallback=lambda: (None, None),
+            )
+            for stddate in stddates:
+                if not past[stddate]:
+                    in_the_news[stddate] = current_in_the_news
+
+    tasks = [
+        (
+            datetime_target,
+            the_week_ahead_url,
+            cycle_data.get(stddate),
+            week_filename,
+            days_since_beginning,
+            assigned[stddate],
+            in_the_news[stddate],
+            build_deadline,
+        )
+        for (datetime_target, (week_filename, days_since_beginning)), stddate in zip(
+            located.items(), stddates
+        )
+    ]
+    with instrument.stage("write_days"):
+        if len(tasks) < POOL_MINIMUM_DAYS or jobs == 1:
+            return [write_day(*task)[0] for task in tasks]
+        import concurrent.futures
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(write_day, *zip(*tasks)))
+        # Degraded in the workers, so not yet in this process's run report
+        for _, degradations in results:
+            for degradation in degradations:
+                deadline.record(degradation)
+        return [day_filename for day_filename, _ in results]
+
+
+def assign_inspirations(
+    stddates: list[str],
+) -> dict[str, typing.Optional[tuple[str, dict[str, typing.Any]]]]:
+    # The same as calling choose_inspiration() for each day in order and
+    # marking its choice used, but reading every inspiration only once
+    dated = {}
+    unused = []
+    for inspfn in sorted(os.listdir()):
+        if not inspfn.startswith("inspire-"):
+            continue
+        with open(inspfn, "r", encoding="utf-8") as inspfd:
+            candidate = json.load(inspfd)
+        if isinstance(candidate["used"], str):
+            dated[candidate["used"]] = (inspfn, candidate)
+            continue
+        if (not candidate["approved"]) or candidate["used"]:
+            continue
+        if candidate["type"] not in ["text", "media", "canteen"]:
+            logger.warning("Inspiration type for %s invalid, skipping" % inspfn)
+            continue
+        unused.append((inspfn, candidate))
+    unused.reverse()
+    assigned: dict[str, typing.Optional[tuple[str, dict[str, typing.Any]]]] = {}
+    for stddate in sorted(stddates):
+        if stddate in dated:
+            assigned[stddate] = dated[stddate]
+        else:
+            assigned[stddate] = unused.pop() if unused else None
+    return assigned
+
+
+def mark_inspiration_used(
+    inspfn: str, inspjq: dict[str, typing.Any], stddate: str
+) -> None:
+    if inspjq["used"] == stddate:
+        return
+    inspjq["used"] = stddate
+    with open(inspfn, "w", encoding="utf-8") as inspfd:
+        json.dump(inspjq, inspfd, indent="\t")
+
+
+def read_in_the_news(
+    in_the_news_ttl: float,
+) -> tuple[typing.Optional[str], typing.Optional[str]]:
+    return (
+        itn.read_in_the_news("en", in_the_news_ttl),
+        itn.read_in_the_news("zh", in_the_news_ttl),
+    )
+
+
+def previous_build(stddate: str, fields: list[str]) -> tuple[typing.Any, ...]:
+    # The fields as the last build of the day had them, where there was one
+    try:
+        with retention.open_artifact("day-%s.json" % stddate.replace("-", "")) as fd:
+            data = json.load(fd)
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        data = (store.get_day(stddate) if store.enabled() else None) or {}
+    values = tuple(data.get(field) for field in fields)
+    logger.info(
+        "%s from the previous build of %s: %s"
+        % (
+            ", ".join(fields),
+            stddate,
+            "found" if any(values) else "none",
+        )
+    )
+    return values
+
+
+def read_inspiration_image(
+    inspiration_image_fn: str,
+) -> tuple[typing.Optional[str], typing.Optional[str]]:
+    # Base64 data and MIME type, as the template embeds it
+    inspiration_image_mime, inspiration_image_extra_encoding = mimetypes.guess_type(
+        inspiration_image_fn
+    )
+    assert not inspiration_image_extra_encoding
+    with open("inspattach-%s" % os.path.basename(inspiration_image_fn), "rb") as ifd:
+        inspiration_image_data = base64.b64encode(ifd.read()).decode("ascii")
+    return inspiration_image_data, inspiration_image_mime
+
+
+def read_on_this_day(
+    datetime_target: datetime.datetime,
+) -> tuple[typing.Optional[str], typing.Optional[str]]:
+    return (
+        otd.read_on_this_day("en", datetime_target.strftime("%m-%d")),
+        otd.read_on_this_day("zh", datetime_target.strftime("%m-%d")),
+    )
+
+
+def write_day(
+    datetime_target: datetime.datetime,
+    the_week_ahead_url: str,
+    day_of_cycle: typing.Optional[str],
+    week_filename: str,
+    days_since_beginning: int,
+    chosen: typing.Optional[tuple[str, dict[str, typing.Any]]],
+    in_the_news: tuple[typing.Optional[str], typing.Optional[str]],
+    build_deadline: typing.Optional[deadline.Deadline] = None,
+) -> tuple[str, list[dict[str, str]]]:
+    # Community Time, the menu and the AOD are essential, so they are never
+    # put under the deadline. Returns the day file and the sections degraded
+    # writing it, which a process pool has to hand back to its parent.
+    degraded_before = len(deadline.degradations)
+    stddate = datetime_target.strftime("%Y-%m-%d")
     weekday_enum = datetime_target.weekday()
     weekday_en = DAYNAMES[weekday_enum]
     weekday_zh = DAYNAMES_CHINESE[weekday_enum]
     weekdays_short = DAYNAMES_SHORT[weekday_enum:]
     weekday_short = weekdays_short[0]
     next_weekday_short = weekdays_short[1]
-    try:
-        day_of_cycle = cycle_data[datetime_target.strftime("%Y-%m-%d")]
-    except KeyError:
+    if day_of_cycle is None:
         day_of_cycle = "SA"
         logger.warning('Cycle day not found, using "SA"')
 
-    for days_since_beginning in range(0, 5):
-        week_start_date = datetime_target - datetime.timedelta(
-            days=days_since_beginning
-        )
-        try:
-            with open(
-                "week-%s.json" % week_start_date.strftime("%Y%m%d"),
-                "r",
-                encoding="utf-8",
-            ) as week_file:
-                week_data = json.load(week_file)
-        except FileNotFoundError:
-            continue
-        else:
-            break
-    else:
-        raise FileNotFoundError(
-            "Cannot find a week-{date}.json file without five prior days"
-        )
-
-    try:
-        aod = week_data["aods"][days_since_beginning]
-    except IndexError:
+    week = weeks.read_week(week_filename)
+    aod = week.aod(days_since_beginning)
+    if aod is None:
         logger.warning("AOD not found")
         aod = "None"
 
-    breakfast_today = week_data["menu"]["Breakfast"][weekday_short]
-    lunch_today = week_data["menu"]["Lunch"][weekday_short]
-    try:
-        dinner_today = week_data["menu"]["Dinner"][weekday_short]
-    except KeyError:
-        dinner_today = None
-    try:
-        breakfast_tomorrow = week_data["menu"]["Breakfast"][next_weekday_short]
-    except KeyError:
-        breakfast_tomorrow = None
-    try:
-        snack_morning = week_data["snacks"]["Morning"][days_since_beginning]
-    except (KeyError, IndexError):
-        snack_morning = None
-    try:
-        snack_afternoon = week_data["snacks"]["Afternoon"][days_since_beginning]
-    except (KeyError, IndexError):
-        snack_afternoon = None
-    try:
-        snack_evening = week_data["snacks"]["Evening"][days_since_beginning]
-    except (KeyError, IndexError):
-        snack_evening = None
+    breakfast_today = week.meal("Breakfast", weekday_short)
+    lunch_today = week.meal("Lunch", weekday_short)
+    if breakfast_today is None or lunch_today is None:
+        raise KeyError(
+            "No breakfast or lunch for %s in %s" % (weekday_short, week_filename)
+        )
+    dinner_today = week.meal("Dinner", weekday_short)
+    breakfast_tomorrow = week.meal("Breakfast", next_weekday_short)
 
-    logger.info("Checking for inspirations")
-    # TODO: Should probably allow inspirations to be reused on the same day
-    # e.g. "used" should be set to the date it was used on
-    for inspfn in os.listdir():
-        if not inspfn.startswith("inspire-"):
-            continue
-        with open(inspfn, "r", encoding="utf-8") as inspfd:
-            inspjq = json.load(inspfd)
-            if (not inspjq["approved"]) or inspjq["used"]:
-                continue
-            inspjq["used"] = True
-        with open(inspfn, "w", encoding="utf-8") as inspfd:
-            json.dump(inspjq, inspfd, indent="\t")
-        inspiration_type = inspjq["type"]
-        if inspiration_type not in ["text", "media", "canteen"]:
-            logger.warning("Inspiration type for %s invalid, skipping" % inspfn)
-            continue
-        inspiration_origin = inspjq["origin"]
-        inspiration_shared_by = inspjq["uname"]
-        inspiration_text = inspjq["text"]
-        inspiration_image_fn = inspjq["file"]
-        if inspiration_image_fn:
-            logger.info("Inspiration has attachment %s" % inspiration_image_fn)
-            inspiration_image_mime, inspiration_image_extra_encoding = (
-                mimetypes.guess_type(inspiration_image_fn)
-            )
-            assert not inspiration_image_extra_encoding
-            with open(
-                "inspattach-%s" % os.path.basename(inspiration_image_fn), "rb"
-            ) as ifd:
-                inspiration_image_data = base64.b64encode(ifd.read()).decode("ascii")
+    with instrument.stage("inspiration_attachment"):
+        if chosen:
+            inspfn, inspjq = chosen
+            inspiration_type = inspjq["type"]
+            inspiration_origin = inspjq["origin"]
+            inspiration_shared_by = inspjq["uname"]
+            inspiration_text = inspjq["text"]
+            inspiration_image_fn = inspjq["file"]
+            if inspiration_image_fn:
+                logger.info("Inspiration has attachment %s" % inspiration_image_fn)
+                inspiration_image_data, inspiration_image_mime = deadline.run_section(
+                    build_deadline,
+                    "inspiration_image",
+                    read_inspiration_image,
+                    inspiration_image_fn,
+                    fallback=lambda: previous_build(
+                        stddate, ["inspiration_image_data", "inspiration_image_mime"]
+                    ),
+                )
+            else:
+                inspiration_image_data = None
+                inspiration_image_mime = None
         else:
             inspiration_image_data = None
             inspiration_image_mime = None
-        break
-    else:
-        inspiration_image_data = None
-        inspiration_image_mime = None
-        inspiration_type = None
-        inspiration_origin = None
-        inspiration_shared_by = None
-        inspiration_text = None
-        inspiration_image_fn = None
+            inspiration_type = None
+            inspiration_origin = None
+            inspiration_shared_by = None
+            inspiration_text = None
+            inspiration_image_fn = None
 
-    logger.info("Finished processing inspirations")
     logger.info("Starting On This Day")
 
-    on_this_day_html_en = None
-    on_this_day_html_zh = None
-    # on_this_day_html_en: typing.Optional[str]
-    # try:
-    #     with open("otd_en-%s.html" % datetime_target.strftime("%m-%d"), "r") as fd:
-    #         on_this_day_html_en = fd.read()
-    # except FileNotFoundError:
-    #     logger.warning("On This Day English not found")
-    # on_this_day_html_zh: typing.Optional[str]
-    # try:
-    #     with open("otd_zh-%s.html" % datetime_target.strftime("%m-%d"), "r") as fd:
-    #         on_this_day_html_zh = fd.read()
-    # except FileNotFoundError:
-    #     logger.warning("On This Day Chinese not found")
-    # logger.info("Finished On This Day")
-
-    in_the_news_html_en = None
-    in_the_news_html_zh = None
-    # logger.info("Starting In The News")
-    # in_the_news_html_en = legacy_wikipedia.get_in_the_news_en()
-    # in_the_news_html_zh = legacy_wikipedia.get_in_the_news_zh()
-    # logger.info("Finished In The News")
-
-    data = {
-        "stddate": datetime_target.strftime("%Y-%m-%d"),
-        "community_time": week_data["community_time"][days_since_beginning:],
-        "days_after_this": len(week_data["community_time"][days_since_beginning:]) - 1,
-        "aod": aod,
-        "weekday_english": weekday_en,
-        "weekdays_abbrev": weekdays_short,
-        "weekday_chinese": weekday_zh,
-        "day_of_cycle": day_of_cycle,
-        "today_breakfast": breakfast_today,
-        "today_lunch": lunch_today,
-        "today_dinner": dinner_today,
-        "next_breakfast": breakfast_tomorrow,
-        "the_week_ahead_url": the_week_ahead_url,
-        "today_snack": {
-            "Morning": snack_morning,
-            "Afternoon": snack_afternoon,
-            "Evening": snack_evening,
+    with instrument.stage("on_this_day"):
+        on_this_day_html_en, on_this_day_html_zh = deadline.run_section(
+            build_deadline,
+            "on_this_day",
+            read_on_this_day,
+            datetime_target,
+            fallback=lambda: previous_build(
+                stddate, ["on_this_day_html_en", "on_this_day_html_zh"]
+            ),
+        )
+    logger.info("Finished On This Day")
+
+    in_the_news_html_en, in_the_news_html_zh = in_the_news
+
+    day = model.Day(
+        stddate=stddate,
+        community_time=week.community_time_from(days_since_beginning),
+        aod=aod,
+        weekday_english=weekday_en,
+        weekdays_abbrev=weekdays_short,
+        weekday_chinese=weekday_zh,
+        day_of_cycle=day_of_cycle,
+        today_breakfast=breakfast_today,
+        today_lunch=lunch_today,
+        today_dinner=dinner_today,
+        next_breakfast=breakfast_tomorrow,
+        the_week_ahead_url=the_week_ahead_url,
+        today_snack={
+            time: week.snack(time, days_since_beginning) for time in model.SNACK_TIMES
         },
-        "inspiration_type": inspiration_type,
-        "inspiration_shared_by": inspiration_shared_by,
-        "inspiration_origin": inspiration_origin,
-        "inspiration_text": inspiration_text,
-        "inspiration_image_data": inspiration_image_data,
-        "inspiration_image_mime": inspiration_image_mime,
-        "on_this_day_html_en": on_this_day_html_en,
-        "on_this_day_html_zh": on_this_day_html_zh,
-        "in_the_news_html_en": in_the_news_html_en,
-        "in_the_news_html_zh": in_the_news_html_zh,
-    }
-    with open(
-        "day-%s.json" % datetime_target.strftime("%Y%m%d"), "w", encoding="utf-8"
-    ) as fd:
-        json.dump(data, fd, ensure_ascii=False, indent="\t")
+        inspiration_type=inspiration_type,
+        inspiration_shared_by=inspiration_shared_by,
+        inspiration_origin=inspiration_origin,
+        inspiration_text=inspiration_text,
+        inspiration_image_data=inspiration_image_data,
+        inspiration_image_mime=inspiration_image_mime,
+        on_this_day_html_en=on_this_day_html_en,
+        on_this_day_html_zh=on_this_day_html_zh,
+        in_the_news_html_en=in_the_news_html_en,
+        in_the_news_html_zh=in_the_news_html_zh,
+        stale=week.stale,
+    )
+    with instrument.stage("write"):
+        with open(
+            "day-%s.json" % datetime_target.strftime("%Y%m%d"), "w", encoding="utf-8"
+        ) as fd:
+            json.dump(day.to_json(), fd, ensure_ascii=False, indent="\t")
+        if store.enabled():
+            store.put_day(day.stddate, day.to_json())
     logger.info(
         "Data dumped to " + "day-%s.json" % datetime_target.strftime("%Y%m%d"),
     )
-    return "day-%s.json" % datetime_target.strftime("%Y%m%d")
+    return (
+        "day-%s.json" % datetime_target.strftime("%Y%m%d"),
+        deadline.degradations[degraded_before:],
+    )
 
 
 if __name__ == "__main__":
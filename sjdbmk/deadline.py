@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+#
+# Time budgets for the optional sections of the Daily Bulletin
+# Copyright (C) 2024 Runxi Yu <https://runxiyu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# A bulletin has to be built by the time it is sent, at [sendmail] hour and
+# minute on its day, less [deadline] margin seconds for packing and sending.
+#
+# Community Time, the menu and the AOD are essential and always run. The
+# optional sections, In The News, On This Day and the inspiration image,
+# each get [deadline] seconds, cut down to what is left before the deadline.
+# A section that runs over or fails falls back to its value in the previous
+# build of the same day, or is left out, and the run report lists it under
+# "degraded". Within the margin, optional sections fall back without
+# running at all. Once the send time has passed, as for late or old days,
+# only the per-section budgets apply.
+#
+# A section that runs over is left running in a daemon thread, which is
+# abandoned when the process exits.
+#
+
+from __future__ import annotations
+from typing import Any, Callable, NamedTuple, Optional, TypeVar
+from configparser import ConfigParser
+import datetime
+import logging
+import threading
+import time
+
+from . import instrument
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Seconds before the send time
+DEFAULT_MARGIN = 300
+# Seconds for each optional section
+DEFAULT_BUDGETS = {
+    "in_the_news": 2.0,
+    "on_this_day": 2.0,
+    "inspiration_image": 5.0,
+}
+
+# Sections degraded in this process since the last reset(), so that callers
+# can tell whether something they ran was, and pass on those degraded in
+# other processes
+degradations: list[dict[str, str]] = []
+
+
+class Deadline(NamedTuple):
+    # A plain tuple, so that it goes to the processes writing a range of days
+    send_at: Optional[float]
+    margin: float
+    budgets: dict[str, float]
+
+    def budget(self, section: str) -> float:
+        # Zero within the margin before the send time
+        seconds = self.budgets.get(section, DEFAULT_BUDGETS[section])
+        if self.send_at is not None:
+            now = time.time()
+            if now < self.send_at:
+                seconds = min(seconds, max(self.send_at - self.margin - now, 0.0))
+        return seconds
+
+
+def budgets_from_config(config: ConfigParser) -> dict[str, float]:
+    return {
+        section: config.getfloat("deadline", section, fallback=default)
+        for section, default in DEFAULT_BUDGETS.items()
+    }
+
+
+def from_config(config: ConfigParser, datetime_target: datetime.datetime) -> Deadline:
+    send_at = datetime_target.replace(
+        hour=int(config["sendmail"]["hour"]),
+        minute=int(config["sendmail"]["minute"]),
+        second=0,
+        microsecond=0,
+    )
+    return Deadline(
+        send_at.timestamp(),
+        config.getfloat("deadline", "margin", fallback=DEFAULT_MARGIN),
+        budgets_from_config(config),
+    )
+
+
+def reset() -> None:
+    # At the start of each build, so that a long-running process such as the
+    # daemon does not keep every degradation it has ever seen
+    degradations.clear()
+
+
+def record(degradation: dict[str, str]) -> None:
+    degradations.append(degradation)
+    report = instrument.current()
+    if report is not None:
+        report.notes.setdefault("degraded", []).append(degradation)
+
+
+def degrade(section: str, reason: str) -> None:
+    logger.warning("Degraded %s: %s" % (section, reason))
+    record({"section": section, "reason": reason})
+
+
+def run_section(
+    deadline: Optional[Deadline],
+    section: str,
+    function: Callable[..., T],
+    *arguments: Any,
+    fallback: Callable[[], T],
+) -> T:
+    # Without a deadline, the section runs as any other code would
+    if deadline is None:
+        return function(*arguments)
+    seconds = deadline.budget(section)
+    if seconds <= 0:
+        degrade(section, "within the margin before the send time")
+        return fallback()
+    outcome: dict[str, Any] = {}
+
+    def target() -> None:
+        try:
+            outcome["result"] = function(*arguments)
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=target, name=section, daemon=True)
+    thread.start()
+    thread.join(seconds)
+    if thread.is_alive():
+        degrade(section, "over its budget of %.1f seconds" % seconds)
+        return fallback()
+    if "error" in outcome:
+        logger.error("%s failed" % section, exc_info=outcome["error"])
+        degrade(section, "failed: %s" % outcome["error"])
+        return fallback()
+    result: T = outcome["result"]
+    return result
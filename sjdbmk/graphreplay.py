@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+#
+# Record and replay Graph traffic for the Songjiang Daily Bulletin Build System
+# Copyright (C) 2024 Runxi Yu <https://runxiyu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# With [graph] mode = record, every response that comes through
+# common.request() is saved to the recording directory: exchanges.jsonl
+# lists the requests in order, and bodies/ holds the response bodies by
+# SHA-256, so a deck fetched twice is stored once. With mode = replay, those
+# responses are served back without any network access, login included,
+# optionally with added latency, throttling and a bandwidth limit.
+#
+# Requests are matched on method, URL, Range header and request body. A
+# request seen several times gets its responses in the order they were
+# recorded, and the last one after that. A POST whose body differs from the
+# recording, such as sending a bulletin for another date, falls back to the
+# first response recorded for that method and URL.
+#
+# Recordings contain whatever the pipeline downloaded, including mail and
+# pre-authenticated download URLs. Treat them like the build directory.
+#
+
+from __future__ import annotations
+from typing import Any, Mapping
+from configparser import ConfigParser
+import argparse
+import hashlib
+import http.client
+import io
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+
+import requests
+import requests.adapters
+import urllib3
+
+from . import common
+
+logger = logging.getLogger(__name__)
+
+EXCHANGES_FILENAME = "exchanges.jsonl"
+BODIES_DIRECTORY = "bodies"
+# Hop-by-hop or no longer true once the body has been decoded
+DROPPED_HEADERS = {
+    "content-encoding",
+    "content-length",
+    "transfer-encoding",
+    "connection",
+    "set-cookie",
+}
+
+
+class ReplayMissError(requests.ConnectionError):
+    pass
+
+
+def request_body_bytes(body: Any) -> bytes:
+    if body is None:
+        return b""
+    if isinstance(body, str):
+        return body.encode("utf-8")
+    if isinstance(body, bytes):
+        return body
+    raise TypeError("Cannot record a streamed request body")
+
+
+def request_key(request: requests.PreparedRequest) -> tuple[str, str, str, str]:
+    body = request_body_bytes(request.body)
+    range_header = request.headers.get("Range", "")
+    if isinstance(range_header, bytes):
+        # Header values may be given as bytes, which HTTP sends as Latin-1
+        range_header = range_header.decode("latin-1")
+    return (
+        request.method or "GET",
+        request.url or "",
+        range_header,
+        hashlib.sha256(body).hexdigest() if body else "",
+    )
+
+
+class Recording:
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.lock = threading.Lock()
+
+    def body_path(self, digest: str) -> str:
+        return os.path.join(self.directory, BODIES_DIRECTORY, digest)
+
+    def append(
+        self,
+        key: tuple[str, str, str, str],
+        status: int,
+        headers: Mapping[str, str],
+        body: bytes,
+    ) -> None:
+        digest = hashlib.sha256(body).hexdigest()
+        with self.lock:
+            os.makedirs(os.path.join(self.directory, BODIES_DIRECTORY), exist_ok=True)
+            if not os.path.exists(self.body_path(digest)):
+                fd, temporary_path = tempfile.mkstemp(
+                    dir=os.path.join(self.directory, BODIES_DIRECTORY)
+                )
+                with os.fdopen(fd, "wb") as body_fd:
+                    body_fd.write(body)
+                os.replace(temporary_path, self.body_path(digest))
+            with open(
+                os.path.join(self.directory, EXCHANGES_FILENAME), "a", encoding="utf-8"
+            ) as exchanges_file:
+                exchanges_file.write(
+                    json.dumps(
+                        {
+                            "method": key[0],
+                            "url": key[1],
+                            "range": key[2],
+                            "request_sha256": key[3],
+                            "status": status,
+                            "headers": {
+                                name: value
+                                for name, value in headers.items()
+                                if name.lower() not in DROPPED_HEADERS
+                            },
+                            "body": digest,
+                        }
+                    )
+                    + "\n"
+                )
+
+    def load(self) -> list[dict[str, Any]]:
+        with open(
+            os.path.join(self.directory, EXCHANGES_FILENAME), "r", encoding="utf-8"
+        ) as fd:
+            return [json.loads(line) for line in fd if line.strip()]
+
+    def read_body(self, digest: str) -> bytes:
+        with open(self.body_path(digest), "rb") as fd:
+            return fd.read()
+
+
+class SlowReader(io.RawIOBase):
+    # Hands out the body no faster than bytes_per_second
+    def __init__(self, body: bytes, bytes_per_second: float) -> None:
+        self.body = memoryview(body)
+        self.position = 0
+        self.bytes_per_second = bytes_per_second
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        # About ten reads per second, however large the caller's buffer
+        size = min(
+            len(buffer),
+            len(self.body) - self.position,
+            max(int(self.bytes_per_second / 10), 1),
+        )
+        time.sleep(size / self.bytes_per_second)
+        buffer[:size] = self.body[self.position : self.position + size]
+        self.position += size
+        return size
+
+
+class GraphAdapter(requests.adapters.HTTPAdapter):
+    def respond(
+        self,
+        request: requests.PreparedRequest,
+        status: int,
+        headers: Mapping[str, str],
+        body: bytes,
+        bytes_per_second: float = 0,
+    ) -> requests.Response:
+        raw = urllib3.HTTPResponse(
+            body=(
+                SlowReader(body, bytes_per_second)
+                if bytes_per_second
+                else io.BytesIO(body)
+            ),
+            headers=dict(headers) | {"Content-Length": str(len(body))},
+            status=status,
+            reason=http.client.responses.get(status, ""),
+            preload_content=False,
+            decode_content=False,
+        )
+        return self.build_response(request, raw)
+
+
+class RecordingAdapter(GraphAdapter):
+    def __init__(self, directory: str) -> None:
+        super().__init__()
+        self.recording = Recording(directory)
+
+    def send(  # type: ignore[override]
+        self, request: requests.PreparedRequest, **kwargs: Any
+    ) -> requests.Response:
+        response = super().send(request, **kwargs)
+        # Streamed or not, the whole body is needed for the recording
+        body = response.content
+        headers = dict(response.headers)
+        self.recording.append(request_key(request), response.status_code, headers, body)
+        return self.respond(
+            request,
+            response.status_code,
+            {
+                name: value
+                for name, value in headers.items()
+                if name.lower() not in DROPPED_HEADERS
+            },
+            body,
+        )
+
+
+class ReplayAdapter(GraphAdapter):
+    def __init__(
+        self,
+        directory: str,
+        latency: float = 0,
+        throttle_rate: float = 0,
+        retry_after: float = 1,
+        bytes_per_second: float = 0,
+        seed: int = 0,
+    ) -> None:
+        super().__init__()
+        self.recording = Recording(directory)
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.bytes_per_second = bytes_per_second
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.exact: dict[tuple[str, str, str, str], list[dict[str, Any]]] = {}
+        self.loose: dict[tuple[str, str, str], list[dict[str, Any]]] = {}
+        self.cursors: dict[tuple[str, str, str, str], int] = {}
+        for exchange in self.recording.load():
+            exact_key = (
+                exchange["method"],
+                exchange["url"],
+                exchange["range"],
+                exchange["request_sha256"],
+            )
+            self.exact.setdefault(exact_key, []).append(exchange)
+            self.loose.setdefault(exact_key[:3], []).append(exchange)
+
+    def next_exchange(self, key: tuple[str, str, str, str]) -> dict[str, Any]:
+        with self.lock:
+            if key in self.exact:
+                exchanges = self.exact[key]
+                cursor = self.cursors.get(key, 0)
+                self.cursors[key] = cursor + 1
+                return exchanges[min(cursor, len(exchanges) - 1)]
+            if key[:3] in self.loose:
+                return self.loose[key[:3]][0]
+        raise ReplayMissError("No recorded response for %s %s" % (key[0], key[1]))
+
+    def send(  # type: ignore[override]
+        self, request: requests.PreparedRequest, **kwargs: Any
+    ) -> requests.Response:
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            throttled = self.random.random() < self.throttle_rate
+        if throttled:
+            return self.respond(
+                request,
+                429,
+                {
+                    "Content-Type": "application/json",
+                    "Retry-After": "%g" % self.retry_after,
+                },
+                b'{"error": {"code": "TooManyRequests"}}',
+            )
+        exchange = self.next_exchange(request_key(request))
+        return self.respond(
+            request,
+            exchange["status"],
+            exchange["headers"],
+            self.recording.read_body(exchange["body"]),
+            self.bytes_per_second,
+        )
+
+    def close(self) -> None:
+        pass
+
+
+def mount(
+    session: requests.Session,
+    adapter: requests.adapters.BaseAdapter,
+    graph_mode: str,
+) -> None:
+    # Also used to put a stand-in Graph in front of the pipeline; anything
+    # mounted as "replay" is offline, so login is skipped
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    common.graph_mode = graph_mode
+
+
+def install(session: requests.Session, config: ConfigParser) -> None:
+    graph_mode = config.get("graph", "mode", fallback="live")
+    if graph_mode == "live":
+        return
+    directory = os.path.abspath(
+        config.get("graph", "recording", fallback="graph-recording")
+    )
+    adapter: GraphAdapter
+    if graph_mode == "record":
+        adapter = RecordingAdapter(directory)
+    elif graph_mode == "replay":
+        adapter = ReplayAdapter(
+            directory,
+            latency=config.getfloat("graph", "latency", fallback=0),
+            throttle_rate=config.getfloat("graph", "throttle_rate", fallback=0),
+            retry_after=config.getfloat("graph", "retry_after", fallback=1),
+            bytes_per_second=config.getfloat("graph", "bytes_per_second", fallback=0),
+            seed=config.getint("graph", "seed", fallback=0),
+        )
+    else:
+        raise ValueError("Unknown graph mode %s" % graph_mode)
+    mount(session, adapter, graph_mode)
+    logger.info(
+        "Graph traffic is being %s %s"
+        % ("recorded to" if graph_mode == "record" else "replayed from", directory)
+    )
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="List a Graph recording")
+    parser.add_argument(
+        "--config", default="config.ini", help="path to the configuration file"
+    )
+    args = parser.parse_args()
+
+    config = ConfigParser()
+    config.read(args.config)
+
+    build_path = config["general"]["build_path"]
+    os.chdir(build_path)
+
+    recording = Recording(
+        os.path.abspath(config.get("graph", "recording", fallback="graph-recording"))
+    )
+    for exchange in recording.load():
+        print(
+            "%s %d %10d %s%s"
+            % (
+                exchange["method"],
+                exchange["status"],
+                os.path.getsize(recording.body_path(exchange["body"])),
+                exchange["url"].split("?", 1)[0],
+                " (%s)" % exchange["range"] if exchange["range"] else "",
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
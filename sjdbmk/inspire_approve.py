@@ -1,11 +1,23 @@
 #!/usr/bin/env python3
 
 from __future__ import annotations
+import argparse
 import json
-import sys
 
-for fn in sys.argv[1:]:
-    with open(fn, "r+") as fd:
-        jq = json.load(fd)
-        jq["approved"] = True
-        json.dump(jq, fd, indent="\t")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Approve Daily Inspirations")
+    parser.add_argument("files", nargs="*", help="inspire-* files to approve")
+    args = parser.parse_args()
+
+    for fn in args.files:
+        with open(fn, "r+") as fd:
+            jq = json.load(fd)
+            jq["approved"] = True
+            fd.seek(0)
+            json.dump(jq, fd, indent="\t")
+            fd.truncate()
+
+
+if __name__ == "__main__":
+    main()
@@ -26,7 +26,8 @@ import argparse
 import logging
 import os
 import shutil
-import requests
+
+from . import common, instrument
 
 logger = logging.getLogger(__name__)
 
@@ -38,6 +39,15 @@ def main() -> None:
     parser.add_argument(
         "--config", default="config.ini", help="path to the configuration file"
     )
+    parser.add_argument(
+        "--profile", action="store_true", help="dump a cProfile of this run"
+    )
+    parser.add_argument(
+        "--no-trace-memory",
+        dest="trace_memory",
+        action="store_false",
+        help="leave peak memory out of the run report, which is faster",
+    )
     args = parser.parse_args()
 
     config = ConfigParser()
@@ -45,15 +55,28 @@ def main() -> None:
 
     build_path = config["general"]["build_path"]
     os.chdir(build_path)
+    common.install_graph_transport(config)
 
     api_base = config["web_service"]["api_base"].rstrip("/") + "/"
     token = config["web_service"]["token"].strip()
 
-    response_json = requests.get(
-        api_base + "rs",
-        headers={"Authorization": "Bearer %s" % token},
-        timeout=20,
-    ).json()
+    with instrument.run(
+        "inspire_dl",
+        profile=args.profile,
+        trace_memory=args.trace_memory,
+        metrics_directory=config.get("metrics", "textfile_directory", fallback=None),
+    ):
+        download_inspirations(api_base, token)
+
+
+def download_inspirations(api_base: str, token: str) -> None:
+    with instrument.stage("list"):
+        response_json = common.request(
+            "GET",
+            api_base + "rs",
+            headers={"Authorization": "Bearer %s" % token},
+            timeout=20,
+        ).json()
     assert isinstance(response_json, list)
     remote_submission_list = set(response_json)
 
@@ -66,9 +89,38 @@ def main() -> None:
     else:
         logger.info("Nothing to fetch")
     for sn in to_fetch:
-        logger.info("Fetching: %s" % sn)
-        with requests.get(
-            api_base + "rs/" + sn,
+        with instrument.stage("fetch"):
+            fetch_inspiration(api_base, token, sn)
+
+
+def fetch_inspiration(api_base: str, token: str, sn: str) -> None:
+    logger.info("Fetching: %s" % sn)
+    with common.request(
+        "GET",
+        api_base + "rs/" + sn,
+        headers={
+            "Authorization": "Bearer %s" % token,
+            "Accept-Encoding": "identity",
+        },
+        stream=True,
+        timeout=20,
+    ) as r:
+        try:
+            sub = json.load(r.raw)
+        except json.decoder.JSONDecodeError:
+            logger.error("inspire-%s is broken, skipping" % sn)
+            return
+    sub["used"] = False
+    sub["approved"] = False
+    with open("inspire-%s" % os.path.basename(sn), "w", encoding="utf-8") as fd:
+        json.dump(sub, fd, indent="\t")
+    if not sub["file"]:
+        logger.info("No attachment")
+    else:
+        logger.info("Attachment noticed")
+        with common.request(
+            "GET",
+            api_base + "rf/" + os.path.basename(sub["file"]),
             headers={
                 "Authorization": "Bearer %s" % token,
                 "Accept-Encoding": "identity",
@@ -76,33 +128,10 @@ def main() -> None:
             stream=True,
             timeout=20,
         ) as r:
-            try:
-                sub = json.load(r.raw)
-            except json.decoder.JSONDecodeError:
-                logger.error("inspire-%s is broken, skipping" % sn)
-        sub["used"] = False
-        sub["approved"] = False
-        with open("inspire-%s" % os.path.basename(sn), "w", encoding="utf-8") as fd:
-            json.dump(sub, fd, indent="\t")
-        if not sub["file"]:
-            logger.info("No attachment")
-        else:
-            logger.info("Attachment noticed")
-            with requests.get(
-                api_base + "rf/" + os.path.basename(sub["file"]),
-                headers={
-                    "Authorization": "Bearer %s" % token,
-                    "Accept-Encoding": "identity",
-                },
-                stream=True,
-                timeout=20,
-            ) as r:
-                with open("inspattach-%s" % os.path.basename(sub["file"]), "wb") as fd:
-                    logger.info(
-                        "Saved to inspattach-%s" % os.path.basename(sub["file"])
-                    )
-                    shutil.copyfileobj(r.raw, fd)
-                    fd.flush()
+            with open("inspattach-%s" % os.path.basename(sub["file"]), "wb") as fd:
+                logger.info("Saved to inspattach-%s" % os.path.basename(sub["file"]))
+                shutil.copyfileobj(r.raw, fd)
+                fd.flush()
 
 
 if __name__ == "__main__":
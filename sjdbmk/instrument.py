@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+#
+# Per-run stage timing for the Songjiang Daily Bulletin Build System
+# Copyright (C) 2024 Runxi Yu <https://runxiyu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Entry points wrap their work in run(), and code anywhere below marks named
+# stages with stage(). Outside of run() both are no-ops, so library callers
+# pay nothing. Each run leaves a run-<timestamp>-<entry point>.json report in
+# the build directory; running this module summarizes the recent ones. With
+# [metrics] textfile_directory set, the report also updates the Prometheus
+# textfile for that entry point. Peak memory per stage is traced with
+# tracemalloc, which slows allocation down; entry points take
+# --no-trace-memory to leave it out.
+#
+
+from __future__ import annotations
+from typing import Any, Iterator, Optional
+from configparser import ConfigParser
+import argparse
+import contextlib
+import datetime
+import glob
+import json
+import logging
+import os
+import time
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RunReport:
+    def __init__(self, name: str, trace_memory: bool) -> None:
+        self.name = name
+        self.trace_memory = trace_memory
+        self.started = datetime.datetime.now(datetime.timezone.utc)
+        self.stages: list[dict[str, Any]] = []
+        self.http: list[dict[str, Any]] = []
+        self.notes: dict[str, Any] = {}
+        # Names of the open stages and the peak memory seen so far by each,
+        # innermost last
+        self.open_stages: list[str] = []
+        self.open_peaks: list[int] = []
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "started": self.started.isoformat(),
+            "stages": self.stages,
+            "http": self.http,
+            "notes": self.notes,
+        }
+
+
+_current: Optional[RunReport] = None
+
+
+def current() -> Optional[RunReport]:
+    return _current
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    report = _current
+    if report is None:
+        yield
+        return
+
+    # Loaded on first use, to keep startup of every entry point short
+    import tracemalloc
+
+    if report.trace_memory:
+        # tracemalloc only has one peak, so fold it into the enclosing stage
+        # before resetting it for this one
+        if report.open_peaks:
+            report.open_peaks[-1] = max(
+                report.open_peaks[-1], tracemalloc.get_traced_memory()[1]
+            )
+        tracemalloc.reset_peak()
+        report.open_peaks.append(0)
+    report.open_stages.append(name)
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    status = "failed"
+    try:
+        yield
+        status = "ok"
+    finally:
+        entry: dict[str, Any] = {
+            "name": name,
+            # Stages of the same name can appear under different parents
+            "path": "/".join(report.open_stages),
+            "status": status,
+            "wall_seconds": time.perf_counter() - wall_start,
+            "cpu_seconds": time.process_time() - cpu_start,
+        }
+        if report.trace_memory:
+            peak = max(report.open_peaks.pop(), tracemalloc.get_traced_memory()[1])
+            if report.open_peaks:
+                report.open_peaks[-1] = max(report.open_peaks[-1], peak)
+            entry["peak_bytes"] = peak
+        report.open_stages.pop()
+        report.stages.append(entry)
+
+
+def record_http(
+    method: str,
+    url: str,
+    status_code: int,
+    response_bytes: Optional[int],
+    seconds: float,
+    attempt: int = 0,
+) -> None:
+    if _current is None:
+        return
+    _current.http.append(
+        {
+            "method": method,
+            # Query strings may carry tokens
+            "url": url.split("?", 1)[0],
+            "status": status_code,
+            "bytes": response_bytes,
+            "seconds": seconds,
+            "attempt": attempt,
+        }
+    )
+
+
+def note(key: str, value: Any) -> None:
+    if _current is not None:
+        _current.notes[key] = value
+
+
+@contextlib.contextmanager
+def run(
+    name: str,
+    report_directory: str = ".",
+    profile: bool = False,
+    trace_memory: bool = True,
+    metrics_directory: Optional[str] = None,
+) -> Iterator[RunReport]:
+    global _current
+    import cProfile
+    import tracemalloc
+
+    report = RunReport(name, trace_memory)
+    stem = os.path.join(
+        report_directory,
+        "run-%s-%s" % (report.started.strftime("%Y%m%dT%H%M%SZ"), name),
+    )
+    profiler = cProfile.Profile() if profile else None
+    if trace_memory:
+        tracemalloc.start()
+    _current = report
+    try:
+        if profiler is not None:
+            profiler.enable()
+        with stage("total"):
+            yield report
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(stem + ".prof")
+            logger.info("Profile written to %s.prof" % stem)
+        _current = None
+        if trace_memory:
+            tracemalloc.stop()
+        with open(stem + ".json", "w", encoding="utf-8") as fd:
+            json.dump(report.to_json(), fd, indent="\t")
+        logger.info("Run report written to %s.json" % stem)
+        if metrics_directory:
+            try:
+                metrics.record_run(report.to_json(), metrics_directory)
+            except Exception:
+                # Monitoring must never be the reason a bulletin is not built
+                logger.exception("Failed to write metrics")
+
+
+def summarize(reports: list[dict[str, Any]]) -> None:
+    by_stage: dict[tuple[str, str], list[dict[str, Any]]] = {}
+    http_totals: dict[str, list[int]] = {}
+    for report in reports:
+        for entry in report["stages"]:
+            by_stage.setdefault((report["name"], entry["name"]), []).append(entry)
+        http_total = http_totals.setdefault(report["name"], [0, 0])
+        http_total[0] += len(report["http"])
+        http_total[1] += sum(call["bytes"] or 0 for call in report["http"])
+
+    print(
+        "%-12s %-28s %5s %9s %9s %9s %10s %6s"
+        % ("run", "stage", "runs", "last s", "mean s", "max s", "peak KiB", "fails")
+    )
+    for (name, stage_name), entries in sorted(by_stage.items()):
+        walls = [entry["wall_seconds"] for entry in entries]
+        peaks = [entry.get("peak_bytes") or 0 for entry in entries]
+        print(
+            "%-12s %-28s %5d %9.2f %9.2f %9.2f %10.1f %6d"
+            % (
+                name,
+                stage_name,
+                len(entries),
+                walls[-1],
+                sum(walls) / len(walls),
+                max(walls),
+                max(peaks) / 1024,
+                sum(entry["status"] != "ok" for entry in entries),
+            )
+        )
+    for name, (calls, total_bytes) in sorted(http_totals.items()):
+        if calls:
+            print(
+                "%s: %d HTTP calls, %.1f KiB received"
+                % (name, calls, total_bytes / 1024)
+            )
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Summarize recent Daily Bulletin run reports"
+    )
+    parser.add_argument(
+        "--last", type=int, default=20, help="how many recent runs to include"
+    )
+    parser.add_argument(
+        "--name", default=None, help="only include runs of this entry point"
+    )
+    parser.add_argument(
+        "--config", default="config.ini", help="path to the configuration file"
+    )
+    args = parser.parse_args()
+
+    config = ConfigParser()
+    config.read(args.config)
+
+    build_path = config["general"]["build_path"]
+    os.chdir(build_path)
+
+    reports = []
+    for filename in sorted(glob.glob("run-*.json")):
+        with open(filename, "r", encoding="utf-8") as fd:
+            report = json.load(fd)
+        if args.name is None or report["name"] == args.name:
+            reports.append(report)
+    summarize(reports[-args.last :])
+
+
+if __name__ == "__main__":
+    main()
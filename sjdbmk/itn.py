@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+#
+# In The News prefetching for the Songjiang Daily Bulletin Build System
+# Copyright (C) 2024 Runxi Yu <https://runxiyu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# The prefetcher runs on its own schedule (cron, or --interval) and keeps the
+# latest In The News sections in a timestamped cache file. daily.generate only
+# ever reads that file, so a slow Wikipedia never blocks a build.
+#
+
+from __future__ import annotations
+from typing import Any, Callable, Optional
+from configparser import ConfigParser
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+ITN_CACHE_FILENAME = "itn-cache.json"
+LANGUAGES = ["en", "zh"]
+
+
+def load_cache(path: str = ITN_CACHE_FILENAME) -> dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as fd:
+            cache = json.load(fd)
+    except FileNotFoundError:
+        return {}
+    assert isinstance(cache, dict)
+    return cache
+
+
+def save_cache(cache: dict[str, Any], path: str = ITN_CACHE_FILENAME) -> None:
+    fd, temporary_path = tempfile.mkstemp(
+        prefix=".itn-", suffix=".json", dir=os.path.dirname(os.path.abspath(path))
+    )
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as temporary_file:
+            json.dump(cache, temporary_file, ensure_ascii=False, indent="\t")
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+def read_in_the_news(
+    language: str, ttl: float, path: str = ITN_CACHE_FILENAME
+) -> Optional[str]:
+    entry = load_cache(path).get(language)
+    if not entry:
+        logger.warning("In The News %s not cached" % language)
+        return None
+    age = time.time() - entry["fetched"]
+    if age > ttl:
+        logger.warning(
+            "In The News %s is %d seconds old, over the TTL of %d, leaving it out"
+            % (language, age, ttl)
+        )
+        return None
+    html = entry["html"]
+    assert isinstance(html, str)
+    return html
+
+
+def prefetch(path: str = ITN_CACHE_FILENAME) -> None:
+    from . import legacy_wikipedia
+
+    fetchers: dict[str, Callable[[], str]] = {
+        "en": legacy_wikipedia.get_in_the_news_en,
+        "zh": legacy_wikipedia.get_in_the_news_zh,
+    }
+    cache = load_cache(path)
+    for language in LANGUAGES:
+        logger.info("Fetching In The News %s" % language)
+        try:
+            html = fetchers[language]()
+        except Exception:
+            logger.exception(
+                "Fetching In The News %s failed, keeping the cached copy" % language
+            )
+            continue
+        cache[language] = {"fetched": time.time(), "html": html}
+        # Saving after each language means a hang on the second one
+        # doesn't hold back the first.
+        save_cache(cache, path)
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Prefetch In The News for the Daily Bulletin"
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=None,
+        help="keep running and refresh every this many seconds; defaults to running once",
+    )
+    parser.add_argument(
+        "--config", default="config.ini", help="path to the configuration file"
+    )
+    args = parser.parse_args()
+
+    config = ConfigParser()
+    config.read(args.config)
+
+    build_path = config["general"]["build_path"]
+    os.chdir(build_path)
+
+    while True:
+        prefetch()
+        if args.interval is None:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
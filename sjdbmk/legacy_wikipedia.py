@@ -19,6 +19,8 @@
 #
 
 from __future__ import annotations
+from typing import Iterator
+import itertools
 import re
 import os
 import copy
@@ -30,10 +32,12 @@ import configparser
 import requests
 import bs4
 
+from . import otd
+
 logger = logging.getLogger(__name__)
 
 
-def get_on_this_day_zh() -> None:
+def get_on_this_day_zh() -> Iterator[tuple[str, str, str]]:
     months = list(map(lambda x: str(x) + "月", range(1, 13)))
 
     for index in range(12):
@@ -79,13 +83,11 @@ def get_on_this_day_zh() -> None:
             )
             result = re.sub(r"<small>.*?图.*?</small>", "", result)
 
-            with open("otd_zh-" + formatted_time_yearless + ".html", "w") as file:
-                file.write(result)
-                file.close()
-                day += 1
+            yield ("zh", formatted_time_yearless, result)
+            day += 1
 
 
-def get_on_this_day_en() -> None:
+def get_on_this_day_en() -> Iterator[tuple[str, str, str]]:
     months = [
         "January",
         "February",
@@ -147,10 +149,8 @@ def get_on_this_day_en() -> None:
             )
             result = re.sub(r" <i>.*?icture.*?</i>", "", result)
 
-            with open("otd_en-" + formatted_time_yearless + ".html", "w") as file:
-                file.write(result)
-                file.close()
-                day += 1
+            yield ("en", formatted_time_yearless, result)
+            day += 1
 
 
 def get_in_the_news_en() -> str:
@@ -283,10 +283,8 @@ def main() -> None:
 
     logging.basicConfig(level=logging.DEBUG)
     logger.warning("Running main() only grabs On This Day")
-    logger.info("get_on_this_day_en()")
-    get_on_this_day_en()
-    logger.info("get_on_this_day_zh()")
-    get_on_this_day_zh()
+    logger.info("get_on_this_day_en() and get_on_this_day_zh()")
+    otd.write_store(itertools.chain(get_on_this_day_en(), get_on_this_day_zh()))
     # logger.info("get_in_the_news_en()")
     # get_in_the_news_en()
     # logger.info("get_in_the_news_zh()")
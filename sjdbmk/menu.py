@@ -18,19 +18,19 @@
 #
 
 
-from typing import Optional, Any
+from typing import Optional, Any, Union
 import email
-import requests
 import datetime
 import logging
 import os
 
-import openpyxl
-
-from . import common
+from . import cas, common
 
 logger = logging.getLogger(__name__)
 
+# Bump this whenever the menu parsing changes, to invalidate cached parses
+MENU_PARSER_VERSION = 2
+
 
 def menu_item_fix(s: str) -> Optional[str]:
     if not s:
@@ -49,13 +49,15 @@ def menu_item_fix(s: str) -> Optional[str]:
 def parse_meal_table(
     rows: list[Any], initrow: int, t: list[str]
 ) -> dict[str, dict[str, list[str]]]:
+    from openpyxl.cell.cell import MergedCell
+
     assert rows[initrow + 1][1].value is None
 
     igroups = []
     i = initrow + 2
     while True:
         c = rows[i][1]
-        if not isinstance(c, openpyxl.cell.MergedCell):
+        if not isinstance(c, MergedCell):
             igroups.append(i)
         i += 1
         if len(igroups) >= len(t):
@@ -85,14 +87,45 @@ def parse_meal_table(
     return ret
 
 
+def read_menu_rows(datetime_target: datetime.datetime) -> list[Any]:
+    filename = "menu-%s.xlsx" % datetime_target.strftime("%Y%m%d")
+    # openpyxl takes a while to import, so only the parsers load it
+    import openpyxl
+
+    wb = openpyxl.load_workbook(filename=filename)
+    ws = wb["菜单"]
+    return list(ws.iter_rows())
+
+
+def parse_menu_workbook(
+    datetime_target: datetime.datetime,
+) -> tuple[
+    dict[str, dict[str, dict[str, list[str]]]], dict[str, Union[list[str], str]]
+]:
+    # Menus and snacks from a single load of the workbook
+    cache_key = {
+        "sha256": common.file_sha256(
+            "menu-%s.xlsx" % datetime_target.strftime("%Y%m%d")
+        ),
+        "parser_version": MENU_PARSER_VERSION,
+    }
+    cached = cas.get_parsed("menu", cache_key)
+    if cached is not None:
+        return cached["menus"], cached["snacks"]
+    rows = read_menu_rows(datetime_target)
+    menus = parse_menus(datetime_target, rows)
+    snacks = parse_snacks(datetime_target, rows)
+    cas.put_parsed("menu", cache_key, {"menus": menus, "snacks": snacks})
+    return menus, snacks
+
+
 def parse_menus(
     datetime_target: datetime.datetime,
+    rows: Optional[list[Any]] = None,
 ) -> dict[str, dict[str, dict[str, list[str]]]]:
     logger.info("Parsing menus")
-    filename = "menu-%s.xlsx" % datetime_target.strftime("%Y%m%d")
-    wb = openpyxl.load_workbook(filename=filename)
-    ws = wb["菜单"]
-    rows = list(ws.iter_rows())
+    if rows is None:
+        rows = read_menu_rows(datetime_target)
 
     final = {}
 
@@ -149,12 +182,13 @@ def parse_menus(
     return final
 
 
-def parse_snacks(datetime_target: datetime.datetime) -> dict[str, list[str]]:
+def parse_snacks(
+    datetime_target: datetime.datetime,
+    rows: Optional[list[Any]] = None,
+) -> dict[str, Union[list[str], str]]:
     logger.info("Parsing snacks")
-    filename = "menu-%s.xlsx" % datetime_target.strftime("%Y%m%d")
-    wb = openpyxl.load_workbook(filename=filename)
-    ws = wb["菜单"]
-    rows = list(ws.iter_rows())
+    if rows is None:
+        rows = read_menu_rows(datetime_target)
 
     final = {}
 
@@ -169,6 +203,7 @@ def parse_snacks(datetime_target: datetime.datetime) -> dict[str, list[str]]:
     else:
         raise ValueError("snacks not found")
     i += 2
+    ev: Union[list[str], str]
     try:
         ev = [a.value for a in rows[i + 2][2:7]]
     except (IndexError, KeyError):
@@ -194,7 +229,23 @@ def download_menu(
     menu_filename: str,
 ) -> None:
     search_results = common.search_mail(token, weekly_menu_query_string)
+    hit = find_menu_hit(
+        search_results,
+        datetime_target,
+        weekly_menu_sender,
+        weekly_menu_subject_regex,
+        weekly_menu_subject_regex_four_groups,
+    )
+    download_menu_message(token, hit, menu_filename)
 
+
+def find_menu_hit(
+    search_results: list[dict[str, Any]],
+    datetime_target: datetime.datetime,
+    weekly_menu_sender: str,
+    weekly_menu_subject_regex: str,
+    weekly_menu_subject_regex_four_groups: tuple[int, int, int, int],
+) -> dict[str, Any]:
     for hit, matched_groups in common.filter_mail_results_by_subject_regex_groups(
         common.filter_mail_results_by_sender(search_results, weekly_menu_sender),
         weekly_menu_subject_regex,
@@ -211,11 +262,13 @@ def download_menu(
             subject_1st_month == datetime_target.month
             and subject_1st_day == datetime_target.day
         ):
-            break
-    else:
-        raise ValueError("No menu email found")
+            return hit
+    raise ValueError("No menu email found")
+
 
-    with requests.get(
+def download_menu_message(token: str, hit: dict[str, Any], menu_filename: str) -> None:
+    with common.request(
+        "GET",
         "https://graph.microsoft.com/v1.0/me/messages/%s/$value" % hit["hitId"],
         headers={
             "Authorization": "Bearer %s" % token,
@@ -249,17 +302,21 @@ def download_or_report_menu(
     weekly_menu_subject_regex_four_groups: tuple[int, int, int, int],
 ) -> None:
     menu_filename = "menu-%s.xlsx" % datetime_target.strftime("%Y%m%d")
-    if not (os.path.isfile(menu_filename)):
-        logger.info("Menu not found, downloading")
-        download_menu(
-            token,
-            datetime_target,
-            weekly_menu_query_string,
-            weekly_menu_sender,
-            weekly_menu_subject_regex,
-            weekly_menu_subject_regex_four_groups,
-            menu_filename,
-        )
-        assert os.path.isfile(menu_filename)
-    else:
+    if os.path.isfile(menu_filename):
         logger.info("Menu already exists")
+        return
+    cache_name = "menu-%s" % datetime_target.strftime("%Y%m%d")
+    if cas.fetch_input(cache_name):
+        return
+    logger.info("Menu not found, downloading")
+    download_menu(
+        token,
+        datetime_target,
+        weekly_menu_query_string,
+        weekly_menu_sender,
+        weekly_menu_subject_regex,
+        weekly_menu_subject_regex_four_groups,
+        menu_filename,
+    )
+    assert os.path.isfile(menu_filename)
+    cas.store_input(cache_name, menu_filename)
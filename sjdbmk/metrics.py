@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+#
+# Prometheus textfile metrics for the Songjiang Daily Bulletin Build System
+# Copyright (C) 2024 Runxi Yu <https://runxiyu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# At the end of each run, the run report from instrument is folded into
+# sjdb_<entry point>.prom in the node-exporter textfile collector directory.
+# Counters and histograms must keep growing across runs for rate() to work,
+# so the previous file is read back and this run's values are added to it,
+# under a lock on sjdb_<entry point>.prom.lock, which the collector ignores,
+# so that runs finishing together, e.g. the daemon and a cron job, do not
+# drop each other's values.
+#
+# Metric families, all prefixed with sjdb_:
+#   http_requests_total{run,endpoint,method,status}   requests, by status
+#   http_request_duration_seconds{run,endpoint}       latency histogram
+#   http_response_bytes_total{run,endpoint}           bytes received
+#   http_throttled_total{run,endpoint}                429 responses
+#   http_retries_total{run,endpoint}                  retried requests
+#   stage_runs_total{run,stage,status}                stage outcomes
+#   stage_duration_seconds{run,stage}                 stage duration histogram
+#   stage_last_duration_seconds{run,stage}            most recent duration
+#   run_last_success_timestamp_seconds{run}           when a run last succeeded
+#   run_last_failure_timestamp_seconds{run}           when a run last failed
+#
+
+from __future__ import annotations
+from typing import Any, Iterator
+import contextlib
+import fcntl
+import logging
+import os
+import re
+import tempfile
+import time
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "sjdb_"
+HTTP_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+STAGE_BUCKETS = [0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0]
+
+METRICS = {
+    "http_requests_total": ("counter", "Requests made, by response status"),
+    "http_request_duration_seconds": ("histogram", "Request latency"),
+    "http_response_bytes_total": ("counter", "Response bytes received"),
+    "http_throttled_total": ("counter", "Responses with status 429"),
+    "http_retries_total": ("counter", "Requests retried after throttling"),
+    "stage_runs_total": ("counter", "Stages run, by outcome"),
+    "stage_duration_seconds": ("histogram", "Stage wall time"),
+    "stage_last_duration_seconds": ("gauge", "Wall time of the latest stage run"),
+    "run_last_success_timestamp_seconds": ("gauge", "End of the latest good run"),
+    "run_last_failure_timestamp_seconds": ("gauge", "End of the latest failed run"),
+}
+
+# Path segments that name things rather than identify them
+_NAME_SEGMENT = re.compile(r"v[0-9]+(\.[0-9]+)?|\$?[A-Za-z_][A-Za-z_.]*")
+_SAMPLE_LINE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*\})? (\S+)$")
+
+
+def endpoint_label(url: str) -> str:
+    # Drive item IDs, message IDs, addresses and the like would make one
+    # series per object, so they are folded into {id}
+    parts = urllib.parse.urlsplit(url)
+    segments = [
+        segment if _NAME_SEGMENT.fullmatch(segment) else "{id}"
+        for segment in parts.path.split("/")
+        if segment
+    ]
+    return parts.netloc + "/" + "/".join(segments)
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def sample_key(name: str, labels: dict[str, str]) -> str:
+    if not labels:
+        return PREFIX + name
+    return (
+        PREFIX
+        + name
+        + "{"
+        + ",".join(
+            '%s="%s"' % (key, escape_label_value(value))
+            for key, value in sorted(labels.items())
+        )
+        + "}"
+    )
+
+
+def format_bound(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+class Samples:
+    def __init__(self) -> None:
+        # Family name -> sample key -> value
+        self.families: dict[str, dict[str, float]] = {name: {} for name in METRICS}
+
+    def add(self, family: str, key: str, value: float) -> None:
+        samples = self.families[family]
+        samples[key] = samples.get(key, 0.0) + value
+
+    def set(self, family: str, key: str, value: float) -> None:
+        self.families[family][key] = value
+
+    def inc(self, name: str, labels: dict[str, str], value: float = 1.0) -> None:
+        self.add(name, sample_key(name, labels), value)
+
+    def observe(
+        self,
+        name: str,
+        labels: dict[str, str],
+        value: float,
+        buckets: list[float],
+    ) -> None:
+        for bound in buckets + [float("inf")]:
+            self.add(
+                name,
+                sample_key(name + "_bucket", labels | {"le": format_bound(bound)}),
+                1.0 if value <= bound else 0.0,
+            )
+        self.add(name, sample_key(name + "_sum", labels), value)
+        self.add(name, sample_key(name + "_count", labels), 1.0)
+
+    def merge(self, other: Samples) -> None:
+        for family, samples in other.families.items():
+            for key, value in samples.items():
+                if METRICS[family][0] == "gauge":
+                    self.set(family, key, value)
+                else:
+                    self.add(family, key, value)
+
+    def render(self) -> str:
+        lines = []
+        for family, (kind, description) in METRICS.items():
+            samples = self.families[family]
+            if not samples:
+                continue
+            lines.append("# HELP %s%s %s" % (PREFIX, family, description))
+            lines.append("# TYPE %s%s %s" % (PREFIX, family, kind))
+            for key in sorted(samples, key=bucket_sort_key):
+                lines.append("%s %s" % (key, format_value(samples[key])))
+        return "\n".join(lines) + "\n"
+
+
+def bucket_sort_key(key: str) -> tuple[str, float]:
+    # Keep histogram buckets in increasing order of their upper bound
+    matched = re.search(r'le="([^"]*)"', key)
+    if not matched:
+        return (key, 0.0)
+    return (key[: matched.start()] + key[matched.end() :], float(matched.group(1)))
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def family_of(sample_name: str) -> str:
+    name = sample_name.removeprefix(PREFIX)
+    if name in METRICS:
+        return name
+    for suffix in ["_bucket", "_sum", "_count"]:
+        if name.endswith(suffix) and name.removesuffix(suffix) in METRICS:
+            return name.removesuffix(suffix)
+    raise KeyError(sample_name)
+
+
+def read_textfile(path: str) -> Samples:
+    samples = Samples()
+    try:
+        with open(path, "r", encoding="utf-8") as fd:
+            lines = fd.readlines()
+    except FileNotFoundError:
+        return samples
+    for line in lines:
+        matched = _SAMPLE_LINE.match(line.strip())
+        if not matched:
+            continue
+        try:
+            family = family_of(matched.group(1))
+        except KeyError:
+            # A metric dropped since that file was written
+            continue
+        samples.set(
+            family, matched.group(1) + (matched.group(2) or ""), float(matched.group(3))
+        )
+    return samples
+
+
+def samples_from_report(report: dict[str, Any], finished: float) -> Samples:
+    samples = Samples()
+    run = report["name"]
+    for call in report["http"]:
+        labels = {"run": run, "endpoint": endpoint_label(call["url"])}
+        samples.inc(
+            "http_requests_total",
+            labels | {"method": call["method"], "status": str(call["status"])},
+        )
+        samples.observe(
+            "http_request_duration_seconds", labels, call["seconds"], HTTP_BUCKETS
+        )
+        samples.inc("http_response_bytes_total", labels, call["bytes"] or 0)
+        if call["status"] == 429:
+            samples.inc("http_throttled_total", labels)
+        if call.get("attempt", 0) > 0:
+            samples.inc("http_retries_total", labels)
+    total_status = "failed"
+    for entry in report["stages"]:
+        labels = {"run": run, "stage": entry["name"]}
+        samples.inc("stage_runs_total", labels | {"status": entry["status"]})
+        samples.observe(
+            "stage_duration_seconds", labels, entry["wall_seconds"], STAGE_BUCKETS
+        )
+        samples.set(
+            "stage_last_duration_seconds",
+            sample_key("stage_last_duration_seconds", labels),
+            entry["wall_seconds"],
+        )
+        if entry["name"] == "total":
+            total_status = entry["status"]
+    outcome = (
+        "run_last_success_timestamp_seconds"
+        if total_status == "ok"
+        else "run_last_failure_timestamp_seconds"
+    )
+    samples.set(outcome, sample_key(outcome, {"run": run}), finished)
+    return samples
+
+
+def write_textfile(path: str, samples: Samples) -> None:
+    # node-exporter may read the file at any moment, so never let it see a
+    # partially written one
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temporary_path = tempfile.mkstemp(
+        dir=directory, prefix=".sjdb-", suffix=".prom.tmp"
+    )
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as temporary_fd:
+            temporary_fd.write(samples.render())
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+def textfile_path(directory: str, run: str) -> str:
+    return os.path.join(directory, "%s%s.prom" % (PREFIX, run))
+
+
+@contextlib.contextmanager
+def textfile_lock(path: str) -> Iterator[None]:
+    # Held around reading, merging and replacing the textfile
+    with open(path + ".lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def record_run(report: dict[str, Any], directory: str) -> None:
+    path = textfile_path(directory, report["name"])
+    with textfile_lock(path):
+        samples = read_textfile(path)
+        samples.merge(samples_from_report(report, time.time()))
+        write_textfile(path, samples)
+    logger.info("Metrics written to %s" % path)
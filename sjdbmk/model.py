@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+#
+# Week and day data for the Daily Bulletin Build System
+# Copyright (C) 2024 Runxi Yu <https://runxiyu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Typed, slotted classes for what week-*.json and day-*.json hold. The files
+# keep their layout: from_json() and to_json() convert to and from exactly
+# the dicts and lists they contain, in the same order, and the lookups that
+# used to be try/except around nested indexing are methods returning None.
+#
+
+from __future__ import annotations
+from typing import Any, Optional, Union
+import dataclasses
+import datetime
+
+SNACK_TIMES = ["Morning", "Afternoon", "Evening"]
+# Week sections that weekly can carry forward from an earlier week
+STALE_SECTIONS = ["community_time", "aods", "menu"]
+
+
+@dataclasses.dataclass(slots=True)
+class Station:
+    name: str
+    items: list[str]
+
+
+@dataclasses.dataclass(slots=True)
+class Meal:
+    # One meal on one day, station by station
+    stations: list[Station]
+
+    @classmethod
+    def from_json(cls, data: dict[str, list[str]]) -> Meal:
+        return cls([Station(name, items) for name, items in data.items()])
+
+    def to_json(self) -> dict[str, list[str]]:
+        return {station.name: station.items for station in self.stations}
+
+    def station(self, name: str) -> Optional[Station]:
+        for station in self.stations:
+            if station.name == name:
+                return station
+        return None
+
+
+@dataclasses.dataclass(slots=True)
+class Week:
+    start_date: datetime.date
+    # Per day from start_date, each a list of the Community Time slots
+    community_time: list[list[str]]
+    aods: list[str]
+    # Meal name, then weekday abbreviation as in daily.DAYNAMES_SHORT
+    meals: dict[str, dict[str, Meal]]
+    # Snack time, then per day from start_date, or "" for a time the menu
+    # has no row for, as with the Evening on some menus
+    snacks: dict[str, Union[list[Optional[str]], str]]
+    # Sections carried forward from an earlier week, as in STALE_SECTIONS;
+    # only written when there are any
+    stale: list[str] = dataclasses.field(default_factory=list)
+
+    @classmethod
+    def from_json(cls, data: dict[str, Any]) -> Week:
+        return cls(
+            start_date=datetime.date.fromisoformat(data["start_date"]),
+            community_time=data["community_time"],
+            aods=data["aods"],
+            meals={
+                meal_name: {
+                    weekday: Meal.from_json(meal) for weekday, meal in meal_days.items()
+                }
+                for meal_name, meal_days in data["menu"].items()
+            },
+            snacks=data.get("snacks", {}),
+            stale=data.get("stale", []),
+        )
+
+    def to_json(self) -> dict[str, Any]:
+        data: dict[str, Any] = {
+            "start_date": self.start_date.isoformat(),
+            "community_time": self.community_time,
+            "aods": self.aods,
+            "menu": {
+                meal_name: {weekday: meal.to_json() for weekday, meal in days.items()}
+                for meal_name, days in self.meals.items()
+            },
+            "snacks": self.snacks,
+        }
+        if self.stale:
+            data["stale"] = self.stale
+        return data
+
+    def meal(self, meal_name: str, weekday: str) -> Optional[Meal]:
+        return self.meals.get(meal_name, {}).get(weekday)
+
+    def aod(self, offset: int) -> Optional[str]:
+        return self.aods[offset] if 0 <= offset < len(self.aods) else None
+
+    def snack(self, time: str, offset: int) -> Optional[str]:
+        snacks = self.snacks.get(time) or []
+        return snacks[offset] if 0 <= offset < len(snacks) else None
+
+    def community_time_from(self, offset: int) -> list[list[str]]:
+        return self.community_time[offset:]
+
+
+@dataclasses.dataclass(slots=True)
+class Day:
+    stddate: str
+    community_time: list[list[str]]
+    aod: str
+    weekday_english: str
+    weekdays_abbrev: list[str]
+    weekday_chinese: str
+    day_of_cycle: str
+    today_breakfast: Meal
+    today_lunch: Meal
+    today_dinner: Optional[Meal]
+    next_breakfast: Optional[Meal]
+    the_week_ahead_url: str
+    today_snack: dict[str, Optional[str]]
+    inspiration_type: Optional[str] = None
+    inspiration_shared_by: Optional[str] = None
+    inspiration_origin: Optional[str] = None
+    inspiration_text: Optional[str] = None
+    inspiration_image_data: Optional[str] = None
+    inspiration_image_mime: Optional[str] = None
+    on_this_day_html_en: Optional[str] = None
+    on_this_day_html_zh: Optional[str] = None
+    in_the_news_html_en: Optional[str] = None
+    in_the_news_html_zh: Optional[str] = None
+    # As in Week, for the template to label; only written when there are any
+    stale: list[str] = dataclasses.field(default_factory=list)
+
+    @property
+    def days_after_this(self) -> int:
+        return len(self.community_time) - 1
+
+    @classmethod
+    def from_json(cls, data: dict[str, Any]) -> Day:
+        fields: dict[str, Any] = {
+            field.name: data.get(field.name) for field in dataclasses.fields(cls)
+        }
+        for meal_field in [
+            "today_breakfast",
+            "today_lunch",
+            "today_dinner",
+            "next_breakfast",
+        ]:
+            if fields[meal_field] is not None:
+                fields[meal_field] = Meal.from_json(fields[meal_field])
+        fields["stale"] = fields["stale"] or []
+        return cls(**fields)
+
+    def to_json(self) -> dict[str, Any]:
+        data: dict[str, Any] = {
+            "stddate": self.stddate,
+            "community_time": self.community_time,
+            "days_after_this": self.days_after_this,
+            "aod": self.aod,
+            "weekday_english": self.weekday_english,
+            "weekdays_abbrev": self.weekdays_abbrev,
+            "weekday_chinese": self.weekday_chinese,
+            "day_of_cycle": self.day_of_cycle,
+            "today_breakfast": self.today_breakfast.to_json(),
+            "today_lunch": self.today_lunch.to_json(),
+            "today_dinner": (
+                self.today_dinner.to_json() if self.today_dinner else None
+            ),
+            "next_breakfast": (
+                self.next_breakfast.to_json() if self.next_breakfast else None
+            ),
+            "the_week_ahead_url": self.the_week_ahead_url,
+            "today_snack": self.today_snack,
+            "inspiration_type": self.inspiration_type,
+            "inspiration_shared_by": self.inspiration_shared_by,
+            "inspiration_origin": self.inspiration_origin,
+            "inspiration_text": self.inspiration_text,
+            "inspiration_image_data": self.inspiration_image_data,
+            "inspiration_image_mime": self.inspiration_image_mime,
+            "on_this_day_html_en": self.on_this_day_html_en,
+            "on_this_day_html_zh": self.on_this_day_html_zh,
+            "in_the_news_html_en": self.in_the_news_html_en,
+            "in_the_news_html_zh": self.in_the_news_html_zh,
+        }
+        if self.stale:
+            data["stale"] = self.stale
+        return data
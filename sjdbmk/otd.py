@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+#
+# On This Day storage for the Songjiang Daily Bulletin Build System
+# Copyright (C) 2024 Runxi Yu <https://runxiyu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# All On This Day entries live in a single SQLite table keyed by
+# (language, MM-DD), instead of one HTML file per language per day.
+# The store is always rebuilt in a temporary file next to the final one and
+# then renamed over it, so readers never see a half-written store.
+#
+
+from __future__ import annotations
+from typing import Iterable, Iterator, Optional
+from configparser import ConfigParser
+import argparse
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+OTD_STORE_FILENAME = "otd.sqlite3"
+
+
+def write_store(
+    entries: Iterable[tuple[str, str, str]], path: str = OTD_STORE_FILENAME
+) -> int:
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temporary_path = tempfile.mkstemp(
+        prefix=".otd-", suffix=".sqlite3", dir=directory
+    )
+    os.close(fd)
+    count = 0
+    try:
+        connection = sqlite3.connect(temporary_path)
+        try:
+            connection.execute(
+                "CREATE TABLE otd ("
+                "language TEXT NOT NULL, "
+                "month_day TEXT NOT NULL, "
+                "html TEXT NOT NULL, "
+                "PRIMARY KEY (language, month_day)"
+                ") WITHOUT ROWID"
+            )
+            for language, month_day, html in entries:
+                connection.execute(
+                    "INSERT OR REPLACE INTO otd VALUES (?, ?, ?)",
+                    (language, month_day, html),
+                )
+                count += 1
+            connection.commit()
+        finally:
+            connection.close()
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+    logger.info("Wrote %d On This Day entries to %s" % (count, path))
+    return count
+
+
+def read_on_this_day(
+    language: str, month_day: str, path: str = OTD_STORE_FILENAME
+) -> Optional[str]:
+    if not os.path.isfile(path):
+        logger.warning("On This Day store %s not found" % path)
+        return None
+    connection = sqlite3.connect("file:%s?mode=ro" % path, uri=True)
+    try:
+        row = connection.execute(
+            "SELECT html FROM otd WHERE language = ? AND month_day = ?",
+            (language, month_day),
+        ).fetchone()
+    finally:
+        connection.close()
+    if row is None:
+        logger.warning("On This Day %s not found for %s" % (language, month_day))
+        return None
+    assert isinstance(row[0], str)
+    return row[0]
+
+
+def read_legacy_files(directory: str = ".") -> Iterator[tuple[str, str, str]]:
+    for filename in sorted(os.listdir(directory)):
+        matched = re.fullmatch(r"otd_(en|zh)-([0-9]{2}-[0-9]{2})\.html", filename)
+        if not matched:
+            continue
+        with open(os.path.join(directory, filename), "r", encoding="utf-8") as fd:
+            yield (matched.group(1), matched.group(2), fd.read())
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Import legacy otd_*.html files into the On This Day store"
+    )
+    parser.add_argument(
+        "--config", default="config.ini", help="path to the configuration file"
+    )
+    args = parser.parse_args()
+
+    config = ConfigParser()
+    config.read(args.config)
+
+    build_path = config["general"]["build_path"]
+    os.chdir(build_path)
+
+    write_store(read_legacy_files())
+
+
+if __name__ == "__main__":
+    main()
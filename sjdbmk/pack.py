@@ -24,39 +24,58 @@ import datetime
 import argparse
 import logging
 import zoneinfo
-from jinja2 import Template, StrictUndefined
+
+from . import instrument, retention, store
 
 
 def main(date: str, config: ConfigParser) -> None:
+    # Imported here so that --help does not wait for jinja2
+    from jinja2 import Template, StrictUndefined
 
-    with open(
-        os.path.join(config["templates"]["directory"], config["templates"]["main"]),
-        "r",
-        encoding="utf-8",
-    ) as template_file:
-        template = Template(
-            template_file.read(), undefined=StrictUndefined, autoescape=True
-        )
+    with instrument.stage("load_template"):
+        with open(
+            os.path.join(config["templates"]["directory"], config["templates"]["main"]),
+            "r",
+            encoding="utf-8",
+        ) as template_file:
+            template = Template(
+                template_file.read(), undefined=StrictUndefined, autoescape=True
+            )
 
-    with open(
-        os.path.join(
-            config["general"]["build_path"], "day-" + date.replace("-", "") + ".json"
-        ),
-        "r",
-        encoding="utf-8",
-    ) as fd:
-        data = json.load(fd)
+    store_path = os.path.join(
+        config["general"]["build_path"], store.ARTIFACT_STORE_FILENAME
+    )
+    with instrument.stage("load_day"):
+        try:
+            with retention.open_artifact(
+                os.path.join(
+                    config["general"]["build_path"],
+                    "day-" + date.replace("-", "") + ".json",
+                )
+            ) as fd:
+                data = json.load(fd)
+        except FileNotFoundError:
+            stored = (
+                store.get_day(date, store_path) if store.enabled(store_path) else None
+            )
+            if stored is None:
+                raise
+            data = stored
 
     # extra_data = {
     # }
     #
     # data = data | extra_data
 
-    template.stream(**data).dump(
-        os.path.join(
-            config["general"]["build_path"], "sjdb-%s.html" % date.replace("-", "")
-        )
+    output_filename = os.path.join(
+        config["general"]["build_path"],
+        "sjdb-%s.html" % date.replace("-", ""),
     )
+    with instrument.stage("render"):
+        template.stream(**data).dump(output_filename)
+    if store.enabled(store_path):
+        with open(output_filename, "r", encoding="utf-8") as fd:
+            store.put_bulletin(date, fd.read(), store_path)
 
     # FIXME: Escape the dangerous HTML!
 
@@ -75,6 +94,15 @@ if __name__ == "__main__":
         parser.add_argument(
             "--config", default="config.ini", help="path to the configuration file"
         )
+        parser.add_argument(
+            "--profile", action="store_true", help="dump a cProfile of this run"
+        )
+        parser.add_argument(
+            "--no-trace-memory",
+            dest="trace_memory",
+            action="store_false",
+            help="leave peak memory out of the run report, which is faster",
+        )
         args = parser.parse_args()
         config = ConfigParser()
         config.read(args.config)
@@ -87,6 +115,15 @@ if __name__ == "__main__":
             date = (now + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
         logging.info("Generating for day %s" % date)
         # main(date, config)
-        main(date, config)
+        with instrument.run(
+            "pack",
+            report_directory=config["general"]["build_path"],
+            profile=args.profile,
+            trace_memory=args.trace_memory,
+            metrics_directory=config.get(
+                "metrics", "textfile_directory", fallback=None
+            ),
+        ):
+            main(date, config)
     except KeyboardInterrupt:
         logging.critical("KeyboardInterrupt")
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+#
+# Read individual members of a remote zip file with HTTP range requests
+# Copyright (C) 2024 Runxi Yu <https://runxiyu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# The Week Ahead is mostly photos, but we only need a few small XML parts.
+# RemoteZip fetches the end of central directory record and the central
+# directory, and then range-fetches single members on demand. Callers should
+# fall back to a full download when RemoteZipError is raised, e.g. when the
+# server ignores Range headers or the archive needs ZIP64.
+#
+
+from __future__ import annotations
+from typing import Iterable
+import logging
+import os
+import struct
+import zipfile
+import zlib
+
+from . import common
+
+logger = logging.getLogger(__name__)
+
+EOCD_SIGNATURE = b"PK\x05\x06"
+EOCD_FORMAT = "<4sHHHHIIH"
+EOCD_SIZE = struct.calcsize(EOCD_FORMAT)
+CENTRAL_SIGNATURE = b"PK\x01\x02"
+CENTRAL_FORMAT = "<4sHHHHHHIIIHHHHHII"
+CENTRAL_SIZE = struct.calcsize(CENTRAL_FORMAT)
+LOCAL_SIGNATURE = b"PK\x03\x04"
+LOCAL_FORMAT = "<4sHHHHHIIIHH"
+LOCAL_SIZE = struct.calcsize(LOCAL_FORMAT)
+
+# Local headers may carry a different extra field than the central directory;
+# over-fetching a little usually saves a second round trip.
+LOCAL_EXTRA_SLACK = 256
+TAIL_GUESS = 4096
+
+# What parsing or inflating truncated or corrupt data raises, which callers
+# see as RemoteZipError like any other reason to download all of it
+MALFORMED_DATA_ERRORS = (struct.error, zlib.error, UnicodeDecodeError)
+
+
+class RemoteZipError(Exception):
+    pass
+
+
+class RemoteZip:
+    def __init__(self, url: str, headers: dict[str, str], timeout: int = 20) -> None:
+        self.url = url
+        self.headers = headers
+        self.timeout = timeout
+        self.bytes_transferred = 0
+        self.size = 0
+        self.entries: dict[str, tuple[int, int, int, int, int]] = {}
+        try:
+            self._read_central_directory()
+        except MALFORMED_DATA_ERRORS as e:
+            raise RemoteZipError("Corrupt central directory: %s" % e) from e
+
+    def _fetch(self, range_spec: str) -> bytes:
+        response = common.request(
+            "GET",
+            self.url,
+            headers=self.headers
+            | {"Range": "bytes=%s" % range_spec, "Accept-Encoding": "identity"},
+            stream=True,
+            timeout=self.timeout,
+        )
+        if response.status_code != 206:
+            # Streamed, so a server ignoring Range doesn't send us everything
+            response.close()
+            raise RemoteZipError(
+                "Range request returned %d instead of 206" % response.status_code
+            )
+        content_range = response.headers.get("Content-Range", "")
+        try:
+            self.size = int(content_range.rsplit("/", 1)[1])
+        except (IndexError, ValueError):
+            raise RemoteZipError("Bad Content-Range header %r" % content_range)
+        self.bytes_transferred += len(response.content)
+        return response.content
+
+    def _fetch_between(self, start: int, end: int) -> bytes:
+        return self._fetch("%d-%d" % (start, end - 1))
+
+    def _read_central_directory(self) -> None:
+        # Archive comments are almost always empty, so try a small tail first
+        # before fetching the largest possible end of central directory record.
+        for tail_length in (TAIL_GUESS, EOCD_SIZE + 65535):
+            tail = self._fetch("-%d" % tail_length)
+            tail_start = self.size - len(tail)
+            eocd_position = tail.rfind(EOCD_SIGNATURE)
+            if eocd_position >= 0 or len(tail) >= self.size:
+                break
+        if eocd_position < 0:
+            raise RemoteZipError("End of central directory record not found")
+        _, _, _, _, entry_count, directory_size, directory_offset, _ = (
+            struct.unpack_from(EOCD_FORMAT, tail, eocd_position)
+        )
+        if directory_offset == 0xFFFFFFFF or entry_count == 0xFFFF:
+            raise RemoteZipError("ZIP64 archives are not supported")
+
+        if directory_offset >= tail_start:
+            directory = tail[
+                directory_offset
+                - tail_start : directory_offset
+                - tail_start
+                + directory_size
+            ]
+        else:
+            directory = self._fetch_between(
+                directory_offset, directory_offset + directory_size
+            )
+
+        position = 0
+        for _ in range(entry_count):
+            (
+                signature,
+                _,
+                _,
+                _,
+                method,
+                _,
+                _,
+                crc,
+                compressed_size,
+                _,
+                name_length,
+                extra_length,
+                comment_length,
+                _,
+                _,
+                _,
+                local_offset,
+            ) = struct.unpack_from(CENTRAL_FORMAT, directory, position)
+            if signature != CENTRAL_SIGNATURE:
+                raise RemoteZipError("Corrupt central directory")
+            position += CENTRAL_SIZE
+            name = directory[position : position + name_length].decode("utf-8")
+            position += name_length + extra_length + comment_length
+            self.entries[name] = (
+                method,
+                compressed_size,
+                local_offset,
+                name_length,
+                crc,
+            )
+
+    def namelist(self) -> list[str]:
+        return list(self.entries)
+
+    def read(self, name: str) -> bytes:
+        try:
+            method, compressed_size, local_offset, name_length, crc = self.entries[name]
+        except KeyError:
+            raise KeyError("There is no item named %r in the archive" % name)
+        try:
+            return self._read_member(
+                name, method, compressed_size, local_offset, name_length, crc
+            )
+        except MALFORMED_DATA_ERRORS as e:
+            raise RemoteZipError("Corrupt data for %s: %s" % (name, e)) from e
+
+    def _read_member(
+        self,
+        name: str,
+        method: int,
+        compressed_size: int,
+        local_offset: int,
+        name_length: int,
+        crc: int,
+    ) -> bytes:
+        guess = LOCAL_SIZE + name_length + LOCAL_EXTRA_SLACK + compressed_size
+        chunk = self._fetch_between(local_offset, min(local_offset + guess, self.size))
+        signature, _, _, _, _, _, _, _, _, local_name_length, local_extra_length = (
+            struct.unpack_from(LOCAL_FORMAT, chunk)
+        )
+        if signature != LOCAL_SIGNATURE:
+            raise RemoteZipError("Corrupt local header for %s" % name)
+        data_start = LOCAL_SIZE + local_name_length + local_extra_length
+        data = chunk[data_start : data_start + compressed_size]
+        if len(data) < compressed_size:
+            data += self._fetch_between(
+                local_offset + data_start + len(data),
+                local_offset + data_start + compressed_size,
+            )
+
+        if method == zipfile.ZIP_STORED:
+            content = data
+        elif method == zipfile.ZIP_DEFLATED:
+            content = zlib.decompress(data, -15)
+        else:
+            raise RemoteZipError(
+                "Unsupported compression method %d for %s" % (method, name)
+            )
+        if zlib.crc32(content) != crc:
+            raise RemoteZipError("CRC mismatch for %s" % name)
+        return content
+
+    def extract_to_zip(self, names: Iterable[str], local_filename: str) -> None:
+        # Written under a temporary name so an interrupted fetch never leaves
+        # something that looks like a complete download behind
+        temporary_filename = local_filename + ".part"
+        try:
+            with zipfile.ZipFile(
+                temporary_filename, "w", zipfile.ZIP_DEFLATED
+            ) as local_zip:
+                for name in names:
+                    local_zip.writestr(name, self.read(name))
+            os.replace(temporary_filename, local_filename)
+        except BaseException:
+            if os.path.exists(temporary_filename):
+                os.unlink(temporary_filename)
+            raise
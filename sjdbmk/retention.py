@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+#
+# Build directory retention for the Daily Bulletin Build System
+# Copyright (C) 2024 Runxi Yu <https://runxiyu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# Keeps the build directory from growing forever. Ages come from the date in
+# each file name, and the thresholds from [retention]:
+#
+# - After compress_after_days, week, day and bulletin files are gzipped;
+#   day files carry the inspiration images in base64, which gzip mostly
+#   undoes. A full download of The Week Ahead is cut down to its slide parts,
+#   and The Week Ahead parse caches are removed, as parsing rebuilds them.
+# - After remove_after_days, run reports and profiles are removed, and so
+#   are week, day and bulletin files that the artifact store also holds.
+#
+# Menus, The Week Ahead slide parts and inspirations are never removed, as
+# they may not be there to download again. They are zip files and images
+# already, which gzip would not shrink.
+#
+# Whatever reads these files goes through open_artifact(), which opens the
+# file if it is there and its .gz otherwise.
+#
+#     python3 -m sjdbmk.retention --dry-run
+#
+
+from __future__ import annotations
+from typing import IO, Optional
+from configparser import ConfigParser
+import argparse
+import datetime
+import gzip
+import logging
+import os
+import re
+import shutil
+import tempfile
+import zoneinfo
+
+logger = logging.getLogger(__name__)
+
+COMPRESSED_SUFFIX = ".gz"
+COMPRESS_LEVEL = 6
+DEFAULT_COMPRESS_AFTER_DAYS = 28
+DEFAULT_REMOVE_AFTER_DAYS = 365
+
+# The artifact store table holding each kind of file
+STORED_KINDS = {"week": "weeks", "day": "days", "sjdb": "bulletins"}
+ARTIFACT_PATTERN = re.compile(
+    r"(?P<kind>week|day|sjdb)-(?P<date>[0-9]{8})\.(json|html)" r"(?P<compressed>\.gz)?"
+)
+THE_WEEK_AHEAD_PATTERN = re.compile(r"the_week_ahead-(?P<date>[0-9]{8})\.pptx")
+CACHE_PATTERN = re.compile(r"the_week_ahead-(?P<date>[0-9]{8})\.(parsed|index)\.json")
+REPORT_PATTERN = re.compile(r"run-(?P<date>[0-9]{8})T[0-9]{6}Z-\w+\.(json|prof)")
+
+
+def existing_path(filename: str) -> Optional[str]:
+    # The file itself if it is there, which wins over a stale compressed copy
+    if os.path.isfile(filename):
+        return filename
+    if os.path.isfile(filename + COMPRESSED_SUFFIX):
+        return filename + COMPRESSED_SUFFIX
+    return None
+
+
+def exists(filename: str) -> bool:
+    return existing_path(filename) is not None
+
+
+def open_artifact(filename: str) -> IO[str]:
+    # Raises FileNotFoundError for the uncompressed name if neither is there
+    if not os.path.isfile(filename) and os.path.isfile(filename + COMPRESSED_SUFFIX):
+        return gzip.open(filename + COMPRESSED_SUFFIX, "rt", encoding="utf-8")
+    return open(filename, "r", encoding="utf-8")
+
+
+def compress(filename: str) -> int:
+    # Written next to the file and renamed over filename.gz, keeping the
+    # modification time, before the original goes; returns the new size
+    stat = os.stat(filename)
+    fd, temporary_filename = tempfile.mkstemp(
+        prefix=".retention-", dir=os.path.dirname(filename) or "."
+    )
+    try:
+        with os.fdopen(fd, "wb") as raw_file, open(filename, "rb") as source:
+            with gzip.GzipFile(
+                os.path.basename(filename),
+                "wb",
+                COMPRESS_LEVEL,
+                raw_file,
+                mtime=int(stat.st_mtime),
+            ) as compressed_file:
+                shutil.copyfileobj(source, compressed_file)
+        shutil.copymode(filename, temporary_filename)
+        os.utime(temporary_filename, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(temporary_filename, filename + COMPRESSED_SUFFIX)
+    except BaseException:
+        os.unlink(temporary_filename)
+        raise
+    os.unlink(filename)
+    return os.stat(filename + COMPRESSED_SUFFIX).st_size
+
+
+def file_date(date: str) -> datetime.date:
+    return datetime.datetime.strptime(date, "%Y%m%d").date()
+
+
+def plan(
+    filenames: list[str],
+    today: datetime.date,
+    compress_after_days: int,
+    remove_after_days: int,
+    stored: dict[str, set[str]],
+) -> list[tuple[str, str]]:
+    # (action, filename) for every file due for one: "compress", "slim" or
+    # "remove"
+    compress_before = today - datetime.timedelta(days=compress_after_days)
+    remove_before = today - datetime.timedelta(days=remove_after_days)
+    actions = []
+    for filename in sorted(filenames):
+        if matched := ARTIFACT_PATTERN.fullmatch(filename):
+            date = file_date(matched.group("date"))
+            iso_date = date.isoformat()
+            if date < remove_before and iso_date in stored.get(
+                STORED_KINDS[matched.group("kind")], set()
+            ):
+                actions.append(("remove", filename))
+            elif date < compress_before and not matched.group("compressed"):
+                # A rebuild of an old day replaces its compressed copy this way
+                actions.append(("compress", filename))
+        elif matched := THE_WEEK_AHEAD_PATTERN.fullmatch(filename):
+            if file_date(matched.group("date")) < compress_before:
+                actions.append(("slim", filename))
+        elif matched := CACHE_PATTERN.fullmatch(filename):
+            if file_date(matched.group("date")) < compress_before:
+                actions.append(("remove", filename))
+        elif matched := REPORT_PATTERN.fullmatch(filename):
+            if file_date(matched.group("date")) < remove_before:
+                actions.append(("remove", filename))
+    return actions
+
+
+def stored_dates() -> dict[str, set[str]]:
+    # The dates each artifact store table holds, if there is a store
+    from . import store
+
+    if not store.enabled():
+        return {}
+    with store.connect() as connection:
+        return {
+            table: {
+                row[0]
+                for row in connection.execute(
+                    "SELECT %s FROM %s"
+                    % ("start_date" if table == "weeks" else "date", table)
+                )
+            }
+            for table in STORED_KINDS.values()
+        }
+
+
+def apply(actions: list[tuple[str, str]], dry_run: bool = False) -> int:
+    # Returns the bytes freed, or for a dry run those that removing would free
+    from . import twa, weeks
+
+    freed = 0
+    for action, filename in actions:
+        size = os.stat(filename).st_size
+        if dry_run:
+            print("would %-8s %s (%d bytes)" % (action, filename, size))
+            if action == "remove":
+                freed += size
+            continue
+        if action == "compress":
+            new_size = compress(filename)
+        elif action == "slim":
+            new_filename = twa.slim_the_week_ahead(filename)
+            new_size = os.stat(new_filename).st_size
+        else:
+            os.unlink(filename)
+            new_size = 0
+        print("%-8s %s (%d -> %d bytes)" % (action, filename, size, new_size))
+        freed += size - new_size
+    if not dry_run and any(
+        action == "remove" and filename.startswith("week-")
+        for action, filename in actions
+    ):
+        # Removed weeks are then found through the artifact store
+        weeks.rebuild()
+    return freed
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Compress or remove old files in the Daily Bulletin build directory"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="only list what would be done"
+    )
+    parser.add_argument(
+        "--config", default="config.ini", help="path to the configuration file"
+    )
+    args = parser.parse_args()
+
+    config = ConfigParser()
+    config.read(args.config)
+    today = datetime.datetime.now(
+        zoneinfo.ZoneInfo(config["general"]["timezone"])
+    ).date()
+    compress_after_days = config.getint(
+        "retention", "compress_after_days", fallback=DEFAULT_COMPRESS_AFTER_DAYS
+    )
+    remove_after_days = config.getint(
+        "retention", "remove_after_days", fallback=DEFAULT_REMOVE_AFTER_DAYS
+    )
+    os.chdir(config["general"]["build_path"])
+
+    actions = plan(
+        os.listdir(), today, compress_after_days, remove_after_days, stored_dates()
+    )
+    freed = apply(actions, args.dry_run)
+    logger.info(
+        "%d files %s, %d bytes freed"
+        % (len(actions), "due" if args.dry_run else "done", freed)
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -19,15 +19,17 @@
 
 from __future__ import annotations
 from configparser import ConfigParser
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
 from pprint import pprint
 import datetime
 import zoneinfo
 import argparse
 import os
 
-import requests
-import msal  # type: ignore
+if TYPE_CHECKING:
+    import msal  # type: ignore
+
+from . import common, instrument, retention
 
 
 def acquire_token(app: msal.PublicClientApplication, config: ConfigParser) -> str:
@@ -74,26 +76,30 @@ def sendmail(
             {"id": "SystemTime 0x3FEF", "value": isoval}
         ]
 
-    if not reply_to:
-        response = requests.post(
-            "https://graph.microsoft.com/v1.0/me/messages",
-            json=data,
-            headers={
-                "Authorization": "Bearer %s" % token,
-                "Prefer": 'IdType="ImmutableId"',
-            },
-            timeout=20,
-        ).json()
-    else:
-        response = requests.post(
-            "https://graph.microsoft.com/v1.0/me/messages/%s/createReply" % reply_to,
-            json=data,
-            headers={
-                "Authorization": "Bearer %s" % token,
-                "Prefer": 'IdType="ImmutableId"',
-            },
-            timeout=20,
-        ).json()
+    with instrument.stage("create_draft"):
+        if not reply_to:
+            response = common.request(
+                "POST",
+                "https://graph.microsoft.com/v1.0/me/messages",
+                json=data,
+                headers={
+                    "Authorization": "Bearer %s" % token,
+                    "Prefer": 'IdType="ImmutableId"',
+                },
+                timeout=20,
+            ).json()
+        else:
+            response = common.request(
+                "POST",
+                "https://graph.microsoft.com/v1.0/me/messages/%s/createReply"
+                % reply_to,
+                json=data,
+                headers={
+                    "Authorization": "Bearer %s" % token,
+                    "Prefer": 'IdType="ImmutableId"',
+                },
+                timeout=20,
+            ).json()
 
     try:
         msgid = response["id"]
@@ -103,11 +109,13 @@ def sendmail(
 
     assert isinstance(msgid, str)
 
-    response2 = requests.post(
-        "https://graph.microsoft.com/v1.0/me/messages/%s/send" % msgid,
-        headers={"Authorization": "Bearer " + token},
-        timeout=20,
-    )
+    with instrument.stage("send"):
+        response2 = common.request(
+            "POST",
+            "https://graph.microsoft.com/v1.0/me/messages/%s/send" % msgid,
+            headers={"Authorization": "Bearer " + token},
+            timeout=20,
+        )
 
     if response2.status_code != 202:
         pprint(response2.content.decode("utf-8", "replace"))
@@ -142,6 +150,15 @@ def main() -> None:
     parser.add_argument(
         "--config", default="config.ini", help="path to the configuration file"
     )
+    parser.add_argument(
+        "--profile", action="store_true", help="dump a cProfile of this run"
+    )
+    parser.add_argument(
+        "--no-trace-memory",
+        dest="trace_memory",
+        action="store_false",
+        help="leave peak memory out of the run report, which is faster",
+    )
     args = parser.parse_args()
     config = ConfigParser()
     config.read(args.config)
@@ -155,125 +172,138 @@ def main() -> None:
         ) + datetime.timedelta(days=1)
 
     os.chdir(config["general"]["build_path"])
+    common.install_graph_transport(config)
 
-    html_filename = "sjdb-%s.html" % date.strftime("%Y%m%d")
-    with open(html_filename, "r", encoding="utf-8") as html_fd:
-        html = html_fd.read()
+    with instrument.run(
+        "sendmail",
+        profile=args.profile,
+        trace_memory=args.trace_memory,
+        metrics_directory=config.get("metrics", "textfile_directory", fallback=None),
+    ):
+        html_filename = "sjdb-%s.html" % date.strftime("%Y%m%d")
+        with retention.open_artifact(html_filename) as html_fd:
+            html = html_fd.read()
 
-    app = msal.PublicClientApplication(
-        config["credentials"]["client_id"],
-        authority=config["credentials"]["authority"],
-    )
-    token = acquire_token(app, config)
+        with instrument.stage("login"):
+            if common.replaying_graph():
+                token = common.REPLAY_TOKEN
+            else:
+                import msal
 
-    if not args.reply:
-        a = sendmail(
-            token,
-            subject=config["sendmail"]["subject_format"]
-            % date.strftime(config["sendmail"]["subject_date_format"]),
-            body=html,
-            to=config["sendmail"]["to_1"].split(" "),
-            cc=config["sendmail"]["cc_1"].split(" "),
-            bcc=[
-                w.strip()
-                for w in open(config["sendmail"]["bcc_1_file"], "r").readlines()
-                if w.strip()
-            ],
-            when=date.replace(
-                hour=int(config["sendmail"]["hour"]),
-                minute=int(config["sendmail"]["minute"]),
-                second=0,
-                microsecond=0,
-            ),
-            content_type="HTML",
-            importance="Normal",
-            respect_when=(not args.now),
-        )
-        assert a
-        with open("last-a.txt", "w") as fd:
-            fd.write(a)
-        b = sendmail(
-            token,
-            subject=config["sendmail"]["subject_format"]
-            % date.strftime(config["sendmail"]["subject_date_format"]),
-            body=html,
-            to=config["sendmail"]["to_2"].split(" "),
-            cc=config["sendmail"]["cc_2"].split(" "),
-            bcc=[
-                w.strip()
-                for w in open(config["sendmail"]["bcc_2_file"], "r").readlines()
-                if w.strip()
-            ],
-            when=date.replace(
-                hour=int(config["sendmail"]["hour"]),
-                minute=int(config["sendmail"]["minute"]),
-                second=0,
-                microsecond=0,
-            ),
-            content_type="HTML",
-            importance="Normal",
-            respect_when=(not args.now),
-        )
-        assert b
-        with open("last-b.txt", "w") as fd:
-            fd.write(b)
-    else:
-        with open("last-a.txt", "r") as fd:
-            last_a = fd.read().strip()
-        a = sendmail(
-            token,
-            subject=config["sendmail"]["subject_format"]
-            % date.strftime(config["sendmail"]["subject_date_format"]),
-            body=html,
-            to=config["sendmail"]["to_1"].split(" "),
-            cc=config["sendmail"]["cc_1"].split(" "),
-            bcc=[
-                w.strip()
-                for w in open(config["sendmail"]["bcc_1_file"], "r").readlines()
-                if w.strip()
-            ],
-            when=date.replace(
-                hour=int(config["sendmail"]["hour"]),
-                minute=int(config["sendmail"]["minute"]),
-                second=0,
-                microsecond=0,
-            ),
-            content_type="HTML",
-            importance="Normal",
-            reply_to=last_a,
-            respect_when=(not args.now),
-        )
-        assert a
-        with open("last-a.txt", "w") as fd:
-            fd.write(a)
-        with open("last-b.txt", "r") as fd:
-            last_b = fd.read().strip()
-        b = sendmail(
-            token,
-            subject=config["sendmail"]["subject_format"]
-            % date.strftime(config["sendmail"]["subject_date_format"]),
-            body=html,
-            to=config["sendmail"]["to_2"].split(" "),
-            cc=config["sendmail"]["cc_2"].split(" "),
-            bcc=[
-                w.strip()
-                for w in open(config["sendmail"]["bcc_2_file"], "r").readlines()
-                if w.strip()
-            ],
-            when=date.replace(
-                hour=int(config["sendmail"]["hour"]),
-                minute=int(config["sendmail"]["minute"]),
-                second=0,
-                microsecond=0,
-            ),
-            content_type="HTML",
-            importance="Normal",
-            reply_to=last_b,
-            respect_when=(not args.now),
-        )
-        assert b
-        with open("last-b.txt", "w") as fd:
-            fd.write(b)
+                app = msal.PublicClientApplication(
+                    config["credentials"]["client_id"],
+                    authority=config["credentials"]["authority"],
+                )
+                token = acquire_token(app, config)
+
+        if not args.reply:
+            a = sendmail(
+                token,
+                subject=config["sendmail"]["subject_format"]
+                % date.strftime(config["sendmail"]["subject_date_format"]),
+                body=html,
+                to=config["sendmail"]["to_1"].split(" "),
+                cc=config["sendmail"]["cc_1"].split(" "),
+                bcc=[
+                    w.strip()
+                    for w in open(config["sendmail"]["bcc_1_file"], "r").readlines()
+                    if w.strip()
+                ],
+                when=date.replace(
+                    hour=int(config["sendmail"]["hour"]),
+                    minute=int(config["sendmail"]["minute"]),
+                    second=0,
+                    microsecond=0,
+                ),
+                content_type="HTML",
+                importance="Normal",
+                respect_when=(not args.now),
+            )
+            assert a
+            with open("last-a.txt", "w") as fd:
+                fd.write(a)
+            b = sendmail(
+                token,
+                subject=config["sendmail"]["subject_format"]
+                % date.strftime(config["sendmail"]["subject_date_format"]),
+                body=html,
+                to=config["sendmail"]["to_2"].split(" "),
+                cc=config["sendmail"]["cc_2"].split(" "),
+                bcc=[
+                    w.strip()
+                    for w in open(config["sendmail"]["bcc_2_file"], "r").readlines()
+                    if w.strip()
+                ],
+                when=date.replace(
+                    hour=int(config["sendmail"]["hour"]),
+                    minute=int(config["sendmail"]["minute"]),
+                    second=0,
+                    microsecond=0,
+                ),
+                content_type="HTML",
+                importance="Normal",
+                respect_when=(not args.now),
+            )
+            assert b
+            with open("last-b.txt", "w") as fd:
+                fd.write(b)
+        else:
+            with open("last-a.txt", "r") as fd:
+                last_a = fd.read().strip()
+            a = sendmail(
+                token,
+                subject=config["sendmail"]["subject_format"]
+                % date.strftime(config["sendmail"]["subject_date_format"]),
+                body=html,
+                to=config["sendmail"]["to_1"].split(" "),
+                cc=config["sendmail"]["cc_1"].split(" "),
+                bcc=[
+                    w.strip()
+                    for w in open(config["sendmail"]["bcc_1_file"], "r").readlines()
+                    if w.strip()
+                ],
+                when=date.replace(
+                    hour=int(config["sendmail"]["hour"]),
+                    minute=int(config["sendmail"]["minute"]),
+                    second=0,
+                    microsecond=0,
+                ),
+                content_type="HTML",
+                importance="Normal",
+                reply_to=last_a,
+                respect_when=(not args.now),
+            )
+            assert a
+            with open("last-a.txt", "w") as fd:
+                fd.write(a)
+            with open("last-b.txt", "r") as fd:
+                last_b = fd.read().strip()
+            b = sendmail(
+                token,
+                subject=config["sendmail"]["subject_format"]
+                % date.strftime(config["sendmail"]["subject_date_format"]),
+                body=html,
+                to=config["sendmail"]["to_2"].split(" "),
+                cc=config["sendmail"]["cc_2"].split(" "),
+                bcc=[
+                    w.strip()
+                    for w in open(config["sendmail"]["bcc_2_file"], "r").readlines()
+                    if w.strip()
+                ],
+                when=date.replace(
+                    hour=int(config["sendmail"]["hour"]),
+                    minute=int(config["sendmail"]["minute"]),
+                    second=0,
+                    microsecond=0,
+                ),
+                content_type="HTML",
+                importance="Normal",
+                reply_to=last_b,
+                respect_when=(not args.now),
+            )
+            assert b
+            with open("last-b.txt", "w") as fd:
+                fd.write(b)
 
 
 if __name__ == "__main__":
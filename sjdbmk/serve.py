@@ -20,7 +20,7 @@
 
 
 from __future__ import annotations
-from typing import Union, TypeAlias
+from typing import Any, Union, TypeAlias
 import json
 import datetime
 import zoneinfo
@@ -34,6 +34,8 @@ from flask import (
     render_template,
 )
 
+from . import retention, store
+
 ResponseType: TypeAlias = Union[Response, werkzeugResponse, str]
 
 app = Flask(__name__)
@@ -60,32 +62,43 @@ config.read("config.ini")
 # data = data | extra_data
 
 
+def load_day(stem: str) -> dict[str, Any]:
+    try:
+        with retention.open_artifact(
+            os.path.join(config["general"]["build_path"], "day-%s.json" % stem)
+        ) as fd:
+            data = json.load(fd)
+    except FileNotFoundError:
+        store_path = os.path.join(
+            config["general"]["build_path"], store.ARTIFACT_STORE_FILENAME
+        )
+        if not store.enabled(store_path):
+            raise
+        stored = store.get_day(
+            datetime.datetime.strptime(stem, "%Y%m%d").strftime("%Y-%m-%d"),
+            store_path,
+        )
+        if stored is None:
+            raise
+        data = stored
+    assert isinstance(data, dict)
+    return data
+
+
 @app.route("/")
 def index() -> ResponseType:
-    with open(
-        os.path.join(
-            config["general"]["build_path"],
-            "day-%s.json"
-            % (
-                datetime.datetime.now(tz=zoneinfo.ZoneInfo("Asia/Shanghai"))
-                + datetime.timedelta(days=1)
-            ).strftime("%Y%m%d"),
-        ),
-        "r",
-        encoding="utf-8",
-    ) as fd:
-        data = json.load(fd)
+    data = load_day(
+        (
+            datetime.datetime.now(tz=zoneinfo.ZoneInfo("Asia/Shanghai"))
+            + datetime.timedelta(days=1)
+        ).strftime("%Y%m%d")
+    )
     return render_template("template.html", **data)
 
 
 @app.route("/<date>")
 def date(date: str) -> ResponseType:
-    with open(
-        os.path.join(config["general"]["build_path"], "day-%s.json" % date),
-        "r",
-        encoding="utf-8",
-    ) as fd:
-        data = json.load(fd)
+    data = load_day(date)
     return render_template("template.html", **data)
 
 
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+#
+# Lightweight PPTX slide access for the Songjiang Daily Bulletin Build System
+# Copyright (C) 2024 Runxi Yu <https://runxiyu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# python-pptx loads every slide, layout, master and image relationship of a
+# deck. We only ever need the text of a couple of slides, so this module reads
+# the XML parts directly out of the zip container. Anything with a
+# read(name) -> bytes method works as a part reader, e.g. zipfile.ZipFile.
+#
+
+from __future__ import annotations
+from typing import Iterator, Optional, Protocol
+import posixpath
+import xml.etree.ElementTree as ET
+
+NAMESPACES = {
+    "a": "http://schemas.openxmlformats.org/drawingml/2006/main",
+    "p": "http://schemas.openxmlformats.org/presentationml/2006/main",
+    "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+    "rel": "http://schemas.openxmlformats.org/package/2006/relationships",
+}
+
+PRESENTATION_PART = "ppt/presentation.xml"
+PRESENTATION_RELS_PART = "ppt/_rels/presentation.xml.rels"
+
+
+class PartReader(Protocol):
+    def read(self, name: str) -> bytes: ...
+
+
+def resolve_target(base_directory: str, target: str) -> str:
+    if target.startswith("/"):
+        return target.lstrip("/")
+    return posixpath.normpath(posixpath.join(base_directory, target))
+
+
+def slide_part_names(reader: PartReader) -> list[str]:
+    presentation = ET.fromstring(reader.read(PRESENTATION_PART))
+    relationships = ET.fromstring(reader.read(PRESENTATION_RELS_PART))
+    targets = {
+        relationship.get("Id"): relationship.get("Target", "")
+        for relationship in relationships.iterfind("rel:Relationship", NAMESPACES)
+    }
+    return [
+        resolve_target("ppt", targets[slide_id.get("{%s}id" % NAMESPACES["r"])])
+        for slide_id in presentation.iterfind("p:sldIdLst/p:sldId", NAMESPACES)
+    ]
+
+
+def slide_rels_part_name(slide_part_name: str) -> str:
+    directory, filename = posixpath.split(slide_part_name)
+    return posixpath.join(directory, "_rels", filename + ".rels")
+
+
+def load_slide(reader: PartReader, page_number: int) -> ET.Element:
+    # Page numbers index like Python lists, so -1 is the last slide
+    return ET.fromstring(reader.read(slide_part_names(reader)[page_number]))
+
+
+def iter_shapes(slide: ET.Element) -> Iterator[ET.Element]:
+    shape_tree = slide.find("p:cSld/p:spTree", NAMESPACES)
+    if shape_tree is None:
+        return
+    for shape in shape_tree:
+        if shape.tag in (
+            "{%s}sp" % NAMESPACES["p"],
+            "{%s}graphicFrame" % NAMESPACES["p"],
+        ):
+            yield shape
+
+
+def paragraph_text(paragraph: ET.Element) -> str:
+    # Mirrors python-pptx's _Paragraph.text: runs and fields contribute their
+    # text, and line breaks become vertical tabs.
+    text = ""
+    for child in paragraph:
+        if child.tag in ("{%s}r" % NAMESPACES["a"], "{%s}fld" % NAMESPACES["a"]):
+            text += child.findtext("a:t", "", NAMESPACES)
+        elif child.tag == "{%s}br" % NAMESPACES["a"]:
+            text += "\v"
+    return text
+
+
+def shape_text(shape: ET.Element) -> Optional[str]:
+    text_body = shape.find("p:txBody", NAMESPACES)
+    if text_body is None:
+        return None
+    return "\n".join(
+        paragraph_text(paragraph) for paragraph in text_body.iterfind("a:p", NAMESPACES)
+    )
+
+
+def shape_is_title(shape: ET.Element) -> bool:
+    placeholder = shape.find("p:nvSpPr/p:nvPr/p:ph", NAMESPACES)
+    return placeholder is not None and placeholder.get("type") in (
+        "title",
+        "ctrTitle",
+    )
+
+
+def shape_table(shape: ET.Element) -> Optional[ET.Element]:
+    return shape.find("a:graphic/a:graphicData/a:tbl", NAMESPACES)
+
+
+def table_column_count(table: ET.Element) -> int:
+    return len(table.findall("a:tblGrid/a:gridCol", NAMESPACES))
+
+
+def table_rows(table: ET.Element) -> list[list[ET.Element]]:
+    return [
+        row.findall("a:tc", NAMESPACES) for row in table.iterfind("a:tr", NAMESPACES)
+    ]
+
+
+def cell_runs_text(cell: ET.Element) -> str:
+    # Only the runs, like iterating python-pptx's paragraphs and their runs
+    return "".join(
+        run.findtext("a:t", "", NAMESPACES)
+        for run in cell.iterfind("a:txBody/a:p/a:r", NAMESPACES)
+    )
+
+
+def cell_is_spanned(cell: ET.Element) -> bool:
+    return cell.get("hMerge") in ("1", "true") or cell.get("vMerge") in ("1", "true")
+
+
+def cell_span(cell: ET.Element) -> tuple[int, int]:
+    return int(cell.get("rowSpan", "1")), int(cell.get("gridSpan", "1"))
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+#
+# SQLite artifact store for the Daily Bulletin Build System
+# Copyright (C) 2024 Runxi Yu <https://runxiyu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# Week data, day data and rendered bulletins, each in a table keyed by its
+# ISO date, so that ranges, the archive and searches are indexed reads of one
+# file, and a backup is a single copy.
+#
+# The store is optional and only used once artifacts.sqlite3 exists in the
+# build directory, which migrating the existing files creates:
+#     python3 -m sjdbmk.store --migrate
+# From then on weekly, daily and pack write to it as well as to their usual
+# files, and whatever reads a week, a day or a bulletin falls back to the
+# store when the file is gone.
+#
+
+from __future__ import annotations
+from typing import Any, Iterator, Optional
+from configparser import ConfigParser
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import os
+import re
+import sqlite3
+
+from . import model, retention, weeks
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_STORE_FILENAME = "artifacts.sqlite3"
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS weeks (
+    start_date TEXT PRIMARY KEY,
+    days INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    updated TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS days (
+    date TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS bulletins (
+    date TEXT PRIMARY KEY,
+    html TEXT NOT NULL,
+    updated TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def enabled(path: str = ARTIFACT_STORE_FILENAME) -> bool:
+    return os.path.isfile(path)
+
+
+@contextlib.contextmanager
+def connect(path: str = ARTIFACT_STORE_FILENAME) -> Iterator[sqlite3.Connection]:
+    # Committed when the block ends without an exception. WAL lets the
+    # daemon read while a range or backfill is writing from several processes.
+    connection = sqlite3.connect(path, timeout=30)
+    try:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+
+
+def insert_week(connection: sqlite3.Connection, week: model.Week) -> None:
+    connection.execute(
+        "INSERT OR REPLACE INTO weeks VALUES (?, ?, ?, ?)",
+        (
+            week.start_date.isoformat(),
+            weeks.week_days(week),
+            json.dumps(week.to_json(), ensure_ascii=False),
+            now(),
+        ),
+    )
+
+
+def put_week(week: model.Week, path: str = ARTIFACT_STORE_FILENAME) -> None:
+    with connect(path) as connection:
+        insert_week(connection, week)
+
+
+def get_week(
+    start_date: datetime.date, path: str = ARTIFACT_STORE_FILENAME
+) -> Optional[model.Week]:
+    with connect(path) as connection:
+        row = connection.execute(
+            "SELECT data FROM weeks WHERE start_date = ?", (start_date.isoformat(),)
+        ).fetchone()
+    return model.Week.from_json(json.loads(row[0])) if row else None
+
+
+def week_for(
+    day: datetime.date, path: str = ARTIFACT_STORE_FILENAME
+) -> Optional[tuple[datetime.date, int]]:
+    # The start of the latest week covering the day, and the day's offset in
+    # school days, as in weeks.json
+    with connect(path) as connection:
+        row = connection.execute(
+            "SELECT start_date, days FROM weeks WHERE start_date <= ? "
+            "ORDER BY start_date DESC LIMIT 1",
+            (day.isoformat(),),
+        ).fetchone()
+    if row is None:
+        return None
+    start_date = datetime.date.fromisoformat(row[0])
+    offset = weeks.school_day_offset(start_date, day)
+    return (start_date, offset) if offset is not None and offset < row[1] else None
+
+
+def put_day(
+    stddate: str, data: dict[str, Any], path: str = ARTIFACT_STORE_FILENAME
+) -> None:
+    with connect(path) as connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO days VALUES (?, ?, ?)",
+            (stddate, json.dumps(data, ensure_ascii=False), now()),
+        )
+
+
+def get_day(
+    stddate: str, path: str = ARTIFACT_STORE_FILENAME
+) -> Optional[dict[str, Any]]:
+    with connect(path) as connection:
+        row = connection.execute(
+            "SELECT data FROM days WHERE date = ?", (stddate,)
+        ).fetchone()
+    if row is None:
+        return None
+    data = json.loads(row[0])
+    assert isinstance(data, dict)
+    return data
+
+
+def days_between(
+    first: str, last: str, path: str = ARTIFACT_STORE_FILENAME
+) -> list[tuple[str, dict[str, Any]]]:
+    with connect(path) as connection:
+        rows = connection.execute(
+            "SELECT date, data FROM days WHERE date BETWEEN ? AND ? ORDER BY date",
+            (first, last),
+        ).fetchall()
+    return [(stddate, json.loads(data)) for stddate, data in rows]
+
+
+def put_bulletin(stddate: str, html: str, path: str = ARTIFACT_STORE_FILENAME) -> None:
+    with connect(path) as connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO bulletins VALUES (?, ?, ?)",
+            (stddate, html, now()),
+        )
+
+
+def get_bulletin(stddate: str, path: str = ARTIFACT_STORE_FILENAME) -> Optional[str]:
+    with connect(path) as connection:
+        row = connection.execute(
+            "SELECT html FROM bulletins WHERE date = ?", (stddate,)
+        ).fetchone()
+    return row[0] if row else None
+
+
+def archive(path: str = ARTIFACT_STORE_FILENAME) -> list[tuple[str, int, str]]:
+    # Every rendered bulletin: date, size and when it was last written
+    with connect(path) as connection:
+        rows = connection.execute(
+            "SELECT date, length(html), updated FROM bulletins ORDER BY date"
+        ).fetchall()
+    return [(stddate, size, updated) for stddate, size, updated in rows]
+
+
+def search(text: str, path: str = ARTIFACT_STORE_FILENAME) -> list[str]:
+    # The dates whose day data mentions the text anywhere, e.g. a dish
+    with connect(path) as connection:
+        rows = connection.execute(
+            "SELECT date FROM days WHERE instr(data, ?) > 0 ORDER BY date",
+            (json.dumps(text, ensure_ascii=False)[1:-1],),
+        ).fetchall()
+    return [row[0] for row in rows]
+
+
+def backup(destination: str, path: str = ARTIFACT_STORE_FILENAME) -> None:
+    # A consistent copy, even while something is writing
+    target = sqlite3.connect(destination)
+    try:
+        with connect(path) as connection:
+            connection.backup(target)
+    finally:
+        target.close()
+
+
+def migrate(
+    directory: str = ".", path: str = ARTIFACT_STORE_FILENAME
+) -> dict[str, int]:
+    # Every file is imported, so running this again brings the store up to
+    # date with files written while it did not exist
+    counts = {"weeks": 0, "days": 0, "bulletins": 0}
+    filenames = set(os.listdir(directory))
+    with connect(path) as connection:
+        for filename in sorted(filenames):
+            matched = re.fullmatch(
+                r"(week|day)-([0-9]{4})([0-9]{2})([0-9]{2})\.json|"
+                r"sjdb-([0-9]{4})([0-9]{2})([0-9]{2})\.html",
+                filename.removesuffix(retention.COMPRESSED_SUFFIX),
+            )
+            # A compressed copy is only read when the file itself is gone
+            if not matched or (
+                matched.group(0) != filename and matched.group(0) in filenames
+            ):
+                continue
+            with retention.open_artifact(
+                os.path.join(directory, matched.group(0))
+            ) as fd:
+                content = fd.read()
+            if matched.group(1) == "week":
+                insert_week(connection, model.Week.from_json(json.loads(content)))
+                counts["weeks"] += 1
+            elif matched.group(1) == "day":
+                connection.execute(
+                    "INSERT OR REPLACE INTO days VALUES (?, ?, ?)",
+                    ("%s-%s-%s" % matched.group(2, 3, 4), content, now()),
+                )
+                counts["days"] += 1
+            else:
+                connection.execute(
+                    "INSERT OR REPLACE INTO bulletins VALUES (?, ?, ?)",
+                    ("%s-%s-%s" % matched.group(5, 6, 7), content, now()),
+                )
+                counts["bulletins"] += 1
+    return counts
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Query or maintain the Daily Bulletin artifact store"
+    )
+    parser.add_argument(
+        "--migrate",
+        action="store_true",
+        help="create the store if needed and import the files in the build directory",
+    )
+    parser.add_argument(
+        "--list", action="store_true", help="list the archived bulletins"
+    )
+    parser.add_argument(
+        "--search", default=None, help="list the days whose data contain this"
+    )
+    parser.add_argument("--backup", default=None, help="copy the store to this path")
+    parser.add_argument(
+        "--config", default="config.ini", help="path to the configuration file"
+    )
+    args = parser.parse_args()
+
+    config = ConfigParser()
+    config.read(args.config)
+    if args.backup:
+        args.backup = os.path.abspath(args.backup)
+    os.chdir(config["general"]["build_path"])
+
+    if args.migrate:
+        counts = migrate()
+        logger.info(
+            "Imported %(weeks)d weeks, %(days)d days and %(bulletins)d bulletins"
+            % counts
+        )
+    if not enabled():
+        parser.error("no %s in the build directory" % ARTIFACT_STORE_FILENAME)
+    if args.list:
+        for stddate, size, updated in archive():
+            print("%s %8d %s" % (stddate, size, updated))
+    if args.search is not None:
+        for stddate in search(args.search):
+            print(stddate)
+    if args.backup:
+        backup(args.backup)
+        logger.info("Backed up to %s" % args.backup)
+
+
+if __name__ == "__main__":
+    main()
@@ -17,29 +17,220 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 #
 
+from __future__ import annotations
+from typing import Any, Callable, Container, Optional
 import logging
 import datetime
+import json
 import os
+import zipfile
+import xml.etree.ElementTree as ET
 
-import pptx
-
-from . import common
+from . import cas, common, remotezip, slides
 
 logger = logging.getLogger(__name__)
 
+# Bump this whenever the extraction logic changes, to invalidate parse caches
+TWA_PARSER_VERSION = 2
+
+
+def the_week_ahead_local_filename(datetime_target: datetime.datetime) -> str:
+    # A full download is preferred, but a partial download of just the slide
+    # parts is enough for parsing.
+    the_week_ahead_filename = "the_week_ahead-%s.pptx" % datetime_target.strftime(
+        "%Y%m%d"
+    )
+    if os.path.isfile(the_week_ahead_filename):
+        return the_week_ahead_filename
+    return "the_week_ahead-%s.parts.zip" % datetime_target.strftime("%Y%m%d")
+
+
+def slide_parts(reader: slides.PartReader, entries: Container[str]) -> list[str]:
+    # Every slide is kept so that the slide index can locate the right ones;
+    # slide XML is tiny compared to the images, which are left out.
+    needed = [slides.PRESENTATION_PART, slides.PRESENTATION_RELS_PART]
+    for slide_part_name in slides.slide_part_names(reader):
+        needed.append(slide_part_name)
+        slide_rels_part_name = slides.slide_rels_part_name(slide_part_name)
+        if slide_rels_part_name in entries:
+            needed.append(slide_rels_part_name)
+    return list(dict.fromkeys(needed))
+
+
+def download_the_week_ahead_parts(
+    token: str, the_week_ahead_url: str, local_filename: str
+) -> None:
+    remote_zip = remotezip.RemoteZip(
+        common.get_share_download_url(token, the_week_ahead_url),
+        headers={"Authorization": "Bearer %s" % token},
+    )
+    remote_zip.extract_to_zip(
+        slide_parts(remote_zip, remote_zip.entries), local_filename
+    )
+    logger.info(
+        "Fetched %d bytes of a %d byte The Week Ahead"
+        % (remote_zip.bytes_transferred, remote_zip.size)
+    )
+
 
 def download_or_report_the_week_ahead(
-    token: str, datetime_target: datetime.datetime, the_week_ahead_url: str
+    token: str,
+    datetime_target: datetime.datetime,
+    the_week_ahead_url: str,
 ) -> None:
+    the_week_ahead_filename = the_week_ahead_local_filename(datetime_target)
+    if os.path.isfile(the_week_ahead_filename):
+        logger.info("The Week Ahead already exists at %s" % the_week_ahead_filename)
+        return
+    cache_name = "the_week_ahead-%s" % datetime_target.strftime("%Y%m%d")
+    if cas.fetch_input(cache_name):
+        return
+    logger.info("Downloading slides of The Week Ahead to %s" % the_week_ahead_filename)
+    try:
+        download_the_week_ahead_parts(
+            token, the_week_ahead_url, the_week_ahead_filename
+        )
+    except remotezip.RemoteZipError as e:
+        logger.warning(
+            "Partial download of The Week Ahead failed, downloading all of it: %s" % e
+        )
+    else:
+        cas.store_input(cache_name, the_week_ahead_filename)
+        return
     the_week_ahead_filename = "the_week_ahead-%s.pptx" % datetime_target.strftime(
         "%Y%m%d"
     )
-    if not os.path.isfile(the_week_ahead_filename):
-        logger.info("Downloading The Week Ahead to %s" % the_week_ahead_filename)
-        common.download_share_url(token, the_week_ahead_url, the_week_ahead_filename)
-        assert os.path.isfile(the_week_ahead_filename)
-    else:
-        logger.info("The Week Ahead already exists at %s" % the_week_ahead_filename)
+    logger.info("Downloading The Week Ahead to %s" % the_week_ahead_filename)
+    common.download_share_url(token, the_week_ahead_url, the_week_ahead_filename)
+    assert os.path.isfile(the_week_ahead_filename)
+    cas.store_input(cache_name, the_week_ahead_filename)
+
+
+def slim_the_week_ahead(pptx_filename: str) -> str:
+    # Cuts a full download down to what a partial download would have fetched,
+    # which parses the same, and removes the full download
+    parts_filename = pptx_filename.removesuffix(".pptx") + ".parts.zip"
+    temporary_filename = parts_filename + ".part"
+    try:
+        with zipfile.ZipFile(pptx_filename) as pptx, zipfile.ZipFile(
+            temporary_filename, "w", zipfile.ZIP_DEFLATED
+        ) as parts:
+            for name in slide_parts(pptx, pptx.namelist()):
+                parts.writestr(name, pptx.read(name))
+        os.replace(temporary_filename, parts_filename)
+    except BaseException:
+        if os.path.exists(temporary_filename):
+            os.unlink(temporary_filename)
+        raise
+    os.unlink(pptx_filename)
+    return parts_filename
+
+
+def read_cache(cache_filename: str, cache_key: dict[str, Any]) -> Optional[Any]:
+    try:
+        with open(cache_filename, "r", encoding="utf-8") as fd:
+            cached = json.load(fd)
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        return None
+    if cached.get("key") != cache_key:
+        return None
+    return cached["value"]
+
+
+def write_cache(cache_filename: str, cache_key: dict[str, Any], value: Any) -> None:
+    with open(cache_filename, "w", encoding="utf-8") as fd:
+        json.dump(
+            {"key": cache_key, "value": value}, fd, ensure_ascii=False, indent="\t"
+        )
+
+
+def index_slides(reader: slides.PartReader) -> list[dict[str, Any]]:
+    index = []
+    for slide_part_name in slides.slide_part_names(reader):
+        try:
+            slide = ET.fromstring(reader.read(slide_part_name))
+        except KeyError:
+            # Not fetched in a partial download
+            index.append({"part": slide_part_name, "missing": True})
+            continue
+        headings = []
+        texts = []
+        tables = []
+        for shape in slides.iter_shapes(slide):
+            text = slides.shape_text(shape)
+            if text is not None:
+                texts.append(text)
+                if slides.shape_is_title(shape):
+                    headings.append(text)
+            table = slides.shape_table(shape)
+            if table is not None:
+                rows = slides.table_rows(table)
+                tables.append(
+                    {
+                        "rows": len(rows),
+                        "columns": slides.table_column_count(table),
+                        "first_column": [
+                            slides.cell_runs_text(row[0]).strip() if row else ""
+                            for row in rows
+                        ],
+                    }
+                )
+        index.append(
+            {
+                "part": slide_part_name,
+                "headings": headings,
+                "texts": texts,
+                "tables": tables,
+            }
+        )
+    return index
+
+
+def looks_like_community_time(slide_entry: dict[str, Any]) -> bool:
+    for table in slide_entry.get("tables", []):
+        if table["columns"] not in [4, 5]:
+            continue
+        first_column = " ".join(table["first_column"]).lower()
+        if sum(day in first_column for day in ["mon", "tue", "wed", "thu", "fri"]) >= 2:
+            return True
+        if any("community time" in text.lower() for text in slide_entry["headings"]):
+            return True
+    return False
+
+
+def looks_like_aods(slide_entry: dict[str, Any]) -> bool:
+    return any("monday: " in text.lower() for text in slide_entry.get("texts", []))
+
+
+def locate_page(
+    index: list[dict[str, Any]],
+    configured_page_number: int,
+    signature: Callable[[dict[str, Any]], bool],
+    description: str,
+) -> int:
+    try:
+        if signature(index[configured_page_number]):
+            return configured_page_number
+    except IndexError:
+        pass
+    candidates = [
+        page_number
+        for page_number, slide_entry in enumerate(index)
+        if signature(slide_entry)
+    ]
+    if not candidates:
+        logger.warning(
+            "No slide looks like %s, trying the configured page %d"
+            % (description, configured_page_number)
+        )
+        return configured_page_number
+    if len(candidates) > 1:
+        logger.warning("Several slides look like %s: %s" % (description, candidates))
+    logger.warning(
+        "The configured page %d doesn't look like %s, using page %d instead"
+        % (configured_page_number, description, candidates[0])
+    )
+    return candidates[0]
 
 
 def parse_the_week_ahead(
@@ -47,32 +238,73 @@ def parse_the_week_ahead(
     the_week_ahead_community_time_page_number: int,
     the_week_ahead_aod_page_number: int,
 ) -> tuple[list[list[str]], list[str]]:
-    logger.info("Parsing The Week Ahead")
-    the_week_ahead_filename = "the_week_ahead-%s.pptx" % datetime_target.strftime(
+    the_week_ahead_filename = the_week_ahead_local_filename(datetime_target)
+    cache_filename = "the_week_ahead-%s.parsed.json" % datetime_target.strftime(
         "%Y%m%d"
     )
-    the_week_ahead_presentation = pptx.Presentation(the_week_ahead_filename)
-    community_time = extract_community_time(
-        the_week_ahead_presentation,
-        the_week_ahead_community_time_page_number,
-    )
-    aods = extract_aods(the_week_ahead_presentation, the_week_ahead_aod_page_number)
+    cache_key = {
+        "sha256": common.file_sha256(the_week_ahead_filename),
+        "parser_version": TWA_PARSER_VERSION,
+        "community_time_page_number": the_week_ahead_community_time_page_number,
+        "aod_page_number": the_week_ahead_aod_page_number,
+    }
+    cached = read_cache(cache_filename, cache_key)
+    if cached is not None:
+        logger.info("Using cached parse of The Week Ahead from %s" % cache_filename)
+        return cached["community_time"], cached["aods"]
+    cached = cas.get_parsed("the_week_ahead", cache_key)
+    if cached is not None:
+        write_cache(cache_filename, cache_key, cached)
+        return cached["community_time"], cached["aods"]
+
+    logger.info("Parsing The Week Ahead")
+    with zipfile.ZipFile(the_week_ahead_filename) as the_week_ahead_zip:
+        index_filename = "the_week_ahead-%s.index.json" % datetime_target.strftime(
+            "%Y%m%d"
+        )
+        index_key = {
+            "sha256": cache_key["sha256"],
+            "parser_version": TWA_PARSER_VERSION,
+        }
+        index = read_cache(index_filename, index_key)
+        if index is None:
+            index = index_slides(the_week_ahead_zip)
+            write_cache(index_filename, index_key, index)
+        the_week_ahead_community_time_page_number = locate_page(
+            index,
+            the_week_ahead_community_time_page_number,
+            looks_like_community_time,
+            "the community time table",
+        )
+        the_week_ahead_aod_page_number = locate_page(
+            index, the_week_ahead_aod_page_number, looks_like_aods, "the AODs"
+        )
+        community_time = extract_community_time(
+            slides.load_slide(
+                the_week_ahead_zip, the_week_ahead_community_time_page_number
+            )
+        )
+        aods = extract_aods(
+            slides.load_slide(the_week_ahead_zip, the_week_ahead_aod_page_number)
+        )
+
+    parsed = {"community_time": community_time, "aods": aods}
+    write_cache(cache_filename, cache_key, parsed)
+    cas.put_parsed("the_week_ahead", cache_key, parsed)
     return community_time, aods
 
 
-def extract_community_time(
-    prs: pptx.presentation.Presentation, community_time_page_number: int
-) -> list[list[str]]:
-    slide = prs.slides[community_time_page_number]
-    for shape in slide.shapes:
-        if not shape.has_table:
+def extract_community_time(slide: ET.Element) -> list[list[str]]:
+    for shape in slides.iter_shapes(slide):
+        tbl = slides.shape_table(shape)
+        if tbl is None:
             continue
         break
     else:
         raise ValueError("No shapes")
-    tbl = shape.table
-    row_count = len(tbl.rows)
-    col_count = len(tbl.columns)
+    rows = slides.table_rows(tbl)
+    row_count = len(rows)
+    col_count = slides.table_column_count(tbl)
     if col_count not in [4, 5]:
         raise ValueError(
             "Community time parsing: The Week Ahead community time table does not have 4 or 5 columns"
@@ -86,12 +318,9 @@ def extract_community_time(
 
     for r in range(row_count):
         for c in range(col_count):
-            cell = tbl.cell(r, c)
-            if not cell.is_spanned:
-                t = ""
-                for p in cell.text_frame.paragraphs:
-                    for pr in p.runs:
-                        t += pr.text
+            cell = rows[r][c]
+            if not slides.cell_is_spanned(cell):
+                t = slides.cell_runs_text(cell)
                 t = t.strip()
                 if "whole school assembly" in t.lower():
                     t = "Whole School Assembly"
@@ -102,22 +331,21 @@ def extract_community_time(
                 ):
                     t = "Tutor Time"
                 res[r][c] = t.replace("（", " (").replace("）", ") ").replace("  ", " ")
-                if cell.is_merge_origin:
-                    for sh in range(cell.span_height):
-                        for sw in range(cell.span_width):
+                span_height, span_width = slides.cell_span(cell)
+                if span_height > 1 or span_width > 1:
+                    for sh in range(span_height):
+                        for sw in range(span_width):
                             res[r + sh][c + sw] = t
 
     return [x[1:] for x in res[1:]]
 
 
-def extract_aods(
-    prs: pptx.presentation.Presentation, aod_page_number: int
-) -> list[str]:
-    slide = prs.slides[aod_page_number]
+def extract_aods(slide: ET.Element) -> list[str]:
     aods = ["", "", "", ""]
-    for shape in slide.shapes:
-        if hasattr(shape, "text") and "monday: " in shape.text.lower():
-            slist = shape.text.split("\n")
+    for shape in slides.iter_shapes(slide):
+        text = slides.shape_text(shape)
+        if text is not None and "monday: " in text.lower():
+            slist = text.split("\n")
             for s in slist:
                 try:
                     day, aod = s.split(": ", 1)
@@ -31,7 +31,7 @@
 # TODO: Check The Week Ahead's dates
 
 from __future__ import annotations
-from typing import Any, Iterable, Iterator
+from typing import Any, Callable, Iterable, Iterator, Optional
 from configparser import ConfigParser
 import argparse
 import logging
@@ -44,10 +44,9 @@ import json
 import base64
 import email
 import re
+import time
 
-import requests
-
-from . import common, twa, menu
+from . import cas, common, twa, menu, cal, instrument, model, store, weeks
 
 logger = logging.getLogger(__name__)
 
@@ -67,47 +66,261 @@ def generate(
     graph_password: str,
     graph_scopes: list[str],
     calendar_address: str,
+    calendar_window: Optional[tuple[datetime.datetime, datetime.datetime]] = None,
+    fallback: bool = False,
 ) -> str:
+    # With fallback, Graph failing does not stop the week from being built:
+    # whatever could not be downloaded is carried forward from the last good
+    # week and marked stale, and running this again later patches it
     if not datetime_target.tzinfo:
         raise TypeError("Naive datetimes are unsupported")
     output_filename = "week-%s.json" % datetime_target.strftime("%Y%m%d")
     logger.info("Output filename: %s" % output_filename)
 
-    token = common.acquire_token(
-        graph_client_id, graph_authority, graph_username, graph_password, graph_scopes
-    )
-    twa.download_or_report_the_week_ahead(token, datetime_target, the_week_ahead_url)
-    menu.download_or_report_menu(
-        token,
-        datetime_target,
-        weekly_menu_query_string,
-        weekly_menu_sender,
-        weekly_menu_subject_regex,
-        weekly_menu_subject_regex_four_groups,
-    )
-    community_time, aods = twa.parse_the_week_ahead(
+    token: Optional[str]
+    try:
+        with instrument.stage("login"):
+            token = common.acquire_token(
+                graph_client_id,
+                graph_authority,
+                graph_username,
+                graph_password,
+                graph_scopes,
+            )
+    except Exception:
+        if not fallback:
+            raise
+        logger.exception("Logging in failed, using only the inputs already here")
+        token = None
+    if token is None:
+        # Nothing can be downloaded, but the shared cache may have them
+        if not os.path.isfile(twa.the_week_ahead_local_filename(datetime_target)):
+            cas.fetch_input("the_week_ahead-%s" % datetime_target.strftime("%Y%m%d"))
+        if not os.path.isfile("menu-%s.xlsx" % datetime_target.strftime("%Y%m%d")):
+            cas.fetch_input("menu-%s" % datetime_target.strftime("%Y%m%d"))
+    else:
+        calendar_window = covering_calendar_window(
+            calendar_window,
+            datetime_target,
+            datetime_target + datetime.timedelta(days=7),
+        )
+        try:
+            with instrument.stage("calendar_sync"):
+                cal.sync_calendar(token, calendar_address, *calendar_window)
+        except Exception:
+            logger.exception("Calendar sync failed, continuing without it")
+        download(
+            "download_the_week_ahead",
+            fallback,
+            twa.download_or_report_the_week_ahead,
+            token,
+            datetime_target,
+            the_week_ahead_url,
+        )
+        download(
+            "download_menu",
+            fallback,
+            menu.download_or_report_menu,
+            token,
+            datetime_target,
+            weekly_menu_query_string,
+            weekly_menu_sender,
+            weekly_menu_subject_regex,
+            weekly_menu_subject_regex_four_groups,
+        )
+    return build_week(
         datetime_target,
         the_week_ahead_community_time_page_number,
         the_week_ahead_aod_page_number,
+        fallback=fallback,
     )
-    menu_data = menu.parse_menus(datetime_target)
-    snack_data = menu.parse_snacks(datetime_target)
+
+
+def school_year_window(
+    datetime_target: datetime.datetime,
+) -> tuple[datetime.datetime, datetime.datetime]:
+    # From the August 1 before the target to the one after it
+    year = datetime_target.year - (1 if datetime_target.month < 8 else 0)
+    start = datetime_target.replace(
+        year=year, month=8, day=1, hour=0, minute=0, second=0, microsecond=0
+    )
+    return start, start.replace(year=year + 1)
+
+
+def covering_calendar_window(
+    calendar_window: Optional[tuple[datetime.datetime, datetime.datetime]],
+    start: datetime.datetime,
+    end: datetime.datetime,
+) -> tuple[datetime.datetime, datetime.datetime]:
+    # The calendar store only syncs changes while its window stays the same,
+    # so the window is the configured one, or the school year, and never
+    # derived from the week
+    if calendar_window is not None:
+        if calendar_window[0] <= start and end <= calendar_window[1]:
+            return calendar_window
+        logger.warning(
+            "The calendar window does not cover %s to %s, syncing the school year"
+            % (start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"))
+        )
+    window = school_year_window(start)
+    if end > window[1]:
+        window = (window[0], school_year_window(end)[1])
+    return window
+
+
+def download(
+    stage_name: str,
+    fallback: bool,
+    function: Callable[..., None],
+    *arguments: Any,
+) -> None:
+    # With fallback, a failed download leaves build_week without that input
+    with instrument.stage(stage_name):
+        try:
+            function(*arguments)
+        except Exception:
+            if not fallback:
+                raise
+            logger.exception("%s failed, falling back to an earlier week" % stage_name)
+
+
+def build_week(
+    datetime_target: datetime.datetime,
+    the_week_ahead_community_time_page_number: int,
+    the_week_ahead_aod_page_number: int,
+    register: bool = True,
+    parallel: bool = True,
+    fallback: bool = False,
+) -> str:
+    # Everything after the downloads, which only needs the local files.
+    # Without register, the caller adds the week to the manifest itself.
+    # The parsers run in a process each unless parallel is off, e.g. when
+    # the caller already runs weeks in parallel. With fallback, sections
+    # whose input is missing come from the last good week instead.
+    output_filename = "week-%s.json" % datetime_target.strftime("%Y%m%d")
+    parsers: dict[str, tuple[Callable[..., Any], tuple[Any, ...]]] = {}
+    stale = []
+    if not fallback or os.path.isfile(
+        twa.the_week_ahead_local_filename(datetime_target)
+    ):
+        parsers["parse_the_week_ahead"] = (
+            twa.parse_the_week_ahead,
+            (
+                datetime_target,
+                the_week_ahead_community_time_page_number,
+                the_week_ahead_aod_page_number,
+            ),
+        )
+    else:
+        stale += ["community_time", "aods"]
+    if not fallback or os.path.isfile(
+        "menu-%s.xlsx" % datetime_target.strftime("%Y%m%d")
+    ):
+        parsers["parse_menu"] = (menu.parse_menu_workbook, (datetime_target,))
+    else:
+        stale.append("menu")
+    previous = None
+    if stale:
+        previous = weeks.last_good_week(datetime_target.date(), stale)
+        if previous is None:
+            raise common.DailyBulletinError(
+                "No %s for this week and no earlier week to fall back on"
+                % ", ".join(stale)
+            )
+        logger.warning(
+            "Carrying %s forward from the week of %s"
+            % (", ".join(stale), previous.start_date.isoformat())
+        )
+        instrument.note("stale", stale)
+    with instrument.stage("parse"):
+        results = run_parsers(parsers, parallel) if parsers else {}
 
     logger.info("Packing final data")
-    final_data = {
-        "start_date": datetime_target.strftime("%Y-%m-%d"),
-        "community_time": community_time,
-        "aods": aods,
-        "menu": menu_data,
-        "snacks": snack_data,
-    }
+    if "parse_the_week_ahead" in results:
+        community_time, aods = results["parse_the_week_ahead"]
+    else:
+        assert previous is not None
+        # The previous week's structure, to be patched when it can be fetched
+        community_time, aods = previous.community_time, previous.aods
+    if "parse_menu" in results:
+        menu_data, snacks = results["parse_menu"]
+        meals = {
+            meal_name: {
+                weekday: model.Meal.from_json(meal)
+                for weekday, meal in meal_days.items()
+            }
+            for meal_name, meal_days in menu_data.items()
+        }
+    else:
+        assert previous is not None
+        meals, snacks = previous.meals, previous.snacks
+    week = model.Week(
+        start_date=datetime_target.date(),
+        community_time=community_time,
+        aods=aods,
+        meals=meals,
+        snacks=snacks,
+        stale=stale,
+    )
 
     logger.info("Dumping data to: %s" % output_filename)
-    with open(output_filename, "w", encoding="utf-8") as fd:
-        json.dump(final_data, fd, ensure_ascii=False, indent="\t")
+    with instrument.stage("write"):
+        with open(output_filename, "w", encoding="utf-8") as fd:
+            json.dump(week.to_json(), fd, ensure_ascii=False, indent="\t")
+    if register:
+        weeks.register(output_filename, week)
+    if store.enabled():
+        store.put_week(week)
     return output_filename
 
 
+def timed(function: Callable[..., Any], *arguments: Any) -> tuple[Any, float]:
+    start = time.perf_counter()
+    return function(*arguments), time.perf_counter() - start
+
+
+def run_parsers(
+    parsers: dict[str, tuple[Callable[..., Any], tuple[Any, ...]]],
+    parallel: bool,
+) -> dict[str, Any]:
+    # Only the parsed structures come back from the workers. Every parser
+    # runs to the end, so that all failures are reported together.
+    outcomes = {}
+    failures = {}
+    # On a single CPU the workers would only take turns
+    if parallel and common.available_cpus() > 1:
+        import concurrent.futures
+
+        with concurrent.futures.ProcessPoolExecutor(len(parsers)) as executor:
+            futures = {
+                name: executor.submit(timed, function, *arguments)
+                for name, (function, arguments) in parsers.items()
+            }
+            for name, future in futures.items():
+                try:
+                    outcomes[name] = future.result()
+                except Exception as e:
+                    failures[name] = e
+    else:
+        for name, (function, arguments) in parsers.items():
+            try:
+                outcomes[name] = timed(function, *arguments)
+            except Exception as e:
+                failures[name] = e
+
+    for name, error in failures.items():
+        logger.error("%s failed" % name, exc_info=error)
+    if failures:
+        raise common.DailyBulletinError(
+            "; ".join("%s: %s" % (name, error) for name, error in failures.items())
+        )
+    results = {}
+    for name, (result, seconds) in outcomes.items():
+        instrument.note("%s_seconds" % name, round(seconds, 3))
+        results[name] = result
+    return results
+
+
 def main() -> None:
     logging.basicConfig(level=logging.INFO)
     parser = argparse.ArgumentParser(description="Weekly script for the Daily Bulletin")
@@ -116,9 +329,23 @@ def main() -> None:
         default=None,
         help="the start of the week to generate for, in local time, YYYY-MM-DD; defaults to next Monday",
     )
+    parser.add_argument(
+        "--fallback",
+        action="store_true",
+        help="if a download fails, carry its sections forward from the last good week and mark them stale",
+    )
     parser.add_argument(
         "--config", default="config.ini", help="path to the configuration file"
     )
+    parser.add_argument(
+        "--profile", action="store_true", help="dump a cProfile of this run"
+    )
+    parser.add_argument(
+        "--no-trace-memory",
+        dest="trace_memory",
+        action="store_false",
+        help="leave peak memory out of the run report, which is faster",
+    )
     args = parser.parse_args()
 
     if args.date:
@@ -142,7 +369,27 @@ def main() -> None:
     build_path = config["general"]["build_path"]
     # TODO: check if the build path exists and create it if it doesn't
     os.chdir(build_path)
+    common.install_graph_transport(config)
+    cas.install(config)
+
+    # TODO: Validate the configuration
 
+    with instrument.run(
+        "weekly",
+        profile=args.profile,
+        trace_memory=args.trace_memory,
+        metrics_directory=config.get("metrics", "textfile_directory", fallback=None),
+    ):
+        generate(
+            datetime_target=datetime_target_aware,
+            fallback=args.fallback,
+            **generate_arguments(config),
+        )
+
+
+def generate_arguments(config: ConfigParser) -> dict[str, Any]:
+    # Everything generate() needs besides the date, as configured
+    tzinfo = zoneinfo.ZoneInfo(config["general"]["timezone"])
     the_week_ahead_url = config["the_week_ahead"]["file_url"]
     the_week_ahead_community_time_page_number = int(
         config["the_week_ahead"]["community_time_page_number"]
@@ -168,25 +415,50 @@ def main() -> None:
     graph_scopes = config["credentials"]["scope"].split(" ")
 
     calendar_address = config["calendar"]["address"]
+    calendar_window: Optional[tuple[datetime.datetime, datetime.datetime]]
+    if config.has_option("calendar", "window_start") and config.has_option(
+        "calendar", "window_end"
+    ):
+        calendar_window = (
+            datetime.datetime.strptime(
+                config["calendar"]["window_start"], "%Y-%m-%d"
+            ).replace(tzinfo=tzinfo),
+            datetime.datetime.strptime(
+                config["calendar"]["window_end"], "%Y-%m-%d"
+            ).replace(tzinfo=tzinfo),
+        )
+    elif config.has_option("cycle", "term_start") and config.has_option(
+        "cycle", "term_end"
+    ):
+        # The term, up to the end of its last day
+        calendar_window = (
+            datetime.datetime.strptime(
+                config["cycle"]["term_start"], "%Y-%m-%d"
+            ).replace(tzinfo=tzinfo),
+            datetime.datetime.strptime(config["cycle"]["term_end"], "%Y-%m-%d").replace(
+                tzinfo=tzinfo
+            )
+            + datetime.timedelta(days=1),
+        )
+    else:
+        calendar_window = None
 
-    # TODO: Validate the configuration
-
-    generate(
-        datetime_target=datetime_target_aware,
-        the_week_ahead_url=the_week_ahead_url,
-        the_week_ahead_community_time_page_number=the_week_ahead_community_time_page_number,
-        the_week_ahead_aod_page_number=the_week_ahead_aod_page_number,
-        weekly_menu_query_string=weekly_menu_query_string,
-        weekly_menu_sender=weekly_menu_sender,
-        weekly_menu_subject_regex=weekly_menu_subject_regex,
-        weekly_menu_subject_regex_four_groups=weekly_menu_subject_regex_four_groups,
-        graph_client_id=graph_client_id,
-        graph_authority=graph_authority,
-        graph_username=graph_username,
-        graph_password=graph_password,
-        graph_scopes=graph_scopes,
-        calendar_address=calendar_address,
-    )
+    return {
+        "the_week_ahead_url": the_week_ahead_url,
+        "the_week_ahead_community_time_page_number": the_week_ahead_community_time_page_number,
+        "the_week_ahead_aod_page_number": the_week_ahead_aod_page_number,
+        "weekly_menu_query_string": weekly_menu_query_string,
+        "weekly_menu_sender": weekly_menu_sender,
+        "weekly_menu_subject_regex": weekly_menu_subject_regex,
+        "weekly_menu_subject_regex_four_groups": weekly_menu_subject_regex_four_groups,
+        "graph_client_id": graph_client_id,
+        "graph_authority": graph_authority,
+        "graph_username": graph_username,
+        "graph_password": graph_password,
+        "graph_scopes": graph_scopes,
+        "calendar_address": calendar_address,
+        "calendar_window": calendar_window,
+    }
 
 
 if __name__ == "__main__":
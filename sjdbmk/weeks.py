@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+#
+# Week manifest for the Daily Bulletin Build System
+# Copyright (C) 2024 Runxi Yu <https://runxiyu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# weeks.json maps every date covered by a week file to that file and to the
+# day's offset into it, so finding the week of a day is one lookup instead of
+# trying the five days before it. weekly registers each week file it writes;
+# a week covers as many school days as its Community Time or AODs have rows,
+# and at least five. Offsets count school days, as those rows do, so a week
+# starting on a Wednesday runs across the weekend into the next week. Where
+# weeks overlap, the one that starts later wins, as it did before. Writers
+# hold a lock on weeks.json.lock, so concurrent runs do not drop each
+# other's weeks.
+#
+# Week files written before the manifest are still found by the old search,
+# or it can be rebuilt from them with:
+#     python3 -m sjdbmk.weeks --rebuild
+# Compressed week files are read as they are, and weeks whose files are gone
+# are looked up in the artifact store, if any.
+#
+
+from __future__ import annotations
+from typing import Any, Iterator, Optional
+import argparse
+import contextlib
+import datetime
+import fcntl
+import functools
+import json
+import logging
+import os
+import tempfile
+from configparser import ConfigParser
+
+from . import model, retention
+
+logger = logging.getLogger(__name__)
+
+WEEK_MANIFEST_FILENAME = "weeks.json"
+WEEK_MANIFEST_LOCK_FILENAME = "weeks.json.lock"
+MINIMUM_WEEK_DAYS = 5
+
+
+def week_days(week: model.Week) -> int:
+    return max(MINIMUM_WEEK_DAYS, len(week.community_time), len(week.aods))
+
+
+def school_dates(start_date: datetime.date, days: int) -> Iterator[datetime.date]:
+    # The first days weekdays on or after start_date
+    day = start_date
+    while days > 0:
+        if day.weekday() < 5:
+            yield day
+            days -= 1
+        day += datetime.timedelta(days=1)
+
+
+def school_day_offset(start_date: datetime.date, day: datetime.date) -> Optional[int]:
+    # How many weekdays from start_date come before the day, or None if the
+    # day is not a weekday on or after start_date
+    if day < start_date or day.weekday() >= 5:
+        return None
+    offset = 0
+    while start_date < day:
+        if start_date.weekday() < 5:
+            offset += 1
+        start_date += datetime.timedelta(days=1)
+    return offset
+
+
+def index_dates(weeks: dict[str, dict[str, Any]]) -> dict[str, list[Any]]:
+    dates: dict[str, list[Any]] = {}
+    for week_filename, week in sorted(
+        weeks.items(), key=lambda item: item[1]["start_date"]
+    ):
+        for offset, day in enumerate(
+            school_dates(datetime.date.fromisoformat(week["start_date"]), week["days"])
+        ):
+            dates[day.isoformat()] = [week_filename, offset]
+    return dates
+
+
+@contextlib.contextmanager
+def manifest_lock() -> Iterator[None]:
+    # Held around reading and replacing the manifest
+    with open(WEEK_MANIFEST_LOCK_FILENAME, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def write_manifest(weeks: dict[str, dict[str, Any]]) -> None:
+    fd, temporary_filename = tempfile.mkstemp(prefix=".weeks-", dir=".")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as manifest_file:
+            json.dump(
+                {"weeks": weeks, "dates": index_dates(weeks)},
+                manifest_file,
+                indent="\t",
+            )
+        os.replace(temporary_filename, WEEK_MANIFEST_FILENAME)
+    except BaseException:
+        os.unlink(temporary_filename)
+        raise
+
+
+def read_manifest() -> dict[str, Any]:
+    try:
+        stat = os.stat(WEEK_MANIFEST_FILENAME)
+    except FileNotFoundError:
+        return {"weeks": {}, "dates": {}}
+    return _read_manifest(
+        os.path.abspath(WEEK_MANIFEST_FILENAME), stat.st_mtime_ns, stat.st_ino
+    )
+
+
+@functools.lru_cache(maxsize=4)
+def _read_manifest(path: str, mtime_ns: int, inode: int) -> dict[str, Any]:
+    # Keyed on the inode too, as every write replaces the file
+    try:
+        with open(path, "r", encoding="utf-8") as fd:
+            manifest = json.load(fd)
+    except json.decoder.JSONDecodeError:
+        logger.warning("Week manifest %s is corrupt, ignoring it" % path)
+        return {"weeks": {}, "dates": {}}
+    assert isinstance(manifest, dict)
+    return manifest
+
+
+def register(week_filename: str, week: model.Week) -> None:
+    # Called with the week file already written
+    with manifest_lock():
+        weeks = {
+            filename: week
+            for filename, week in read_manifest()["weeks"].items()
+            if filename != week_filename and retention.exists(filename)
+        }
+        weeks[week_filename] = {
+            "start_date": week.start_date.isoformat(),
+            "days": week_days(week),
+        }
+        write_manifest(weeks)
+
+
+def rebuild() -> int:
+    with manifest_lock():
+        weeks = {}
+        for filename in sorted(os.listdir()):
+            week_filename = filename.removesuffix(retention.COMPRESSED_SUFFIX)
+            if not (
+                week_filename.startswith("week-") and week_filename.endswith(".json")
+            ):
+                continue
+            week = read_week(week_filename)
+            weeks[week_filename] = {
+                "start_date": week.start_date.isoformat(),
+                "days": week_days(week),
+            }
+        write_manifest(weeks)
+    return len(weeks)
+
+
+def last_good_week(before: datetime.date, sections: list[str]) -> Optional[model.Week]:
+    # The latest week starting before the day with none of the sections stale
+    for week_filename, entry in sorted(
+        read_manifest()["weeks"].items(),
+        key=lambda item: item[1]["start_date"],
+        reverse=True,
+    ):
+        if entry["start_date"] >= before.isoformat() or not retention.exists(
+            week_filename
+        ):
+            continue
+        week = read_week(week_filename)
+        if not set(sections) & set(week.stale):
+            return week
+    return None
+
+
+def find_week(datetime_target: datetime.datetime) -> tuple[str, int]:
+    # The week file covering the day, and how many days into that week it is
+    entry = read_manifest()["dates"].get(datetime_target.strftime("%Y-%m-%d"))
+    if entry and retention.exists(entry[0]):
+        return entry[0], entry[1]
+    # Week files missing from the manifest, within a week of the day
+    for days_back in range(0, 7):
+        week_start_date = datetime_target - datetime.timedelta(days=days_back)
+        week_filename = "week-%s.json" % week_start_date.strftime("%Y%m%d")
+        offset = school_day_offset(week_start_date.date(), datetime_target.date())
+        if (
+            offset is not None
+            and offset < MINIMUM_WEEK_DAYS
+            and retention.exists(week_filename)
+        ):
+            return week_filename, offset
+    from . import store
+
+    if store.enabled():
+        stored = store.week_for(datetime_target.date())
+        if stored:
+            return "week-%s.json" % stored[0].strftime("%Y%m%d"), stored[1]
+    raise FileNotFoundError(
+        "Cannot find a week-{date}.json file without five prior days"
+    )
+
+
+def read_week(week_filename: str) -> model.Week:
+    # Parsed once per version of the file; do not modify the result
+    try:
+        path = retention.existing_path(week_filename) or week_filename
+        stat = os.stat(path)
+    except FileNotFoundError:
+        from . import store
+
+        if not store.enabled():
+            raise
+        start_date = datetime.datetime.strptime(week_filename, "week-%Y%m%d.json")
+        week = store.get_week(start_date.date())
+        if week is None:
+            raise
+        return week
+    return _read_week(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=16)
+def _read_week(path: str, mtime_ns: int, size: int) -> model.Week:
+    with retention.open_artifact(path.removesuffix(retention.COMPRESSED_SUFFIX)) as fd:
+        return model.Week.from_json(json.load(fd))
+
+
+def school_days(
+    first: datetime.datetime, last: datetime.datetime
+) -> list[datetime.datetime]:
+    days = []
+    day = first
+    while day <= last:
+        if day.weekday() < 5:
+            days.append(day)
+        day += datetime.timedelta(days=1)
+    return days
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Show or rebuild the manifest of Daily Bulletin week files"
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="rebuild the manifest from the week files in the build directory",
+    )
+    parser.add_argument(
+        "--config", default="config.ini", help="path to the configuration file"
+    )
+    args = parser.parse_args()
+
+    config = ConfigParser()
+    config.read(args.config)
+    os.chdir(config["general"]["build_path"])
+
+    if args.rebuild:
+        logger.info("Registered %d week files" % rebuild())
+    for date, (week_filename, offset) in read_manifest()["dates"].items():
+        print("%s %s +%d" % (date, week_filename, offset))
+
+
+if __name__ == "__main__":
+    main()